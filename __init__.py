@@ -16,6 +16,12 @@ import poemods_threads
 modifyggpk = "C:\\Program Files (x86)\\Grinding Gear Games\\Path of Exile\\Content.ggpk"
 defragggpk = "C:\\Program Files (x86)\\Grinding Gear Games\\Path of Exile\\Content.ggpk.defrag"
 windowgeometry="866x714+0+0"
+# threads decompressing the blocks of a bundle, 0 for one per core
+decodethreads="1"
+# Kraken level of the modified bundle blocks, 1 to 9 from fastest to smallest, 0 to store them uncompressed
+compresslevel="4"
+# memory kept for the decompressed bundle blocks read again, in MB
+blockcachemb="64"
 configfile="poemods_config.txt"
 
 actionqueue=queue.Queue()
@@ -176,9 +182,12 @@ def savedefaultpath():
         confout.write("PoEFile="+modifyggpk+"\n")
         confout.write("DefragmentedFile="+defragggpk+"\n")
         confout.write("Geometry="+windowgeometry+"\n")
+        confout.write("DecodeThreads="+decodethreads+"\n")
+        confout.write("CompressLevel="+compresslevel+"\n")
+        confout.write("BlockCacheMB="+blockcachemb+"\n")
 
 def getdefaultpath():
-    global modifyggpk, defragggpk, windowgeometry
+    global modifyggpk, defragggpk, windowgeometry, decodethreads, compresslevel, blockcachemb
     if os.path.exists(configfile) :
         with open(configfile, "r", encoding="utf-8") as fin :
             for line in fin :
@@ -193,6 +202,12 @@ def getdefaultpath():
                 elif re.search(r'Geometry=', line) is not None :
                     windowgeometry = re.sub(r'.*=(.*?)[\n$]', r'\1', line)
                     root.geometry(windowgeometry)
+                elif re.search(r'DecodeThreads=', line) is not None :
+                    decodethreads = re.sub(r'.*=(.*?)[\n$]', r'\1', line)
+                elif re.search(r'CompressLevel=', line) is not None :
+                    compresslevel = re.sub(r'.*=(.*?)[\n$]', r'\1', line)
+                elif re.search(r'BlockCacheMB=', line) is not None :
+                    blockcachemb = re.sub(r'.*=(.*?)[\n$]', r'\1', line)
     else :
         savedefaultpath()
 
@@ -549,6 +564,12 @@ def quitcallback():
     root.destroy()
 
 getdefaultpath()
+if decodethreads.isdigit() is True :
+    actionqueue.put(["decode threads", int(decodethreads)])
+if compresslevel.isdigit() is True :
+    actionqueue.put(["compress level", int(compresslevel)])
+if blockcachemb.isdigit() is True :
+    actionqueue.put(["block cache", int(blockcachemb)])
 # force rescan in case of errors
 # actionqueue.put(["scan modg", modifyggpk ,True])
 actionqueue.put(["scan modg", modifyggpk ,False])
@@ -18,6 +18,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 #include "stdafx.h"
 #include <sys/stat.h>
+#include <vector>
+#include <thread>
+#include <atomic>
+#include <algorithm>
 
 #if defined _WIN32 || defined __CYGWIN__
 #ifdef OOZ_DYNAMIC
@@ -4158,26 +4162,37 @@ bool Kraken_DecodeStep(struct KrakenDecoder *dec,
   return true;
 }
 
-int Kraken_Decompress(const byte *src, size_t src_len, byte *dst, size_t dst_len) {
-  KrakenDecoder *dec = Kraken_Create();
+// Resets a decoder so it can decode another stream, the scratch memory is kept.
+void Kraken_Reset(KrakenDecoder *dec) {
+  byte *scratch = dec->scratch;
+  size_t scratch_size = dec->scratch_size;
+  memset(dec, 0, sizeof(KrakenDecoder));
+  dec->scratch = scratch;
+  dec->scratch_size = scratch_size;
+}
+
+int Kraken_DecompressWith(KrakenDecoder *dec, const byte *src, size_t src_len, byte *dst, size_t dst_len) {
   int offset = 0;
   while (dst_len != 0) {
     if (!Kraken_DecodeStep(dec, dst, offset, dst_len, src, src_len))
-      goto FAIL;
+      return -1;
     if (dec->src_used == 0)
-      goto FAIL;
+      return -1;
     src += dec->src_used;
     src_len -= dec->src_used;
     dst_len -= dec->dst_used;
     offset += dec->dst_used;
   }
   if (src_len != 0)
-    goto FAIL;
-  Kraken_Destroy(dec);
+    return -1;
   return offset;
-FAIL:
+}
+
+int Kraken_Decompress(const byte *src, size_t src_len, byte *dst, size_t dst_len) {
+  KrakenDecoder *dec = Kraken_Create();
+  int offset = Kraken_DecompressWith(dec, src, src_len, dst, dst_len);
   Kraken_Destroy(dec);
-  return -1;
+  return offset;
 }
 
 extern "C" {
@@ -4194,6 +4209,177 @@ extern "C" {
 // The decompressor will write outside of the target buffer.
 #define SAFE_SPACE 64
 
+// Bundles of the Bundles2 folder, little endian :
+//   0:60     header, 20:28 uncompressed size, 36:40 block count, 40:44 uncompressed size of a block
+//   60:      compressed size of every block, u32 each
+//   then     the blocks, a block starting with 0xcc is stored as is after its two bytes header
+struct BundleBlock {
+  const byte *src;
+  size_t src_len;
+  uint64 start; // uncompressed offset of the block in the bundle
+  size_t len;   // uncompressed size of the block
+};
+
+// Decoder and scratch output kept by each thread, a bundle has thousands of blocks.
+struct BundleThreadState {
+  KrakenDecoder *dec = NULL;
+  std::vector<byte> tmp;
+  ~BundleThreadState() {
+    if (dec)
+      Kraken_Destroy(dec);
+  }
+};
+
+static BundleThreadState &Bundle_ThreadState() {
+  static thread_local BundleThreadState state;
+  if (!state.dec)
+    state.dec = Kraken_Create();
+  return state;
+}
+
+// Writes the part of |b| inside [range_start, range_end) to |dst|, which holds the range.
+// A block fully inside the range is decoded in place and may write SAFE_SPACE bytes after it,
+// a block cut by the range is decoded aside and copied.
+static bool Bundle_DecodeBlock(const BundleBlock &b, uint64 range_start, uint64 range_end, byte *dst) {
+  uint64 from = std::max<uint64>(b.start, range_start);
+  uint64 to = std::min<uint64>(b.start + b.len, range_end);
+  if (b.src_len >= 1 && b.src[0] == 0xcc) {
+    if (b.src_len < 2 + b.len)
+      return false;
+    memcpy(dst + (from - range_start), b.src + 2 + (from - b.start), to - from);
+    return true;
+  }
+  BundleThreadState &state = Bundle_ThreadState();
+  Kraken_Reset(state.dec);
+  if (from == b.start && to == b.start + b.len)
+    return Kraken_DecompressWith(state.dec, b.src, b.src_len, dst + (b.start - range_start), b.len) == (int)b.len;
+  if (state.tmp.size() < b.len + SAFE_SPACE)
+    state.tmp.resize(b.len + SAFE_SPACE);
+  if (Kraken_DecompressWith(state.dec, b.src, b.src_len, state.tmp.data(), b.len) != (int)b.len)
+    return false;
+  memcpy(dst + (from - range_start), state.tmp.data() + (from - b.start), to - from);
+  return true;
+}
+
+// Decodes blocks[first], blocks[first + 2], ... on |threads| threads.
+static bool Bundle_DecodeEvery(const std::vector<BundleBlock> &blocks, size_t first, size_t step,
+                               uint64 range_start, uint64 range_end, byte *dst, int threads) {
+  size_t count = blocks.size() > first ? (blocks.size() - first + step - 1) / step : 0;
+  std::atomic<size_t> next(0);
+  std::atomic<bool> ok(true);
+  auto work = [&]() {
+    for (size_t i; (i = next.fetch_add(1)) < count && ok; ) {
+      if (!Bundle_DecodeBlock(blocks[first + i * step], range_start, range_end, dst))
+        ok = false;
+    }
+  };
+  if (threads > (int)count)
+    threads = (int)count;
+  std::vector<std::thread> pool;
+  for (int i = 1; i < threads; i++)
+    pool.emplace_back(work);
+  work();
+  for (std::thread &t : pool)
+    t.join();
+  return ok;
+}
+
+// Decodes [range_start, range_start + range_len) of a whole bundle into |dst|, which must have
+// SAFE_SPACE bytes after the range. Only the blocks holding the range are decoded, by |threads|
+// threads (0 for one per core). Returns the number of bytes written or -1.
+static int64_t Bundle_Decompress(const uint8_t *bundle, size_t bundle_len, uint64_t range_start, uint64_t range_len,
+                                uint8_t *dst, int threads) {
+  if (bundle_len < 60)
+    return -1;
+  uint64 size = *(uint64*)(bundle + 20);
+  uint32 block_count = *(uint32*)(bundle + 36);
+  uint32 block_size = *(uint32*)(bundle + 40);
+  if (block_size == 0 || 60 + 4 * (uint64)block_count > bundle_len)
+    return -1;
+  if (range_start >= size)
+    return 0;
+  uint64 range_end = std::min<uint64>(range_start + range_len, size);
+  const uint32 *sizes = (const uint32*)(bundle + 60);
+  const byte *src = bundle + 60 + 4 * (size_t)block_count;
+  const byte *src_end = bundle + bundle_len;
+  std::vector<BundleBlock> blocks;
+  uint64 start = 0;
+  for (uint32 i = 0; i < block_count && start < range_end; i++) {
+    if ((size_t)(src_end - src) < sizes[i])
+      return -1;
+    size_t len = (size_t)std::min<uint64>(block_size, size - start);
+    if (start + len > range_start)
+      blocks.push_back(BundleBlock{ src, sizes[i], start, len });
+    src += sizes[i];
+    start += len;
+  }
+  if (start < range_end)
+    return -1;
+  if (threads <= 0)
+    threads = (int)std::thread::hardware_concurrency();
+  if (threads <= 1 || blocks.size() < 2) {
+    // in order, a block overwrites what the previous one wrote after its end
+    if (!Bundle_DecodeEvery(blocks, 0, 1, range_start, range_end, dst, 1))
+      return -1;
+  } else {
+    // the odd blocks first, their start is saved before the even blocks write over it
+    if (!Bundle_DecodeEvery(blocks, 1, 2, range_start, range_end, dst, threads))
+      return -1;
+    std::vector<byte> heads(SAFE_SPACE * blocks.size());
+    for (size_t i = 1; i < blocks.size(); i += 2) {
+      uint64 from = std::max<uint64>(blocks[i].start, range_start);
+      memcpy(&heads[SAFE_SPACE * i], dst + (from - range_start), (size_t)std::min<uint64>(SAFE_SPACE, range_end - from));
+    }
+    if (!Bundle_DecodeEvery(blocks, 0, 2, range_start, range_end, dst, threads))
+      return -1;
+    for (size_t i = 1; i < blocks.size(); i += 2) {
+      uint64 from = std::max<uint64>(blocks[i].start, range_start);
+      memcpy(dst + (from - range_start), &heads[SAFE_SPACE * i], (size_t)std::min<uint64>(SAFE_SPACE, range_end - from));
+    }
+  }
+  return (int64_t)(range_end - range_start);
+}
+
+extern "C" {
+    OOZ_DLL_PUBLIC int64_t Ooz_DecompressBundle(
+          uint8_t const* bundle,
+          size_t bundle_len,
+          uint64_t range_start,
+          uint64_t range_len,
+          uint8_t* dst,
+          int threads
+    ) {
+        return Bundle_Decompress(bundle, bundle_len, range_start, range_len, dst, threads);
+    }
+}
+
+// Compressors of compress.cpp, codec 8 Kraken, 9 Mermaid, 11 Selkie, 13 Leviathan.
+// The output of one call is a block as found in a bundle, it is read back by Ooz_Decompress.
+struct CompressOptions;
+struct LRMCascade;
+int CompressBlock(int codec_id, uint8 *src_in, uint8 *dst_in, int src_size, int level,
+                  const CompressOptions *compressopts, uint8 *src_window_base, LRMCascade *lrm);
+int GetCompressedBufferSizeNeeded(int size);
+
+extern "C" {
+    OOZ_DLL_PUBLIC int Ooz_CompressBound(int src_len) {
+        return GetCompressedBufferSizeNeeded(src_len);
+    }
+
+    OOZ_DLL_PUBLIC int Ooz_Compress(
+          int codec,
+          uint8_t const* src_buf,
+          int src_len,
+          uint8_t* dst,
+          size_t dst_size,
+          int level
+    ) {
+        if (src_len < 0 || dst_size < (size_t)GetCompressedBufferSizeNeeded(src_len))
+            return -1;
+        return CompressBlock(codec, (uint8 *)src_buf, dst, src_len, level, NULL, NULL, NULL);
+    }
+}
+
 #if !OOZ_BUILD_DLL
 
 void error(const char *s, const char *curfile = NULL) {
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+import threading
+from operator import itemgetter
+
+# files written by one action, kept in memory and written together :
+# the files of a bundle are placed one after the other and the bundle is patched and compressed once,
+# bundles and files outside bundles are written in the order of their position in the ggpk,
+# the index is written back once at the end
+# a batch larger than budget bytes is applied before the action ends, add tells when
+# without keeporiginals the files outside bundles are written without storing what they replace to keep/,
+# as when the originals are written back
+class writebatch(object):
+  def __init__(self, modg, budget=256 * 1024 * 1024, keeporiginals=True):
+    self.modg = modg
+    self.budget = budget
+    self.keeporiginals = keeporiginals
+    self.files = {}
+    self.size = 0
+    self.lock = threading.Lock()
+
+  def add(self, filename, data):
+    # data has no header, the last data added for a file is the one written
+    with self.lock :
+      if filename in self.files :
+        self.size -= len(self.files[filename])
+      self.files[filename] = data
+      self.size += len(data)
+      return self.size > self.budget
+
+  def apply(self, ggpkpointer):
+    # write the files added so far, the number of files written
+    with self.lock :
+      files = self.files
+      self.files = {}
+      self.size = 0
+    bundles = {}
+    loose = []
+    for filename in files :
+      fileinfo = self.modg.fullfilelistdic[filename]
+      if "bundlename" in fileinfo :
+        bundles.setdefault(fileinfo["bundlename"], []).append(filename)
+      else :
+        loose.append([fileinfo["position"], filename])
+    for bundlename in sorted(bundles, key=lambda bundlename : self.modg.fullfilelistdic[bundlename]["position"]) :
+      # in the order of their current position in the bundle
+      filenames = sorted(bundles[bundlename], key=lambda filename : self.modg.fullfilelistdic[filename]["position"])
+      print("writebatch %d files in %s" % (len(filenames), bundlename))
+      self.modg.writefilesintobundle(bundlename, [[filename, files[filename]] for filename in filenames], ggpkpointer)
+    for position, filename in sorted(loose, key=itemgetter(0)) :
+      writethis = self.modg.generateheader(filename, files[filename])
+      if self.keeporiginals is True :
+        self.modg.writebinarydata(filename, writethis, ggpkpointer)
+      else :
+        self.modg.onlywritebinarydata(filename, writethis, ggpkpointer)
+    return len(files)
+
+  def commit(self, ggpkpointer):
+    # apply, then write the index back and save the ggpk info once
+    count = self.apply(ggpkpointer)
+    if self.modg.updateindexbundle(ggpkpointer) is False :
+      self.modg.saveinfo()
+    return count
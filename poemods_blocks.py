@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+import sys
+import struct
+import bisect
+import itertools
+import threading
+from array import array
+from collections import OrderedDict
+
+# decompressed bundle blocks shared by every reader of the process
+# a block is keyed by (bundle name, block index, version of the bundle) : the version is the record
+# position and digest for bundles inside the ggpk, the keeplist hash for the originals kept on disk
+# bundles are modified in place without a new digest, writers call forget(bundlename)
+class blockcache(object):
+  def __init__(self, budget):
+    self.budget = budget
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self.blocks = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock :
+      block = self.blocks.get(key)
+      if block is None :
+        self.misses += 1
+        return None
+      self.blocks.move_to_end(key)
+      self.hits += 1
+      return block
+
+  def put(self, key, block):
+    with self.lock :
+      if key in self.blocks :
+        self.size -= len(self.blocks.pop(key))
+      if len(block) > self.budget :
+        return
+      self.blocks[key] = block
+      self.size += len(block)
+      while self.size > self.budget :
+        oldkey, oldblock = self.blocks.popitem(last=False)
+        self.size -= len(oldblock)
+
+  def forget(self, bundlename):
+    with self.lock :
+      for key in [key for key in self.blocks if key[0] == bundlename] :
+        self.size -= len(self.blocks.pop(key))
+
+  def setbudget(self, budget):
+    with self.lock :
+      self.budget = budget
+      while self.size > self.budget :
+        oldkey, oldblock = self.blocks.popitem(last=False)
+        self.size -= len(oldblock)
+
+  def clear(self):
+    with self.lock :
+      self.blocks.clear()
+      self.size = 0
+
+  def stats(self):
+    return "%d hits %d misses %d blocks %d bytes (budget %d)" % (self.hits, self.misses, len(self.blocks), self.size, self.budget)
+
+# 64MB, 256 blocks of 256KB
+blocks = blockcache(64 * 1024 * 1024)
+
+class blocktable(object):
+  # header and block size table of a bundle, parsed once
+  #   0:60   header, 0:4 extracted size, 36:40 block count, 40:44 extracted size of a block
+  #   60:    compressed size of every block, u32 each
+  # offsets[i] is where the compressed block i starts from the start of the bundle, offsets[blockcount]
+  # where the last one ends : the blocks of an extracted range are found by division, their compressed
+  # position by looking the offsets up
+  def __init__(self, header):
+    self.extractedsize, = struct.unpack_from("<I", header, 0)
+    self.blockcount, self.blocksize = struct.unpack_from("<II", header, 36)
+    sizes = array("I")
+    sizes.frombytes(header[60:60+4*self.blockcount])
+    if sys.byteorder != "little" :
+      sizes.byteswap()
+    self.offsets = array("Q", itertools.accumulate(sizes, initial=60+4*self.blockcount))
+
+  def blocks(self, start, end):
+    # range of the blocks holding the extracted bytes start:end
+    end = min(end, self.extractedsize)
+    if end <= start :
+      return range(0)
+    return range(start // self.blocksize, (end - 1) // self.blocksize + 1)
+
+  def compressed(self, i):
+    # (offset from the start of the bundle, size) of compressed block i
+    return self.offsets[i], self.offsets[i+1] - self.offsets[i]
+
+  def extracted(self, i):
+    # (extracted offset, extracted size) of block i
+    start = i * self.blocksize
+    return start, min(self.blocksize, self.extractedsize - start)
+
+  def blockat(self, offset):
+    # block holding a compressed offset from the start of the bundle, -1 in the header
+    if offset < self.offsets[0] or offset >= self.offsets[-1] :
+      return -1
+    return bisect.bisect_right(self.offsets, offset) - 1
+
+class tablecache(object):
+  # block tables by (bundle name, version of the bundle) as for the blocks, forgotten with them
+  def __init__(self):
+    self.tables = {}
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock :
+      return self.tables.get(key)
+
+  def put(self, key, table):
+    with self.lock :
+      self.tables[key] = table
+
+  def forget(self, bundlename):
+    with self.lock :
+      for key in [key for key in self.tables if key[0] == bundlename] :
+        self.tables.pop(key)
+
+  def clear(self):
+    with self.lock :
+      self.tables.clear()
+
+tables = tablecache()
@@ -0,0 +1,389 @@
+#!/usr/bin/python3
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+# binary file table cache keep/<ggpk>.bin, little endian
+#
+#   0:4     magic "PMC\0"
+#   4:8     version
+#   8:16    row count
+#   16:24   first free record
+#   24:28   ggpk hash length, followed by the UTF-8 ggpk hash
+#   every column starts on a 8 bytes boundary :
+#     position            u64 * rows
+#     length              u64 * rows
+#     referenceposition   u64 * rows
+#     bundle              i64 * rows   row of the bundle holding this file, -1 for ggpk records
+#     hash                u64 * rows
+#     digest              32 bytes * rows   sha256 of the PDIR/FILE record, zero for files inside bundles
+#     path offsets        u64 * (rows + 1)
+#     paths               UTF-8 blob of every path+name, in row order
+#
+# rows are sorted with namekey so a name is found by bisection without loading anything
+cachemagic = b'PMC\x00'
+cacheversion = 2
+nodigest = b'\x00' * 32
+cachecolumns = [
+  ["position", "Q"],
+  ["length", "Q"],
+  ["referenceposition", "Q"],
+  ["bundle", "q"],
+  ["hash", "Q"],
+]
+
+def namekey(filename) :
+  # sort order of fullfilelist and of the cache rows
+  return (filename.lower(), filename)
+
+def splitname(filename) :
+  # "./Art/x.dds" -> "./Art/" "x.dds", "./Art/" -> "./" "Art/", "./" -> "." "/", "." -> "" "."
+  namei = filename.rfind("/", 0, len(filename) - 1)
+  if namei == -1 :
+    if filename.endswith("/") :
+      namei = len(filename) - 2
+  return filename[:namei+1], filename[namei+1:]
+
+def lowerbound(name, count, key) :
+  # first row of rows 0:count sorted with namekey whose key is not below key, name(row) is its name
+  lo = 0
+  hi = count
+  while lo < hi :
+    mid = (lo + hi) // 2
+    if namekey(name(mid)) < key :
+      lo = mid + 1
+    else :
+      hi = mid
+  return lo
+
+def padding(size) :
+  return b'\x00' * (-size % 8)
+
+class filecache(object):
+  def __init__(self, cachename):
+    self.cachename = cachename
+    self.fin = None
+    self.mm = None
+    self.count = 0
+    self.ggpkhash = ""
+    self.firstfreerecord = -1
+    self.columns = {}
+    self.offsets = None
+    self.digeststart = 0
+    self.pathstart = 0
+
+  def open(self):
+    self.close()
+    if os.path.exists(self.cachename) is False :
+      return False
+    if sys.byteorder != "little" :
+      return False
+    self.fin = open(self.cachename, "rb")
+    try :
+      self.mm = mmap.mmap(self.fin.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError :
+      # empty file
+      self.close()
+      return False
+    if len(self.mm) < 28 or self.mm[0:4] != cachemagic :
+      print("cache %s : unknown format" % (self.cachename))
+      self.close()
+      return False
+    version, self.count, self.firstfreerecord, hashlength = struct.unpack_from("<IQqI", self.mm, 4)
+    if version != cacheversion :
+      print("cache %s : version %d, expected %d" % (self.cachename, version, cacheversion))
+      self.close()
+      return False
+    self.ggpkhash = str(self.mm[28:28+hashlength], "UTF-8")
+    bi = 28 + hashlength
+    bi += -bi % 8
+    view = memoryview(self.mm)
+    for column, typecode in cachecolumns :
+      bf = bi + 8 * self.count
+      self.columns[column] = view[bi:bf].cast(typecode)
+      bi = bf
+    self.digeststart = bi
+    bi += 32 * self.count
+    bf = bi + 8 * (self.count + 1)
+    self.offsets = view[bi:bf].cast("Q")
+    self.pathstart = bf
+    view.release()
+    return True
+
+  def close(self):
+    # every exported view has to be released before the mmap can be closed
+    for column in self.columns :
+      self.columns[column].release()
+    self.columns = {}
+    if self.offsets is not None :
+      self.offsets.release()
+      self.offsets = None
+    if self.mm is not None :
+      self.mm.close()
+      self.mm = None
+    if self.fin is not None :
+      self.fin.close()
+      self.fin = None
+    self.count = 0
+
+  def name(self, i):
+    return str(self.mm[self.pathstart+self.offsets[i]:self.pathstart+self.offsets[i+1]], "UTF-8")
+
+  def digest(self, i):
+    return self.mm[self.digeststart+32*i:self.digeststart+32*(i+1)]
+
+  def lowerbound(self, key):
+    return lowerbound(self.name, self.count, key)
+
+  def find(self, filename):
+    i = self.lowerbound(namekey(filename))
+    if i < self.count and self.name(i) == filename :
+      return i
+    return -1
+
+  def subtree(self, dirname):
+    # rows of the ggpk records below dirname, dirname included
+    # every name starting with dirname sits in one range of the namekey order
+    lowerdirname = dirname.lower()
+    i = self.lowerbound((lowerdirname, ""))
+    while i < self.count :
+      filename = self.name(i)
+      if filename.lower().startswith(lowerdirname) is False :
+        break
+      if filename.startswith(dirname) and self.columns["bundle"][i] == -1 :
+        yield i
+      i += 1
+
+  def entry(self, i):
+    filename = self.name(i)
+    path, name = splitname(filename)
+    element = {
+      "path" : path,
+      "name" : name,
+      "position" : self.columns["position"][i],
+      "length" : self.columns["length"][i],
+      "referenceposition" : self.columns["referenceposition"][i],
+    }
+    bundle = self.columns["bundle"][i]
+    if bundle != -1 :
+      element["bundlename"] = self.name(bundle)
+      element["hash"] = self.columns["hash"][i]
+    else :
+      element["digest"] = self.digest(i)
+    return element
+
+class cachednames(object):
+  # fullfilelist read from the cache, names are decoded when asked for
+  def __init__(self, cache):
+    self.cache = cache
+
+  def __len__(self):
+    return self.cache.count
+
+  def __getitem__(self, i):
+    if isinstance(i, slice) :
+      return [self.cache.name(j) for j in range(*i.indices(self.cache.count))]
+    if i < 0 :
+      i += self.cache.count
+    if i < 0 or i >= self.cache.count :
+      raise IndexError(i)
+    return self.cache.name(i)
+
+  def __iter__(self):
+    for i in range(self.cache.count) :
+      yield self.cache.name(i)
+
+class namecolumn(object):
+  # names of rows added in memory, laid out like the paths of the cache : UTF-8 one after the other,
+  # row i is blob[offsets[i]:offsets[i+1]], no string is kept per row
+  def __init__(self, offsets=None, blob=None):
+    if offsets is None :
+      offsets = array("Q", [0])
+    if blob is None :
+      blob = bytearray()
+    self.offsets = offsets
+    self.blob = blob
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i):
+    if isinstance(i, slice) :
+      return [self[j] for j in range(*i.indices(len(self)))]
+    if i < 0 :
+      i += len(self)
+    if i < 0 or i >= len(self) :
+      raise IndexError(i)
+    return str(self.blob[self.offsets[i]:self.offsets[i+1]], "UTF-8")
+
+  def __iter__(self):
+    for i in range(len(self)) :
+      yield self[i]
+
+  def raw(self, i):
+    return self.blob[self.offsets[i]:self.offsets[i+1]]
+
+  def append(self, filename):
+    self.blob += filename.encode("UTF-8")
+    self.offsets.append(len(self.blob))
+
+def loadcache(cachename):
+  cache = filecache(cachename)
+  if cache.open() is False :
+    return None
+  return cache
+
+def tablepaths(table):
+  # digests, path offsets and paths of a sorted poemods_table.filetable
+  if isinstance(table.names, cachednames) :
+    # the names did not change since the cache was read
+    cache = table.cache
+    offsets = array("Q")
+    view = cache.offsets.cast("B")
+    offsets.frombytes(view)
+    view.release()
+    paths = cache.mm[cache.pathstart:cache.pathstart+offsets[-1]]
+    digests = bytearray(cache.mm[cache.digeststart:cache.digeststart+32*cache.count])
+    for row in table.digests :
+      digests[32*row:32*(row+1)] = table.digests[row]
+    return digests, offsets, paths
+  count = len(table)
+  digests = bytearray(32 * count)
+  for row in table.digests :
+    digests[32*row:32*(row+1)] = table.digests[row]
+  return digests, array("Q", table.names.offsets), table.names.blob
+
+def savecache(cachename, ggpkhash, firstfreerecord, table):
+  cache = table.cache
+  digests, offsets, paths = tablepaths(table)
+  columns = {}
+  for column, typecode in cachecolumns :
+    columns[column] = array(typecode, table.columns[column])
+  count = len(table)
+  bggpkhash = ggpkhash.encode("UTF-8")
+  header = cachemagic + struct.pack("<IQqI", cacheversion, count, firstfreerecord, len(bggpkhash)) + bggpkhash
+  if sys.byteorder != "little" :
+    for column in columns :
+      columns[column].byteswap()
+    offsets.byteswap()
+  tmpname = cachename + ".tmp"
+  with open(tmpname, "wb") as fout :
+    fout.write(header)
+    fout.write(padding(len(header)))
+    for column, typecode in cachecolumns :
+      fout.write(columns[column].tobytes())
+    fout.write(digests)
+    fout.write(offsets.tobytes())
+    fout.write(paths)
+  try :
+    os.replace(tmpname, cachename)
+  except OSError :
+    # windows does not replace a mapped file, the mapping has to be closed first
+    if cache is None :
+      raise
+    cache.close()
+    os.replace(tmpname, cachename)
+    cache.open()
+
+# paths of _.index.bin keep/<ggpk>.paths.bin, little endian
+#   0:4     magic "PMP\0"
+#   4:8     version
+#   8:16    path count
+#   16:20   key length, followed by the UTF-8 key
+#   hashes  u64 * count, starting on a 8 bytes boundary
+#   paths   UTF-8, separated by NUL
+# the key is the digest of the _.index.bin record the paths were decoded from
+pathsmagic = b'PMP\x00'
+pathsversion = 1
+
+def loadpaths(cachename, key):
+  if os.path.exists(cachename) is False :
+    return None
+  with open(cachename, "rb") as fin :
+    data = fin.read()
+  if len(data) < 20 or data[0:4] != pathsmagic :
+    return None
+  version, count, keylength = struct.unpack_from("<IQI", data, 4)
+  if version != pathsversion or str(data[20:20+keylength], "UTF-8") != key :
+    return None
+  bi = 20 + keylength
+  bi += -bi % 8
+  hashes = array("Q")
+  hashes.frombytes(data[bi:bi+8*count])
+  if sys.byteorder != "little" :
+    hashes.byteswap()
+  try :
+    paths = str(data[bi+8*count:], "UTF-8").split("\x00")
+  except UnicodeDecodeError :
+    return None
+  if len(paths) != count or count == 0 :
+    return None
+  return paths, hashes
+
+def savepaths(cachename, key, paths, hashes):
+  bkey = key.encode("UTF-8")
+  header = pathsmagic + struct.pack("<IQI", pathsversion, len(paths), len(bkey)) + bkey
+  hashes = array("Q", hashes)
+  if sys.byteorder != "little" :
+    hashes.byteswap()
+  tmpname = cachename + ".tmp"
+  with open(tmpname, "wb") as fout :
+    fout.write(header)
+    fout.write(padding(len(header)))
+    fout.write(hashes.tobytes())
+    fout.write("\x00".join(paths).encode("UTF-8"))
+  os.replace(tmpname, cachename)
+
+# free space of the bundles keep/<ggpk>.free.bin, little endian
+#   0:4     magic "PMF\0"
+#   4:8     version
+#   8:16    bundle count
+#   16:20   key length, followed by the UTF-8 key
+#   for each bundle :
+#     u32 name length, UTF-8 name
+#     u64 extracted size, u64 end of the last file, u64 hole count
+#     u64 start, u64 length of every hole
+# the key is the digest of the _.index.bin record written with this free space
+freemagic = b'PMF\x00'
+freeversion = 1
+
+def loadfree(cachename, key):
+  # bundle name -> (size, end, holes)
+  if key is None or os.path.exists(cachename) is False :
+    return None
+  with open(cachename, "rb") as fin :
+    data = fin.read()
+  if len(data) < 20 or data[0:4] != freemagic :
+    return None
+  version, count, keylength = struct.unpack_from("<IQI", data, 4)
+  if version != freeversion or str(data[20:20+keylength], "UTF-8") != key :
+    return None
+  bf = 20 + keylength
+  bundles = {}
+  for i in range(count) :
+    namelength, = struct.unpack_from("<I", data, bf)
+    bi = bf + 4
+    bf = bi + namelength
+    name = str(data[bi:bf], "UTF-8")
+    size, end, holecount = struct.unpack_from("<QQQ", data, bf)
+    bf += 24
+    holes = list(struct.iter_unpack("<QQ", data[bf:bf+16*holecount]))
+    bf += 16 * holecount
+    bundles[name] = (size, end, holes)
+  return bundles
+
+def savefree(cachename, key, bundles):
+  # bundles : bundle name -> (size, end, holes)
+  bkey = key.encode("UTF-8")
+  parts = [freemagic + struct.pack("<IQI", freeversion, len(bundles), len(bkey)) + bkey]
+  for name in bundles :
+    size, end, holes = bundles[name]
+    bname = name.encode("UTF-8")
+    parts.append(struct.pack("<I", len(bname)) + bname + struct.pack("<QQQ", size, end, len(holes)))
+    parts.append(b''.join([struct.pack("<QQ", start, length) for start, length in holes]))
+  tmpname = cachename + ".tmp"
+  with open(tmpname, "wb") as fout :
+    fout.write(b''.join(parts))
+  os.replace(tmpname, cachename)
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+import bisect
+import struct
+
+# free space of one bundle : ranges of its extracted content no file uses
+# the holes between files are kept twice, by start to merge a freed range with the holes on both of its
+# sides, and in buckets of lengths between two powers of two sorted by length, to find the best fit
+# [end, size) after the last file is not a hole, it is used when no hole fits and grows with the bundle
+class freespace(object):
+  def __init__(self, size, end, holes=()):
+    self.size = size
+    self.end = end
+    self.starts = []
+    self.lengths = {}
+    self.buckets = {}
+    for start, length in holes :
+      self.addhole(start, length)
+
+  def addhole(self, start, length):
+    bisect.insort(self.starts, start)
+    self.lengths[start] = length
+    bucket = self.buckets.setdefault(length.bit_length(), [])
+    bisect.insort(bucket, (length, start))
+
+  def removehole(self, start):
+    length = self.lengths.pop(start)
+    del self.starts[bisect.bisect_left(self.starts, start)]
+    bucket = self.buckets[length.bit_length()]
+    del bucket[bisect.bisect_left(bucket, (length, start))]
+    if len(bucket) == 0 :
+      del self.buckets[length.bit_length()]
+    return length
+
+  def find(self, length):
+    # start of the smallest hole length fits in, -1 if none
+    for key in sorted(self.buckets) :
+      if key < length.bit_length() :
+        continue
+      bucket = self.buckets[key]
+      i = bisect.bisect_left(bucket, (length, -1))
+      if i < len(bucket) :
+        return bucket[i][1]
+    return -1
+
+  def allocate(self, length, minimum=0):
+    # start of the smallest hole length fits in, -1 if none, what is left of the hole stays free
+    # and is either nothing or at least minimum bytes
+    start = self.find(length)
+    if start != -1 and length < self.lengths[start] < length + minimum :
+      start = self.find(length + minimum)
+    if start == -1 :
+      return -1
+    holelength = self.removehole(start)
+    if holelength > length :
+      self.addhole(start + length, holelength - length)
+    return start
+
+  def allocateend(self, length):
+    # start of length bytes taken after the last file, -1 if the bundle is too small
+    if self.size - self.end < length :
+      return -1
+    start = self.end
+    self.end += length
+    return start
+
+  def release(self, start, length):
+    # the range becomes free, merged with the hole before it, the hole after it and the free end
+    if length <= 0 :
+      return
+    i = bisect.bisect_left(self.starts, start)
+    if i > 0 :
+      previous = self.starts[i-1]
+      if previous + self.lengths[previous] == start :
+        length += start - previous
+        start = previous
+        self.removehole(previous)
+    if start + length in self.lengths :
+      length += self.removehole(start + length)
+    if start + length >= self.end :
+      self.end = min(self.end, start)
+    else :
+      self.addhole(start, length)
+
+  def grow(self, size):
+    self.size = max(self.size, size)
+
+  def holes(self):
+    return [(start, self.lengths[start]) for start in self.starts]
+
+  def stats(self):
+    # free bytes in holes, largest hole and how much of the free space is split in smaller holes
+    holebytes = sum(self.lengths.values())
+    largest = max(self.lengths.values(), default=0)
+    fragmentation = 0
+    if holebytes > 0 :
+      fragmentation = 1 - largest / holebytes
+    return len(self.starts), holebytes, largest, self.size - self.end, fragmentation
+
+class freerecords(freespace):
+  # FREE records of the ggpk, every hole is one of them : u32 length, "FREE", u64 offset of the next one
+  # or 0 for the last one, the first one is linked from the ggpk header at position first
+  # the records are linked in no particular order, a new hole is linked first : adding or removing a
+  # hole writes its header and the offset pointing at it, the writes wait in self.writes for flush
+  # there is no free end, the ggpk grows when no hole fits, a hole at the end of the ggpk grows with it
+  # the length of a record is a u32 : a hole longer than largest is several records one after the other
+  minimum = 16
+  largest = 0xfffffff0
+
+  def __init__(self, size, first, records=()):
+    freespace.__init__(self, size, size)
+    self.first = first
+    self.head = 0
+    self.previous = {}
+    self.next = {}
+    self.writes = []
+    # records in the order of the chain, linked as they are
+    slot = first
+    for start, length in records :
+      freespace.addhole(self, start, length)
+      self.previous[start] = slot
+      self.next[start] = 0
+      if slot == first :
+        self.head = start
+      else :
+        self.next[slot - 8] = start
+      slot = start + 8
+
+  def addhole(self, start, length):
+    while length > self.largest :
+      piece = self.largest
+      if length - piece < self.minimum :
+        piece = length - self.minimum
+      self.addrecord(start, piece)
+      start += piece
+      length -= piece
+    self.addrecord(start, length)
+
+  def addrecord(self, start, length):
+    freespace.addhole(self, start, length)
+    self.writes.append([start, struct.pack("<I4sQ", length, b"FREE", self.head)])
+    self.writes.append([self.first, struct.pack("<Q", start)])
+    if self.head != 0 :
+      self.previous[self.head] = start + 8
+    self.previous[start] = self.first
+    self.next[start] = self.head
+    self.head = start
+
+  def removehole(self, start):
+    length = freespace.removehole(self, start)
+    slot = self.previous.pop(start)
+    following = self.next.pop(start)
+    self.writes.append([slot, struct.pack("<Q", following)])
+    if slot == self.first :
+      self.head = following
+    else :
+      self.next[slot - 8] = following
+    if following != 0 :
+      self.previous[following] = slot
+    return length
+
+  def allocate(self, length):
+    # start of length bytes, in the smallest FREE record they fit in, at the end of the ggpk otherwise
+    if self.first == -1 :
+      start = -1
+    else :
+      start = freespace.allocate(self, length, self.minimum)
+    if start == -1 :
+      start = self.size
+      if len(self.starts) > 0 and self.starts[-1] + self.lengths[self.starts[-1]] == self.size and self.lengths[self.starts[-1]] < length :
+        # the last FREE record is the start of the new one
+        start = self.starts[-1]
+        self.removehole(start)
+      self.grow(start + length)
+    return start
+
+  def release(self, start, length):
+    # a FREE record needs 16 bytes, less is left as it is
+    if self.first == -1 or length < self.minimum :
+      return
+    freespace.release(self, start, length)
+    if self.end < self.size :
+      # the end of the ggpk is free
+      start = self.end
+      self.end = self.size
+      self.addhole(start, self.size - start)
+
+  def grow(self, size):
+    self.size = max(self.size, size)
+    self.end = self.size
+
+  def flush(self, fout):
+    # write the FREE records headers and offsets changed since the last flush
+    for position, data in self.writes :
+      fout.seek(position)
+      fout.write(data)
+    self.writes.clear()
+
+def fromchain(reader, size, first):
+  # FREE records linked from the offset at position first, in the order of the chain
+  records = []
+  seen = set()
+  position, = struct.unpack("<Q", reader.read(first, 8))
+  while position != 0 and position + 16 <= size and position not in seen :
+    length, tag, following = struct.unpack("<I4sQ", reader.read(position, 16))
+    if tag != b"FREE" or length < 16 or position + length > size :
+      break
+    seen.add(position)
+    records.append((position, length))
+    position = following
+  return freerecords(size, first, records)
+
+def fromflist(flist, size):
+  # free space of a bundle from its [offset, size, ...] file list sorted by offset
+  # files sharing their data have the same offset, a file inside another one adds no hole
+  holes = []
+  end = 0
+  for entry in flist :
+    if entry[0] > end :
+      holes.append((end, entry[0] - end))
+    end = max(end, entry[0] + entry[1])
+  return freespace(size, min(end, size), holes)
+
+def summary(freespaces):
+  holes = 0
+  holebytes = 0
+  largest = 0
+  endbytes = 0
+  for free in freespaces :
+    count, freebytes, largesthole, freeend, fragmentation = free.stats()
+    holes += count
+    holebytes += freebytes
+    largest = max(largest, largesthole)
+    endbytes += freeend
+  return "%d bundles %d holes %d bytes (largest %d) %d free bytes at the end of the bundles" % (len(freespaces), holes, holebytes, largest, endbytes)
@@ -12,14 +12,30 @@ import hashlib
 import brotli
 import subprocess
 import io
+import itertools
+import struct
+import heapq
+import functools
+import concurrent.futures
+import threading
 from operator import itemgetter, attrgetter
 import math
+import poemods_cache
+import poemods_table
+import poemods_index
+import poemods_blocks
+import poemods_reader
+import poemods_free
 
 from cffi import FFI
 ffi = FFI()
 ffi.cdef("""
     int Ooz_Decompress(uint8_t const* src_data, size_t src_size, uint8_t* dst_data, size_t dst_size);
+    int64_t Ooz_DecompressBundle(uint8_t const* bundle, size_t bundle_len, uint64_t range_start, uint64_t range_len, uint8_t* dst, int threads);
+    int Ooz_CompressBound(int src_len);
+    int Ooz_Compress(int codec, uint8_t const* src_buf, int src_len, uint8_t* dst, size_t dst_size, int level);
 """)
+ooz = None
 if os.path.exists("ooz" + os.sep + "build" + os.sep + "oozlib.dll") :
   print("oozlib.dll found")
   ooz = ffi.dlopen("ooz" + os.sep + "build" + os.sep + "oozlib.dll")
@@ -35,7 +51,97 @@ else :
         "   make\n"
   )
 
-uint_max = 2 ** 64
+def hasexport(lib, name) :
+  # a library built before name was added does not export it
+  if lib is None :
+    return False
+  try :
+    getattr(lib, name)
+  except AttributeError :
+    return False
+  return True
+
+# whole bundles are decompressed by libooz in one call when it is recent enough
+nativebundle = hasexport(ooz, "Ooz_DecompressBundle")
+# the blocks of the bundles we write are compressed with Kraken, stored as they are by an older libooz
+nativecompress = hasexport(ooz, "Ooz_Compress")
+krakencodec = 8
+
+safespace = 64
+# largest piece read at once from a file that is not inside a bundle
+chunksize = 262144
+hashsamples = 64
+hashsamplesize = 65536
+
+class recordreader(object):
+  # reads the ggpk records of a scan, they are asked for by increasing offset
+  # a read only covers the header a record needs, unless the next pending record is close :
+  # reading through a small gap is cheaper than seeking, so the read is extended to readahead bytes
+  # a record read alone is read by headerahead bytes, enough for its header whatever the length of its name
+  gap = 65536
+  readahead = 262144
+  headerahead = 512
+
+  def __init__(self, reader, ggpksize):
+    self.reader = reader
+    self.ggpksize = ggpksize
+    self.start = 0
+    self.buffer = bytearray()
+    self.cursor = -1
+    self.end = 0
+    self.bytesread = 0
+    self.reads = 0
+    self.seeks = 0
+    self.mappedreads = 0
+
+  def plan(self, absoluteposition, pending):
+    # end of the next read, pending is the heap of the records still to visit
+    self.end = min(absoluteposition + self.headerahead, self.ggpksize)
+    if len(pending) > 0 and pending[0][0] - absoluteposition <= self.gap :
+      self.end = min(absoluteposition + self.readahead, self.ggpksize)
+
+  def fetch(self, absoluteposition, size):
+    bufferend = self.start + len(self.buffer)
+    end = absoluteposition + size
+    if self.start <= absoluteposition and end <= bufferend :
+      return
+    if self.start <= absoluteposition <= bufferend and len(self.buffer) > 0 :
+      # only the missing part is read, what is before the record is not needed anymore
+      del self.buffer[:absoluteposition - self.start]
+      self.start = absoluteposition
+      readstart = bufferend
+    else :
+      readstart = absoluteposition
+      self.buffer = bytearray()
+      self.start = absoluteposition
+    readend = max(end, self.end)
+    if readstart != self.cursor :
+      self.seeks += 1
+    data = self.reader.read(readstart, readend - readstart)
+    self.buffer += data
+    self.cursor = readstart + len(data)
+    self.bytesread += len(data)
+    self.reads += 1
+
+  def mapped(self, absoluteposition, size):
+    # the mapping is read in place, there is nothing to coalesce : these reads are only counted apart
+    if self.reader.ismapped(absoluteposition + size) is False :
+      return False
+    self.mappedreads += 1
+    return True
+
+  def read(self, absoluteposition, size):
+    if self.mapped(absoluteposition, size) is True :
+      return self.reader.read(absoluteposition, size)
+    self.fetch(absoluteposition, size)
+    bi = absoluteposition - self.start
+    return self.buffer[bi:bi+size]
+
+  def unpack(self, fmt, absoluteposition, size):
+    if self.mapped(absoluteposition, size) is True :
+      return struct.unpack_from(fmt, self.reader.read(absoluteposition, size))
+    self.fetch(absoluteposition, size)
+    return struct.unpack_from(fmt, self.buffer, absoluteposition - self.start)
 
 def pprinthex(b):
   display = ""
@@ -43,52 +149,242 @@ def pprinthex(b):
     display += "%02x" % b[i]
   return display
 
-def decompressooz(filedata, uncompressed_size) :
+def decompressoozinto(filedata, uncompressed_size, output, offset) :
+  # decompress one block straight into output[offset:offset+uncompressed_size]
+  # ooz may write up to safespace bytes after the block : output must have them, and blocks written
+  # one after the other overwrite the safe space of the previous one
   if filedata[0] == 0xcc :
-    # data is not compressed just send back without the two bytes header 0xcc 0x06/0x30
-    return filedata[2:2+uncompressed_size]
-  unpacked_data = ffi.new("uint8_t[]", uncompressed_size + 64)
-  unpacked_size = ooz.Ooz_Decompress(filedata, len(filedata), unpacked_data, uncompressed_size)
-  data = ffi.buffer(unpacked_data)
+    # data is not compressed just copy it without the two bytes header 0xcc 0x06/0x30
+    output[offset:offset+uncompressed_size] = memoryview(filedata)[2:2+uncompressed_size]
+    return True
+  unpacked_size = ooz.Ooz_Decompress(ffi.from_buffer("uint8_t[]", filedata), len(filedata), ffi.from_buffer("uint8_t[]", output) + offset, uncompressed_size)
   if unpacked_size != uncompressed_size :
     # unpacked_size = -1 = 0xfffffff if decompression failed
     # this happens with 0xcc (data is decompressed) 0x30 (unknown decoder)
     print("Error : \n%12d unpacked_size\n%12d uncompressed_size" % (unpacked_size, uncompressed_size))
+    return False
+  return True
+
+def decompressooz(filedata, uncompressed_size) :
+  output = bytearray(uncompressed_size + safespace)
+  if decompressoozinto(filedata, uncompressed_size, output, 0) is False :
     return b''
-  return data[:-64]
+  return bytes(memoryview(output)[:uncompressed_size])
+
+def compressooz(filedata, level) :
+  # one bundle block, a block that does not compress is stored as is after 0xcc 0x06, as every block is
+  # at level 0 : ooz takes 0 as a kraken level
+  if nativecompress is False or level == 0 :
+    return b'\xcc\x06' + bytes(filedata)
+  output = bytearray(ooz.Ooz_CompressBound(len(filedata)))
+  packed_size = ooz.Ooz_Compress(krakencodec, ffi.from_buffer("uint8_t[]", filedata), len(filedata), ffi.from_buffer("uint8_t[]", output), len(output), level)
+  if packed_size < 0 :
+    print("Error : compression failed, block of %d bytes stored as is" % (len(filedata)))
+    return b'\xcc\x06' + bytes(filedata)
+  if packed_size >= len(filedata) :
+    return b'\xcc\x06' + bytes(filedata)
+  del output[packed_size:]
+  # the kraken compressor of ooz sometimes writes a block that decompresses to other bytes
+  if decompressooz(output, len(filedata)) != filedata :
+    print("Error : compressed block of %d bytes does not decompress to itself, stored as is" % (len(filedata)))
+    return b'\xcc\x06' + bytes(filedata)
+  return output
+
+class blockdecoder(object):
+  # decompresses the blocks of a bundle into one output, on a pool of threads when threads > 1
+  # ooz releases the GIL so the blocks are decompressed side by side, but a block may write safespace
+  # bytes over the start of the block after it : the odd blocks are decompressed first and their start
+  # saved, then the even blocks, and the saved starts are written back
+  def __init__(self, threads=1):
+    self.threads = threads
+    self.pool = None
+    if threads > 1 :
+      self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+
+  def decode(self, blocks, output):
+    # blocks : list of (compressed block, decompressed size, offset in output) by increasing offset
+    # output has safespace bytes after the last block, returns False if a block failed
+    if self.pool is None or len(blocks) < 2 :
+      ok = True
+      for compressedblock, size, offset in blocks :
+        if decompressoozinto(compressedblock, size, output, offset) is False :
+          ok = False
+      return ok
+    decodeblock = functools.partial(self.decodeblock, output)
+    ok = all(self.pool.map(decodeblock, blocks[1::2]))
+    heads = []
+    for compressedblock, size, offset in blocks[1::2] :
+      heads.append([offset, bytes(output[offset:offset+min(size, safespace)])])
+    ok = all(self.pool.map(decodeblock, blocks[0::2])) and ok
+    for offset, head in heads :
+      output[offset:offset+len(head)] = head
+    return ok
+
+  def decodeblock(self, output, block):
+    compressedblock, size, offset = block
+    return decompressoozinto(compressedblock, size, output, offset)
+
+  def close(self):
+    if self.pool is not None :
+      self.pool.shutdown()
+      self.pool = None
 
 class listggpkfiles(object):
   def __init__(self):
     self.ggpkname=None
     self.ggpksize=0
     self.ggpkhash="ghkf"
-    self.fullfilelist=[]
-    self.fullfilelistdic={}
+    self.hashlayers=None
+    self.settable(poemods_table.filetable())
     self.refdic={}
     self.firstfreerecord=-1
     self.ggpknameinfo=None
+    self.indexpathsname=None
+    self.freespacename=None
+    self.freespaces={}
+    self.freerecords=None
     self.keeplist={}
-    self.hashdic = {}
     if os.path.exists("keep") is False :
       os.makedirs("keep")
     self.keeplistf=os.path.join("keep", "keeplist.dat")
+    # files are read from several threads, the originals kept on disk are checked and stored by one at a time
+    self.keeplock = threading.RLock()
     self.isthemod=False
     self.forcescan=False
     self.indexbundle = None
     self.indexbundlefilepos = 0
+    self.sortedindex = None
+    self.indexmodel = None
+    self.indexondisk = None
+    self.cache = None
+    self.previouscache = None
+    self.reusedcount = [0, 0]
+    self.decoder = blockdecoder(1)
+    # Kraken level of the blocks we compress, 1 to 9 from fastest to smallest, 0 stores them as they are
+    self.compresslevel = 4
+    self.ggpkfile = None
+    self.reader = None
     self.bench = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
   
+  def settable(self, table):
+    # fullfilelist and hashdic are views of the table
+    self.fullfilelistdic = table
+    self.fullfilelist = poemods_table.filenames(table)
+    self.hashdic = poemods_table.filehashes(table)
+  
+  def setdecodethreads(self, threads):
+    # blocks of a bundle are decompressed by that many threads, 1 decompresses them one after the other
+    if threads < 1 :
+      threads = os.cpu_count() or 1
+    if threads != self.decoder.threads :
+      self.decoder.close()
+      self.decoder = blockdecoder(threads)
+  
+  def setcompresslevel(self, level):
+    self.compresslevel = max(0, min(level, 9))
+  
+  def openreader(self):
+    # reader of the ggpk shared by every thread, other file objects are read through readerfor
+    self.closereader()
+    self.ggpkfile = open(self.ggpkname, "rb")
+    self.reader = poemods_reader.filereader(self.ggpkfile)
+  
+  def closereader(self):
+    if self.reader is not None :
+      self.reader.close()
+      self.reader = None
+    if self.ggpkfile is not None :
+      self.ggpkfile.close()
+      self.ggpkfile = None
+  
+  def readerfor(self, ggpk):
+    # positional reader of a file object, its position is neither used nor moved
+    # what was written through the file object and is still in its buffer is flushed first
+    if isinstance(ggpk, io.BytesIO) :
+      return poemods_reader.bufferreader(ggpk.getvalue())
+    ggpk.flush()
+    if self.reader is not None and ggpk.name == self.ggpkname :
+      return self.reader
+    return poemods_reader.filereader(ggpk, False)
+  
+  def closecache(self):
+    # forget the file table, the mapping of a previous keep/<ggpk>.bin is released
+    self.settable(poemods_table.filetable())
+    self.refdic.clear()
+    if self.cache is not None :
+      self.cache.close()
+      self.cache = None
+    if self.previouscache is not None :
+      self.previouscache.close()
+      self.previouscache = None
+    self.reusedcount = [0, 0]
+  
+  def reusedirectory(self, dirname, absoluteposition, record_length, digest, childrenw, reader):
+    # a directory is taken back from the previous scan when its record has not moved,
+    # its digest (hash of everything below it) is the same and it points to the same children
+    # the digests do not cover the offsets : a record below it may have moved while the tables above
+    # it were written in place, the table of every directory below it is read again and compared
+    previous = self.previouscache
+    if previous is None :
+      return False
+    i = previous.find(dirname)
+    if i == -1 :
+      return False
+    if previous.columns["position"][i] != absoluteposition or previous.columns["length"][i] != record_length :
+      return False
+    if previous.digest(i) != digest :
+      return False
+    rows = list(previous.subtree(dirname))
+    childrenpos = {}
+    for j in rows :
+      path, name = poemods_cache.splitname(previous.name(j))
+      childrenpos.setdefault(path, []).append(previous.columns["position"][j])
+    if sorted(childrenpos.get(dirname, [])) != sorted(childrenw) :
+      return False
+    for j in rows :
+      filename = previous.name(j)
+      if j == i or filename.endswith("/") is False :
+        continue
+      position = previous.columns["position"][j]
+      length = previous.columns["length"][j]
+      if position + 48 > self.ggpksize or position + length > self.ggpksize :
+        return False
+      sublength, tag, name_length, child_count = struct.unpack("<I4sII", reader.read(position, 16))
+      if tag != b"PDIR" or sublength != length or 48 + name_length * 2 + 12 * child_count != length :
+        return False
+      buffer = reader.read(position, length)
+      if bytes(buffer[16:48]) != previous.digest(j) :
+        return False
+      bf = 48 + name_length * 2
+      subchildren = [absolute_offset for timestamp, absolute_offset in struct.iter_unpack("<IQ", buffer[bf:bf+12*child_count])]
+      if sorted(childrenpos.get(filename, [])) != sorted(subchildren) :
+        # this directory is walked, the directories below it are tried one by one
+        return False
+    for j in rows :
+      filename = previous.name(j)
+      element = previous.entry(j)
+      if j == i :
+        # the parent directory may have moved
+        element["referenceposition"] = self.refdic[absoluteposition]
+      self.fullfilelistdic[filename] = element
+    self.reusedcount[0] += 1
+    self.reusedcount[1] += len(rows)
+    return True
+  
   def rescanggpk(self, ggpkname, forcerescan, isthemod):
     self.forcescan=forcerescan
     self.isthemod=isthemod
     self.ggpkname=None
     self.ggpksize=0
     self.ggpkhash="ghkf"
-    self.fullfilelist.clear()
-    self.fullfilelistdic.clear()
-    self.refdic.clear()
+    self.closecache()
+    self.closereader()
     self.firstfreerecord=-1
     self.ggpknameinfo=None
+    self.indexpathsname=None
+    self.freespacename=None
+    self.freespaces={}
+    self.freerecords=None
     if os.path.exists(ggpkname) is False :
       self.ggpkname=None
       print("path does not exist : "+ggpkname)
@@ -99,19 +395,19 @@ class listggpkfiles(object):
     ggpknameinfo=ggpknameinfo.replace(':', '')
     ggpknameinfo=ggpknameinfo.replace(' ', '')
     ggpknameinfo=ggpknameinfo.replace('.', '')
-    ggpknameinfo+=".txt"
-    self.fullfilelist.clear()
-    self.fullfilelistdic.clear()
-    self.refdic.clear()
+    ggpknameinfo+=".bin"
     self.ggpkhash="ghkf"
     self.firstfreerecord=-1
     self.ggpknameinfo=os.path.join("keep", ggpknameinfo)
+    self.indexpathsname=os.path.join("keep", ggpknameinfo[:-4] + ".paths.bin")
+    self.freespacename=os.path.join("keep", ggpknameinfo[:-4] + ".free.bin")
     self.ggpksize=os.path.getsize(ggpkname)
     if self.ggpksize<100 :
       self.ggpkname=None
       print("error ggpk size %d" % (self.ggpksize))
       return None
     print("ggpk %s size %d" % (ggpkname, self.ggpksize))
+    self.openreader()
     if self.isthemod is True :
       self.keeplist.clear()
       if os.path.exists(self.keeplistf) is False :
@@ -127,53 +423,21 @@ class listggpkfiles(object):
             data=line.split('\t')
             if len(data)==2 :
               self.keeplist[data[0]]=data[1]
-    self.gethash()
+    self.hashlayers=None
     rescan=True
-    if os.path.exists(self.ggpknameinfo) is True and forcerescan is False :
-      firstline=True
-      with open(self.ggpknameinfo, "r", encoding="UTF-8") as fin :
-        for line in fin :
-          if len(line)>0 :
-            if line[-1]=='\n' :
-              line=line[:-1]
-          data=line.split('\t')
-          if len(data) == 5 :
-            path=data[0]
-            name=data[1]
-            filename=path+name
-            self.fullfilelist.append(filename)
-            self.fullfilelistdic[filename]={
-              "path" : path,
-              "name" : name,
-              "position" : int(data[2]),
-              "length" : int(data[3]),
-              "referenceposition" : int(data[4])
-            }
-          elif len(data) == 7 :
-            path=data[0]
-            name=data[1]
-            filename=path+name
-            self.fullfilelist.append(filename)
-            self.fullfilelistdic[filename]={
-              "path" : path,
-              "name" : name,
-              "position" : int(data[2]),
-              "length" : int(data[3]),
-              "referenceposition" : int(data[4]),
-              "bundlename" : data[5],
-              "hash" : int(data[6]),
-            }
-            self.hashdic[int(data[6])] = filename
-          elif len(line)>0 :
-            if firstline is True :
-              firstline=False
-              if line==self.ggpkhash :
-                rescan=False
-              else :
-                print("hash different : rescan needed")
-                break
-            else :
-              self.firstfreerecord=int(line)
+    if forcerescan is False :
+      cache = poemods_cache.loadcache(self.ggpknameinfo)
+      if cache is not None :
+        if self.samehash(cache.ggpkhash) is True :
+          rescan=False
+          self.cache = cache
+          self.firstfreerecord = cache.firstfreerecord
+          self.settable(poemods_table.filetable(cache))
+          print("%d files read from %s" % (len(self.fullfilelist), self.ggpknameinfo))
+        else :
+          print("hash different : rescan needed")
+          # unchanged directories are taken back from the previous scan
+          self.previouscache = cache
     if rescan is True :
       with open(self.ggpkname, "rb") as ggpk :
         record_length = int.from_bytes(ggpk.read(4), byteorder='little', signed=False)
@@ -201,7 +465,6 @@ class listggpkfiles(object):
           children.append(absolute_offset)
           print("%12d %d %s %12d" % (pos, i, self.pprint(absoff), absolute_offset))
         filename="."
-        self.fullfilelist.append(filename)
         self.fullfilelistdic[filename]={
           "position" : 0,
           "length" : record_length,
@@ -213,401 +476,337 @@ class listggpkfiles(object):
         self.traverse_children(".", children, ggpk)
         print("unused should be none : ", end="")
         print(self.refdic)
+        if self.previouscache is not None :
+          print("reused %d unchanged directories, %d records" % (self.reusedcount[0], self.reusedcount[1]))
+          self.previouscache.close()
+          self.previouscache = None
         self.retrieveindex(ggpk, "./Bundles2/_.index.bin")
-      self.fullfilelist.sort(key=str.lower)
+      self.fullfilelistdic.sort()
       self.saveinfo()
-    bundleinfo = self.fullfilelistdic["./Bundles2/_.index.bin"]
-    headerlength = 46 + len(bundleinfo["name"]) * 2
-    absoluteposition = bundleinfo["position"] + headerlength
+      # the names are read from the cache just written, they are not kept in memory
+      cache = poemods_cache.loadcache(self.ggpknameinfo)
+      if self.fullfilelistdic.attach(cache) is True :
+        self.cache = cache
+      elif cache is not None :
+        cache.close()
     with open(self.ggpkname, "rb") as ggpk :
-      self.sortindex(ggpk, absoluteposition, False)
+      self.sortindex(self.getindexmodel(ggpk), False)
+    self.loadfreespaces()
+    self.loadfreerecords()
     self.getindexondiskinfo()
     
   def getindexondiskinfo(self):
     print("getindexondiskinfo")
     targetfilename = os.path.join("keep", "Bundles2/_.index.bin")
     if os.path.exists(targetfilename) is True:
-      with open(targetfilename, "rb") as fin:
-        self.sortindex(fin, 0, True)
+      st = os.stat(targetfilename)
+      key = (st.st_size, st.st_mtime_ns)
+      if self.indexondisk is None or self.indexondisk.key != key :
+        with open(targetfilename, "rb") as fin:
+          self.indexondisk = poemods_index.indexmodel(key, self.extractbundle(fin, 0))
+      self.sortindex(self.indexondisk, True)
+  
+  def getindexmodel(self, ggpk):
+    # _.index.bin of the ggpk, decompressed again only when its record changed
+    bundleinfo = self.fullfilelistdic["./Bundles2/_.index.bin"]
+    key = (bundleinfo["position"], bundleinfo["length"], bundleinfo.get("digest"))
+    if self.indexmodel is None or self.indexmodel.key != key :
+      headerlength = 46 + len(bundleinfo["name"]) * 2
+      self.indexmodel = poemods_index.indexmodel(key, self.extractbundle(ggpk, bundleinfo["position"] + headerlength))
+    return self.indexmodel
 
-  def decompressbundle(self, ggpk, bundlename, newbundlesize=-1) :
+  def patchbundle(self, ggpk, bundlename, patches, newextractedsize=-1) :
+    # rewrite a bundle with the patches [offset, data] written over its extracted content, and its extracted
+    # size changed to newextractedsize (-1 keeps it) : the blocks changed are decompressed, patched and
+    # compressed again, the other blocks are copied as they are
     bundleinfo = self.fullfilelistdic[bundlename]
-    if "decompressed" in bundleinfo and newbundlesize == -1 :
-      #print("already checked if decompressed once in this session")
-      return False
-    #print(str(bundleinfo))
     headerlength = 46 + len(bundleinfo["name"]) * 2
-    size = bundleinfo["length"]
-    absoluteposition = bundleinfo["position"]
-    ggpk.seek(absoluteposition)
-    header = ggpk.read(headerlength)
-    bundleheader = ggpk.read(15*4)
-    extractedsize = int.from_bytes(bundleheader[0:4], byteorder='little', signed=False)
-    compressedsize = int.from_bytes(bundleheader[4:8], byteorder='little', signed=False)
-    blockcount = int.from_bytes(bundleheader[9*4:10*4], byteorder='little', signed=False)
-    blocksize = int.from_bytes(bundleheader[10*4:11*4], byteorder='little', signed=False)
-    if extractedsize + blockcount * 2 == compressedsize and newbundlesize == -1 :
-      # this bundle is already decompressed
-      bundleinfo["decompressed"] = True
-      #print("this bundle has already been decompressed\n%12d\n%12d" % (extractedsize, compressedsize))
-      return False
-    newextractedsize = extractedsize
-    if newbundlesize != -1 :
-      newextractedsize = newbundlesize
-    else :
-      if bundlename != "./Bundles2/_.index.bin" :
-        print("expand bundle size by 1MB")
-        # else add some space to limit number of full rewrites of bundles
-        newextractedsize += 1000000
-    lastblocksize = newextractedsize % blocksize
-    newblockcount = int((newextractedsize - lastblocksize) / blocksize)
-    if lastblocksize > 0 :
-      newblockcount += 1
-    newcompressedsize = newextractedsize + newblockcount * 2
-    print("decompressbundle (extracted %d -> %d) (compressed %d -> %d) (blockcount %d -> %d) %s" % (extractedsize, newextractedsize, compressedsize, newcompressedsize, blockcount, newblockcount, bundlename))
-    idxd = b''
-    idxd += (newextractedsize).to_bytes(4, byteorder='little', signed=False)
-    idxd += (newcompressedsize).to_bytes(4, byteorder='little', signed=False)
+    absoluteposition = bundleinfo["position"] + headerlength
+    reader = self.readerfor(ggpk)
+    table = self.blocktable(reader, absoluteposition, bundlename)
+    version = self.bundleversion(bundlename, absoluteposition)
+    blocksize = table.blocksize
+    if newextractedsize == -1 :
+      newextractedsize = table.extractedsize
+    for offset, data in patches :
+      newextractedsize = max(newextractedsize, offset + len(data))
+    newblockcount = (newextractedsize + blocksize - 1) // blocksize
+    # blocks whose extracted content changes, with the patches written over each of them
+    touched = {}
+    for offset, data in patches :
+      for i in range(offset // blocksize, (offset + len(data) + blocksize - 1) // blocksize) :
+        touched.setdefault(i, []).append([offset, data])
+    if newextractedsize != table.extractedsize :
+      # the last block changes size, the blocks after it are new
+      for i in range(max(0, min(table.blockcount, newblockcount) - 1), newblockcount) :
+        touched.setdefault(i, [])
+    compressed = []
+    zeroblocks = {}
+    for i in range(newblockcount) :
+      blockstart = i * blocksize
+      decompressedsize = min(blocksize, newextractedsize - blockstart)
+      if i not in touched :
+        offset, size = table.compressed(i)
+        compressed.append(reader.read(absoluteposition + offset, size))
+        continue
+      block = bytearray(blocksize + safespace)
+      if i < table.blockcount :
+        oldsize = table.extracted(i)[1]
+        cached = poemods_blocks.blocks.get((bundlename, i, version))
+        if cached is not None :
+          block[:oldsize] = cached
+        else :
+          offset, size = table.compressed(i)
+          decompressoozinto(reader.read(absoluteposition + offset, size), oldsize, block, 0)
+        block[oldsize:] = bytes(len(block) - oldsize)
+      del block[decompressedsize:]
+      patched = False
+      for offset, data in touched[i] :
+        bi = max(offset, blockstart)
+        bf = min(offset + len(data), blockstart + decompressedsize)
+        if bi < bf :
+          block[bi-blockstart:bf-blockstart] = data[bi-offset:bf-offset]
+          patched = True
+      if i >= table.blockcount and patched is False :
+        # room added at the end of the bundle, the same zeros for every block
+        if decompressedsize not in zeroblocks :
+          zeroblocks[decompressedsize] = compressooz(block, self.compresslevel)
+        compressed.append(zeroblocks[decompressedsize])
+      else :
+        compressed.append(compressooz(block, self.compresslevel))
+    blocksizes = [len(block) for block in compressed]
+    newcompressedsize = sum(blocksizes)
+    print("patchbundle (extracted %d -> %d) (compressed %d -> %d) (blockcount %d -> %d) %d blocks compressed %s" % (table.extractedsize, newextractedsize, table.offsets[-1] - table.offsets[0], newcompressedsize, table.blockcount, newblockcount, len(touched), bundlename))
+    idxd = bytearray(reader.read(absoluteposition, 15*4))
+    # 0*:1*   size extracted
+    # 1*:2*   size compressed
     # 2*:3*   blockcount * 4 + 0x30
-    idxd += (newblockcount * 4 + 0x30).to_bytes(4, byteorder='little', signed=False)
-    # 3*:4*   08 si 1er block decoder 06 kraken
-    #         09 si 1er block decoder 0a
-    #         0d si 1er block decoder 0c
-    idxd += (0x08).to_bytes(4, byteorder='little', signed=False)
-    # 4*:5*   flag size extracted
-    idxd += (0x01).to_bytes(4, byteorder='little', signed=False)
-    # 5*:6*   size extracted
-    idxd += (newextractedsize).to_bytes(4, byteorder='little', signed=False)
-    idxd += (0x00).to_bytes(4, byteorder='little', signed=False)
-    # 7*:8*   size compressed
-    idxd += (newcompressedsize).to_bytes(4, byteorder='little', signed=False)
-    idxd += b'\x00\x00\x00\x00'
+    struct.pack_into("<III", idxd, 0, newextractedsize, newcompressedsize, newblockcount * 4 + 0x30)
+    if 0 in touched :
+      # 3*:4*   08 si 1er block decoder 06 kraken
+      struct.pack_into("<I", idxd, 3*4, 0x08)
+    # 5*:7*   size extracted
+    # 7*:9*   size compressed
     # 9*:10*  number of compressed blocks
-    idxd += (newblockcount).to_bytes(4, byteorder='little', signed=False)
-    # 10*:11* block size 0x40000 = 256 * 1024
-    idxd += (blocksize).to_bytes(4, byteorder='little', signed=False)
-    # 11*:12* zero
-    # 12*:13* zero
-    # 13*:14* zero
-    # 14*:15* zero
-    idxd += b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    # 10*:11* block size
+    struct.pack_into("<QQII", idxd, 5*4, newextractedsize, newcompressedsize, newblockcount, blocksize)
     # compressed size for each compressed block in the bundle
-    blockheader = ggpk.read(blockcount * 4)
-    bf = 0
-    bundled = []
-    for i in range(blockcount) :
-      bi = bf
-      bf = bi + 4
-      bundledfilesize = int.from_bytes(blockheader[bi:bf], byteorder='little', signed=False)
-      bundled.append(bundledfilesize)
-    remaining = newextractedsize
-    for i in range(newblockcount) :
-      if remaining >= blocksize :
-        idxd += (blocksize + 2).to_bytes(4, byteorder='little', signed=False)
-      else :
-        idxd += (remaining + 2).to_bytes(4, byteorder='little', signed=False)
-      remaining -= blocksize
-    remaining = extractedsize
-    for fsize in bundled :
-      compressedblock = ggpk.read(fsize)
-      idxd += b'\xcc\x06'
-      if remaining >= blocksize :
-        decompressed = decompressooz(compressedblock, blocksize)
-      else :
-        decompressed = decompressooz(compressedblock, remaining)
-      idxd += decompressed
-      remaining -= blocksize
-    towrite = newextractedsize - extractedsize
-    firstblock = True
-    while towrite > 0 :
-      if firstblock :
-        firstblock = False
-        lentowrite = blocksize - extractedsize % blocksize
+    idxd += struct.pack("<%dI" % (newblockcount), *blocksizes)
+    indexpathskey = None
+    if bundlename == "./Bundles2/_.index.bin" :
+      indexpathskey = self.indexpathskey()
+    record_length = headerlength + len(idxd) + newcompressedsize
+    atend = bundleinfo["position"] + bundleinfo["length"] == self.ggpksize
+    if newblockcount == table.blockcount and (record_length <= bundleinfo["length"] or atend is True) :
+      # same block table : the record is patched in place from the first block that changes, the record
+      # at the end of the ggpk grows in place
+      self.checkifnewfileversion(bundlename, ggpk)
+      digest = hashlib.sha256(idxd)
+      for block in compressed :
+        digest.update(block)
+      digest = digest.digest()
+      # blocks moved by the ones before them are copied before anything is written over them
+      writes = [[bundleinfo["position"], bytearray(self.recordheader(bundlename, len(idxd) + newcompressedsize, digest)) + idxd]]
+      position = absoluteposition + len(idxd)
+      for i in range(newblockcount) :
+        if i in touched or position != absoluteposition + table.offsets[i] :
+          if writes[-1][0] + len(writes[-1][1]) == position :
+            writes[-1][1] += compressed[i]
+          else :
+            writes.append([position, bytearray(compressed[i])])
+        position += len(compressed[i])
+      compressed.clear()
+      print("patchbundle %s %d bytes written in place at %d" % (bundlename, sum([len(data) for position, data in writes]), bundleinfo["position"]))
+      for position, data in writes :
+        ggpk.seek(position)
+        ggpk.write(data)
+      if self.isthemod :
+        self.keeplist[bundlename] = digest.hex()
+      bundleinfo["digest"] = digest
+      if record_length <= bundleinfo["length"] :
+        self.releaserecord(bundleinfo["position"] + record_length, bundleinfo["length"] - record_length, ggpk)
       else :
-        lentowrite = blocksize
-      if towrite < lentowrite :
-        lentowrite = towrite
-      idxd += b'\x00' * lentowrite
-      towrite -= lentowrite
-      if towrite > 0 :
-        ggpk.write(b'\xcc06')
-    # write the extracted bundle in the ggpk
-    # store the original as reference
-    writethis = self.generateheader(bundlename, idxd)
-    self.writebinarydata(bundlename, writethis, ggpk)
-    bundleinfo["decompressed"] = True
+        self.ggpksize = bundleinfo["position"] + record_length
+        self.freerecords.grow(self.ggpksize)
+      bundleinfo["length"] = record_length
+    else :
+      # write the patched bundle in the ggpk
+      # store the original as reference
+      idxd += b''.join(compressed)
+      compressed.clear()
+      writethis = self.generateheader(bundlename, idxd)
+      self.writebinarydata(bundlename, writethis, ggpk)
+    poemods_blocks.blocks.forget(bundlename)
+    poemods_blocks.tables.forget(bundlename)
+    if indexpathskey is not None :
+      # same paths under the digest of the rewritten record
+      cached = poemods_cache.loadpaths(self.indexpathsname, indexpathskey)
+      if cached is not None :
+        poemods_cache.savepaths(self.indexpathsname, self.indexpathskey(), cached[0], cached[1])
     
   def traverse_children(self, path, children, ggpk):
-    for absoluteposition in children:
-      ggpk.seek(absoluteposition)
-      # maximum 4+4+4+4+32+150*2+12*1437 = 17952
-      buffer = ggpk.read(81920)
-      bi = 0
-      bf = bi+4
-      record_length = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi+4
-      tag = buffer[bi:bf].decode("UTF-8")
-      if tag == "PDIR":
-        bi = bf
-        bf = bi+4
-        name_length = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-        bi = bf
-        bf = bi+4
-        child_count = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-        bi = bf
+    # records are visited by increasing offset instead of depth first, so the file is read forward
+    # and the records lying close to each other come from the same read
+    reader = recordreader(self.readerfor(ggpk), self.ggpksize)
+    pending = [(absoluteposition, path) for absoluteposition in children]
+    heapq.heapify(pending)
+    records = 0
+    while len(pending) > 0 :
+      absoluteposition, path = heapq.heappop(pending)
+      records += 1
+      reader.plan(absoluteposition, pending)
+      record_length, tag = reader.unpack("<I4s", absoluteposition, 8)
+      if tag == b"PDIR":
+        # the children table is part of the record
+        name_length, child_count = reader.unpack("<II", absoluteposition+8, 8)
+        buffer = reader.read(absoluteposition, record_length)
+        bi = 4+4+4+4
         bf = bi+32
-        # digest = buffer[bi:bf]
+        digest = bytes(buffer[bi:bf])
         bi = bf
         bf = bi+name_length * 2
-        name = buffer[bi:bf].decode("UTF-16LE")[:-1]
-        headerlength = bf
-        childrenw = []
+        name = str(buffer[bi:bf], "UTF-16LE")[:-1]
+        childrenw = [absolute_offset for timestamp, absolute_offset in struct.iter_unpack("<IQ", buffer[bf:bf+12*child_count])]
+        if self.reusedirectory(path+name+"/", absoluteposition, record_length, digest, childrenw, reader.reader) :
+          self.refdic.pop(absoluteposition)
+          continue
         for i in range(child_count):
-          bi = bf
-          bf = bi+4
-          #timestamp = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-          bi = bf
-          bf = bi+8
-          pos = absoluteposition+4+4+4+4+32+name_length*2+12*i+4
-          absolute_offset = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-          self.refdic[absolute_offset] = absoluteposition+4+4+4+4+32+name_length*2+12*i+4
-          childrenw.append(absolute_offset)
-        self.fullfilelist.append(path+name+"/")
+          self.refdic[childrenw[i]] = absoluteposition+4+4+4+4+32+name_length*2+12*i+4
+          heapq.heappush(pending, (childrenw[i], path+name+"/"))
         self.fullfilelistdic[path+name+"/"]={
           "position" : absoluteposition,
           "length" : record_length,
           "path" : path,
           "name" : name+"/",
-          "referenceposition" : self.refdic[absoluteposition]
+          "referenceposition" : self.refdic[absoluteposition],
+          "digest" : digest
         }
         self.refdic.pop(absoluteposition)
-        self.traverse_children(path+name+"/", childrenw, ggpk)
-      elif tag == "FILE":
-        bi = bf
-        bf = bi+4
-        name_length = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-        bi = bf
+      elif tag == b"FILE":
+        # only the header is needed, not the data
+        name_length, = reader.unpack("<I", absoluteposition+8, 4)
+        buffer = reader.read(absoluteposition, 4+4+4+32+name_length*2)
+        bi = 4+4+4
         bf = bi+32
-        # digest = buffer[bi:bf]
+        digest = bytes(buffer[bi:bf])
         bi = bf
         bf = bi + name_length * 2
-        name = buffer[bi:bf].decode("UTF-16LE")[:-1]
-        headerlength = bf
-        self.fullfilelist.append(path+name)
+        name = str(buffer[bi:bf], "UTF-16LE")[:-1]
         self.fullfilelistdic[path+name]={
           "position" : absoluteposition,
           "length" : record_length,
           "path" : path,
           "name" : name,
-          "referenceposition" : self.refdic[absoluteposition]
+          "referenceposition" : self.refdic[absoluteposition],
+          "digest" : digest
         }
         self.refdic.pop(absoluteposition)
-      elif tag == "FREE":
-        bi = bf
-        bf = bi+8
-        next_record = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
+      elif tag == b"FREE":
+        next_record, = reader.unpack("<Q", absoluteposition+8, 8)
         if self.firstfreerecord == -1 :
           print("%12d %6d (%4d) %s first free record -> %d" % (absoluteposition, record_length, 8, path, next_record))
           self.firstfreerecord = self.refdic[absoluteposition]
           self.refdic.pop(absoluteposition)
       else:
-        print("new tag " + tag)
+        print("new tag " + str(tag))
+    print("%d records, %d bytes read in %d reads, %d seeks, %d reads from the mapping" % (records, reader.bytesread, reader.reads, reader.seeks, reader.mappedreads))
   
   def fnva(self, filename):
-    hval = 0xcbf29ce484222325
-    filenamemod = filename.lower() + "++"
-    for s in filenamemod :
-      hval = hval ^ ord(s)
-      hval = (hval * 0x100000001b3) % uint_max
-      hval = hval & ((1 << 64) - 1)
-    return hval
+    return poemods_index.fnv1a(filename)
   
-  def sortindex(self, ggpk, absoluteposition, indexondisk) :
-    buffer = self.extractbundle(ggpk, absoluteposition)
-    bundlelist = []
-    bi = 0
-    bf = bi + 4
-    bundle_count = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-    for i in range(bundle_count) :
-      bi = bf
-      bf = bi + 4
-      name_length = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + name_length
-      if not indexondisk :
-        name = str(buffer[bi:bf], "UTF-8")
-      bi = bf
-      bf = bi + 4
-      if not indexondisk :
-        bundle_uncompressed_size = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-        bundlename = "./Bundles2/" + name + ".bundle.bin"
-        self.fullfilelistdic[bundlename]["idxunsizepos"] = bi
-        self.fullfilelistdic[bundlename]["idxunsize"] = bundle_uncompressed_size
-        bundlelist.append(bundlename)
-    bi = bf
-    bf = bi + 4
-    file_count = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-    for i in range(file_count) :
-      bi = bf
-      bf = bi + 8
-      hashf = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + 4
-      bundle_index = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + 4
-      file_offset = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + 4
-      file_size = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      if indexondisk :
-        # old index might not have this new added file
-        if hashf in self.hashdic :
-          thisfilename = self.hashdic[hashf]
-          self.fullfilelistdic[thisfilename]["oposition"] = file_offset
-          self.fullfilelistdic[thisfilename]["olength"] = file_size
-      else :
-        thisfilename = self.hashdic[hashf]
-        bundlename = bundlelist[bundle_index]
+  def sortindex(self, index, indexondisk) :
+    files = index.files
+    if indexondisk :
+      # offsets and sizes of the original files are looked up by hash when a kept bundle is read
+      index.lookup()
+    else :
+      # the files of a bundle are listed by preparebundle, only for the bundles written to
+      for i in range(len(index.bundlenames)) :
+        bundlename = "./Bundles2/" + index.bundlenames[i] + ".bundle.bin"
         bundleinfo = self.fullfilelistdic[bundlename]
-        if "flist" not in bundleinfo:
-          bundleinfo["sorted"] = False
-          bundleinfo["flist"] = []
-        bundleinfo["flist"].append([file_offset, file_size, bf - 20, thisfilename])
-    if not indexondisk :
-      self.indexbundle = io.BytesIO(buffer[:bf])
-    print("sortindex %d bundles %d files" % (bundle_count, file_count))
+        bundleinfo["idxunsizepos"] = index.bundlesizepos[i]
+        bundleinfo["idxunsize"] = index.bundlesizes[i]
+        bundleinfo["bundleindex"] = i
+        bundleinfo["sorted"] = False
+      self.indexbundle = index.writable()
+      self.sortedindex = index
+    print("sortindex %d bundles %d files" % (len(index.bundlenames), len(files)))
   
   def retrieveindex(self, ggpk, filename):
     bundleinfo = self.fullfilelistdic[filename]
     headerlength = 46 + len(bundleinfo["name"]) * 2
     absoluteposition = bundleinfo["position"] + headerlength
-    buffer = self.extractbundle(ggpk, absoluteposition)
-    # bundle name list
-    bundlelist = []
-    bi = 0
-    bf = bi + 4
-    bundle_count = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-    for i in range(bundle_count) :
-      bi = bf
-      bf = bi + 4
-      name_length = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + name_length
-      name = str(buffer[bi:bf], "UTF-8")
-      bi = bf
-      bf = bi + 4
-      bundle_uncompressed_size = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bundlelist.append([name, bundle_uncompressed_size])
+    index = self.getindexmodel(ggpk)
     # file to bundle link
-    filelist = {}
-    bi = bf
-    bf = bi + 4
-    file_count = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-    for i in range(file_count) :
-      bi = bf
-      bf = bi + 8
-      hash = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + 4
-      bundle_index = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + 4
-      file_offset = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + 4
-      file_size = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      filelist[hash] = [bundle_index, file_offset, file_size]
-    # complete file list generation
-    bi = bf
-    bf = bi + 4
-    path_rep_count = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-    pathrep = []
-    for i in range(path_rep_count) :
-      bi = bf
-      bf = bi + 8
-      #hash = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + 4
-      payload_offset = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + 4
-      payload_size = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      bi = bf
-      bf = bi + 4
-      #payload_recursive_size = int.from_bytes(buffer[bi:bf], byteorder='little', signed=False)
-      pathrep.append([payload_offset, payload_size])
-    bi = bf
-    print("retrieveindex %d bundles %d files" % (bundle_count, file_count))
+    bundlelist = index.bundlenames
+    filelookup = index.lookup()
+    bundles = index.files.values("bundle")
+    offsets = index.files.values("offset")
+    sizes = index.files.values("size")
+    print("retrieveindex %d bundles %d files" % (len(bundlelist), len(index.files)))
     # link filename to bundles
-    pathbuf = self.extractbundle(io.BytesIO(buffer[bf:]), 0)
-    pathbufl = len(pathbuf)
-    results = []
-    for pathi in pathrep :
-      basephase = False
-      bases = []
-      bf = pathi[0]
-      bfmax = pathi[0] + pathi[1]
-      while bf < bfmax :
-        bi = bf
-        bf = bf + 4
-        cmd = int.from_bytes(pathbuf[bi:bf], byteorder='little', signed=False)
-        if cmd == 0 :
-          basephase = not basephase
-          if basephase :
-            bases.clear()
-        else :
-          fragment = ""
-          while bf < bfmax :
-            if pathbuf[bf] == 0x0 :
-              bf += 1
-              break
-            fragment += "%c" % pathbuf[bf]
-            bf += 1
-          index = cmd - 1
-          if index < len(bases) :
-            full = bases[index] + fragment
-            if basephase :
-              bases.append(full)
-            else :
-              results.append(full)
-          else :
-            if basephase :
-              bases.append(fragment)
-            else :
-              results.append(fragment)
-    for fullpath in results :
-      hash = self.fnva(fullpath)
-      if hash not in filelist :
-        print("error hash not found " + fullpath)
+    paths = self.indexpaths(index)
+    while True :
+      batch = list(itertools.islice(paths, 65536))
+      if len(batch) == 0 :
         break
-      thisfile = filelist[hash]
-      thisbundle = bundlelist[thisfile[0]]
-      fullpath = "./" + fullpath
-      namei = fullpath.rfind("/")
-      path = fullpath[:namei+1]
-      name = fullpath[namei+1:]
-      self.fullfilelist.append(fullpath)
-      self.fullfilelistdic[fullpath] = {
-        "position" : thisfile[1],
-        "length" : thisfile[2],
-        "path" : path,
-        "name" : name,
-        "referenceposition" : absoluteposition,
-        "bundlename" : "./Bundles2/" + thisbundle[0] + ".bundle.bin",
-        "hash" : hash,
-      }
-      self.hashdic[hash] = fullpath
+      rows = filelookup.findall([hash for fullpath, hash in batch])
+      for i in range(len(batch)) :
+        fullpath, hash = batch[i]
+        row = rows[i]
+        if row == -1 :
+          print("error hash not found " + fullpath)
+          return
+        thisbundle = bundlelist[bundles[row]]
+        fullpath = "./" + fullpath
+        namei = fullpath.rfind("/")
+        path = fullpath[:namei+1]
+        name = fullpath[namei+1:]
+        self.fullfilelistdic[fullpath] = {
+          "position" : offsets[row],
+          "length" : sizes[row],
+          "path" : path,
+          "name" : name,
+          "referenceposition" : absoluteposition,
+          "bundlename" : "./Bundles2/" + thisbundle + ".bundle.bin",
+          "hash" : hash,
+        }
     
+  def indexpathskey(self):
+    digest = self.fullfilelistdic["./Bundles2/_.index.bin"].get("digest")
+    if digest is None :
+      return None
+    return bytes(digest).hex()
+  
+  def indexpaths(self, index):
+    # (path, hash) of the index, decoded again only when the digest of the _.index.bin record changed
+    # moving files inside bundles does not change the paths so our own writes keep them
+    key = self.indexpathskey()
+    if key is not None :
+      cached = poemods_cache.loadpaths(self.indexpathsname, key)
+      if cached is not None :
+        print("%d index paths read from %s" % (len(cached[0]), self.indexpathsname))
+        yield from zip(cached[0], cached[1])
+        return
+    paths = []
+    hashes = []
+    for path, hashf in index.paths(lambda payload : self.extractbundle(io.BytesIO(payload), 0)) :
+      paths.append(path)
+      hashes.append(hashf)
+      yield path, hashf
+    if key is not None and len(paths) > 0 :
+      poemods_cache.savepaths(self.indexpathsname, key, paths, hashes)
+  
   def extractbundle(self, ggpk, absoluteposition):
-    ggpk.seek(absoluteposition)
-    bundleheader = ggpk.read(15*4)
+    reader = self.readerfor(ggpk)
+    bundleheader = reader.read(absoluteposition, 15*4)
     extractedsize = int.from_bytes(bundleheader[0:4], byteorder='little', signed=False)
     compressedsize = int.from_bytes(bundleheader[4:8], byteorder='little', signed=False)
     blockcount = int.from_bytes(bundleheader[9*4:10*4], byteorder='little', signed=False)
     blocksize = int.from_bytes(bundleheader[10*4:11*4], byteorder='little', signed=False)
-    blockheader = ggpk.read(blockcount * 4)
+    blockheader = reader.read(absoluteposition + 15*4, blockcount * 4)
+    if nativebundle is True :
+      return self.extractbundlenative(reader, absoluteposition, blockheader, extractedsize)
     bf = 0
     bundled = []
     for i in range(blockcount) :
@@ -615,133 +814,181 @@ class listggpkfiles(object):
       bf = bi + 4
       bundledfilesize = int.from_bytes(blockheader[bi:bf], byteorder='little', signed=False)
       bundled.append(bundledfilesize)
-    idxd = b''
+    # one output for the whole bundle, every block is decompressed at its place
+    idxd = bytearray(extractedsize + safespace)
     remaining = extractedsize
+    position = 0
+    compressedposition = absoluteposition + 15*4 + blockcount * 4
+    blocks = []
     for fsize in bundled :
-      compressedblock = ggpk.read(fsize)
-      if remaining >= blocksize :
-        decompressed = decompressooz(compressedblock, blocksize)
-      else :
-        decompressed = decompressooz(compressedblock, remaining)
-      idxd += decompressed
+      compressedblock = reader.read(compressedposition, fsize)
+      blocks.append([compressedblock, min(remaining, blocksize), position])
+      compressedposition += fsize
+      position += blocksize
       remaining -= blocksize
+    self.decoder.decode(blocks, idxd)
+    del idxd[extractedsize:]
     return idxd
   
-  def updateindexbundle(self) :
-    if self.indexbundle is not None :
-      self.indexbundle.seek(0)
-      indexbundle = self.indexbundle.read()
-      print("write back modified index bundle of size %d" % (len(indexbundle)))
+  def extractbundlenative(self, reader, absoluteposition, blockheader, extractedsize):
+    # the whole bundle is given to libooz, it walks the block table and decompresses every block
+    # with a decoder kept by each of its threads
+    compressedsize = sum(struct.unpack("<%dI" % (len(blockheader) // 4), blockheader))
+    bundle = reader.read(absoluteposition, 15*4 + len(blockheader) + compressedsize)
+    idxd = bytearray(extractedsize + safespace)
+    unpacked_size = ooz.Ooz_DecompressBundle(ffi.from_buffer("uint8_t[]", bundle), len(bundle), 0, extractedsize, ffi.from_buffer("uint8_t[]", idxd), self.decoder.threads)
+    if unpacked_size != extractedsize :
+      print("Error : \n%12d unpacked_size\n%12d extracted size" % (unpacked_size, extractedsize))
+    del idxd[extractedsize:]
+    return idxd
+  
+  def updateindexbundle(self, ggpk=None) :
+    # True if the index was written back, in ggpk if it is already opened for writing
+    if self.indexbundle is None or self.fullfilelistdic["./Bundles2/_.index.bin"].get("modified") is not True :
+      return False
+    self.indexbundle.seek(0)
+    indexbundle = self.indexbundle.read()
+    print("write back modified index bundle of size %d" % (len(indexbundle)))
+    # the parsed index does not match what is in the ggpk anymore
+    self.indexmodel = None
+    if ggpk is None :
       with open(self.ggpkname, "r+b") as ggpk :
         self.insertfileintobundle(ggpk, "./Bundles2/_.index.bin", 0, indexbundle)
+    else :
+      self.insertfileintobundle(ggpk, "./Bundles2/_.index.bin", 0, indexbundle)
+    self.fullfilelistdic["./Bundles2/_.index.bin"]["modified"] = False
+    # the index record moved
+    self.saveinfo()
+    self.savefreespaces()
+    return True
   
-  def insertfileintobundle(self, ggpk, bundlename, offset, writethis) :
-    bundleinfo = self.fullfilelistdic[bundlename]
-    headerlength = 46 + len(bundleinfo["name"]) * 2
-    ggpk.seek(bundleinfo["position"])
-    header = ggpk.read(headerlength)
-    bundleheader = ggpk.read(15*4)
-    extractedsize = int.from_bytes(bundleheader[0:4], byteorder='little', signed=False)
-    compressedsize = int.from_bytes(bundleheader[4:8], byteorder='little', signed=False)
-    blockcount = int.from_bytes(bundleheader[9*4:10*4], byteorder='little', signed=False)
-    blocksize = int.from_bytes(bundleheader[10*4:11*4], byteorder='little', signed=False)
-    # check if bundle extracted otherwise do not write anything (first boot and index never extracted etc...)
-    if extractedsize + blockcount * 2 != compressedsize :
-      print("this bundle is not decompressed cannot insertfileintobundle len %d at bundle pos %d at offset %d %s blockcount %d blocksize %d" % (len(writethis), bundleinfo["position"], offset, bundlename, blockcount, blocksize))
-      return False
-    headerblock = ggpk.read(4 * blockcount)
-    bundleoffset = bundleinfo["position"] + headerlength + 15 * 4 + 4 * blockcount
-    bundleoffset += offset + 2 * (int((offset - offset % blocksize) / blocksize) + 1)
-    ggpk.seek(bundleoffset)
-    towrite = len(writethis)
-    firstblock = True
-    bf = 0
-    while towrite > 0 :
-      if firstblock :
-        firstblock = False
-        lentowrite = blocksize - offset % blocksize
-      else :
-        lentowrite = blocksize
-      if towrite < lentowrite :
-        lentowrite = towrite
-      bi = bf
-      bf = bi + lentowrite
-      ggpk.write(writethis[bi:bf])
-      towrite -= lentowrite
-      if towrite > 0 :
-        sepa = ggpk.read(2)
-        if sepa != b'\xcc\x06' :
-          print("error not cc06 found : " + self.pprinthex(sepa))
+  def loadfreespaces(self):
+    # free space of the bundles saved with the index, if the index did not change since
+    self.freespaces = {}
+    bundles = poemods_cache.loadfree(self.freespacename, self.indexpathskey())
+    if bundles is not None :
+      for bundlename in bundles :
+        size, end, holes = bundles[bundlename]
+        self.freespaces[bundlename] = poemods_free.freespace(size, end, holes)
+      print("free space of %d bundles read from %s" % (len(bundles), self.freespacename))
+  
+  def loadfreerecords(self):
+    # FREE records of the ggpk, the records moved are written in them and leave new ones
+    # without a first free record the records moved are written at the end of the ggpk
+    if self.firstfreerecord == -1 :
+      self.freerecords = poemods_free.freerecords(self.ggpksize, -1)
+    else :
+      self.freerecords = poemods_free.fromchain(self.reader, self.ggpksize, self.firstfreerecord)
+    print("ggpk free records : %d holes %d bytes (largest %d)" % self.freerecords.stats()[:3])
+  
+  def allocaterecord(self, length, ggpkpointer):
+    # position of a record of length bytes, the FREE records are updated before the record is written
+    position = self.freerecords.allocate(length)
+    self.freerecords.flush(ggpkpointer)
+    self.ggpksize = max(self.ggpksize, position + length)
+    return position
+  
+  def releaserecord(self, position, length, ggpkpointer):
+    # bytes no record uses anymore become a FREE record
+    self.freerecords.release(position, length)
+    self.freerecords.flush(ggpkpointer)
+  
+  def savefreespaces(self):
+    key = self.indexpathskey()
+    if key is None or self.freespacename is None :
+      return
+    bundles = {}
+    for bundlename in self.freespaces :
+      freespace = self.freespaces[bundlename]
+      bundles[bundlename] = (freespace.size, freespace.end, freespace.holes())
+    poemods_cache.savefree(self.freespacename, key, bundles)
+  
+  def insertfileintobundle(self, ggpk, bundlename, offset, writethis, newbundlesize=-1) :
+    # the blocks holding the file are compressed again, the bundle is resized at the same time
+    self.patchbundle(ggpk, bundlename, [[offset, writethis]], newbundlesize)
     
-      
+  def bundleversion(self, bundlename, absoluteposition):
+    # which content of a bundle the blocks come from, absoluteposition 0 is the original kept on disk
+    if absoluteposition == 0 :
+      return ("keep", self.keeplist.get(bundlename))
+    bundleinfo = self.fullfilelistdic[bundlename]
+    return (bundleinfo["position"], bundleinfo.get("digest"))
+  
+  def blocktable(self, reader, absoluteposition, bundlename):
+    # block table of a bundle, read and parsed once for each version of the bundle
+    key = (bundlename, self.bundleversion(bundlename, absoluteposition))
+    table = poemods_blocks.tables.get(key)
+    if table is None :
+      blockcount = int.from_bytes(reader.read(absoluteposition + 9*4, 4), byteorder='little', signed=False)
+      table = poemods_blocks.blocktable(reader.read(absoluteposition, 15*4 + blockcount * 4))
+      poemods_blocks.tables.put(key, table)
+    return table
+  
+  def bundledrange(self, filename, absoluteposition):
+    # (offset, size) of a file inside its bundle, None if the original kept on disk does not have it
+    extractfile = self.fullfilelistdic[filename]
+    if absoluteposition != 0 :
+      return extractfile["position"], extractfile["length"]
+    # if the bundle is on disk we need the position/length from the index on disk
+    with self.keeplock :
+      if self.indexondisk is None :
+        self.getindexondiskinfo()
+      indexondisk = self.indexondisk
+    row = -1
+    if indexondisk is not None :
+      row = indexondisk.lookup().find(extractfile["hash"])
+    if row == -1 :
+      return None
+    return int(indexondisk.files["offset"][row]), int(indexondisk.files["size"][row])
+  
   def extractfilefrombundle(self, ggpk, absoluteposition, filename, limit):
-    ggpk.seek(absoluteposition)
-    bundleheader = ggpk.read(15*4)
-    extractedsize = int.from_bytes(bundleheader[0:4], byteorder='little', signed=False)
-    compressedsize = int.from_bytes(bundleheader[4:8], byteorder='little', signed=False)
-    blockcount = int.from_bytes(bundleheader[9*4:10*4], byteorder='little', signed=False)
-    blocksize = int.from_bytes(bundleheader[10*4:11*4], byteorder='little', signed=False)
+    reader = self.readerfor(ggpk)
     # look for file position inside bundle
     extractfile = self.fullfilelistdic[filename]
-    start = extractfile["position"]
-    length = extractfile["length"]
-    if absoluteposition == 0 :
-      # if the bundle is on disk we need the position/length from the index on disk
-      if "oposition" not in extractfile :
-        self.getindexondiskinfo()
-      if "oposition" in extractfile :
-        start = extractfile["oposition"]
-        length = extractfile["olength"]
-      else :
-        return b'<original file not found>'
+    bundlename = extractfile["bundlename"]
+    table = self.blocktable(reader, absoluteposition, bundlename)
+    filerange = self.bundledrange(filename, absoluteposition)
+    if filerange is None :
+      return b'<original file not found>'
+    start, length = filerange
     if limit != -1 and length > limit :
       length = limit
-    end = start + length
-    blockstart = -1
-    blockstartati = -1
-    # compressed size for each compressed file in the bundle
-    blockheader = ggpk.read(blockcount * 4)
-    bf = 0
-    bundled = []
-    currxpos = 0
-    bundledfilesizesum = 0
-    for i in range(blockcount) :
-      if blockstart == -1 and start < currxpos + blocksize :
-        # first block containing start of file
-        blockstart = absoluteposition + 15 * 4 + 4 * blockcount + bundledfilesizesum
-        blockstartati = i
-      # current compressed block size
-      bi = bf
-      bf = bi + 4
-      bundledfilesize = int.from_bytes(blockheader[bi:bf], byteorder='little', signed=False)
-      if blockstart != -1 :
-        # record this compressed block size
-        bundled.append(bundledfilesize)
-      if end < currxpos + blocksize :
-        # this was the last block containing the end of the file
-        break
-      # current extracted position
-      currxpos += blocksize
-      # current compressed position
-      bundledfilesizesum += bundledfilesize
-    # retrieve file data
-    ggpk.seek(blockstart)
-    decalage = blocksize * blockstartati
-    remaining = extractedsize - decalage
-    idxd = b''
-    for fsize in bundled :
-      compressedblock = ggpk.read(fsize)
-      if remaining >= blocksize :
-        decompressed = decompressooz(compressedblock, blocksize)
+    end = min(start + length, table.extractedsize)
+    blocks = table.blocks(start, end)
+    if len(blocks) == 0 :
+      return b''
+    # retrieve file data, the blocks decompressed before come from the block cache
+    version = self.bundleversion(bundlename, absoluteposition)
+    decalage = table.blocksize * blocks[0]
+    # one output for the blocks holding the file, trimmed to the file in place
+    # the missing blocks are decompressed first, the cached ones copied after so the safe space of a
+    # decompressed block does not overwrite them
+    idxd = bytearray(table.blocksize * len(blocks) + safespace)
+    position = 0
+    missing = []
+    cached = []
+    for i in blocks :
+      key = (bundlename, i, version)
+      decompressedsize = table.extracted(i)[1]
+      decompressed = poemods_blocks.blocks.get(key)
+      if decompressed is not None :
+        cached.append([decompressed, position])
       else :
-        decompressed = decompressooz(compressedblock, remaining)
-      idxd += decompressed
-      remaining -= blocksize
+        offset, size = table.compressed(i)
+        compressedblock = reader.read(absoluteposition + offset, size)
+        missing.append([compressedblock, decompressedsize, position, key])
+      position += decompressedsize
+    if self.decoder.decode([block[:3] for block in missing], idxd) is True :
+      for compressedblock, decompressedsize, blockposition, key in missing :
+        poemods_blocks.blocks.put(key, bytes(memoryview(idxd)[blockposition:blockposition+decompressedsize]))
+    for decompressed, blockposition in cached :
+      idxd[blockposition:blockposition+len(decompressed)] = decompressed
     # correct offset
-    start -= decalage
-    end -= decalage
-    return idxd[start:end]
+    del idxd[end-decalage:]
+    del idxd[:start-decalage]
+    return idxd
   
+
   def pprinthex(self, b):
     display = ""
     for i in range(len(b)) :
@@ -763,19 +1010,80 @@ class listggpkfiles(object):
         display += "%02x" % b[i]
     return display
   
-  def gethash(self):
-    ggpksize=self.ggpksize
-    hashstart=""
-    hashend=""
-    hashlength=20000000
+  def getstathash(self):
+    st = os.stat(self.ggpkname)
+    return "%d:%d:%d" % (st.st_size, st.st_mtime_ns, st.st_ino)
+  
+  def getrecordhash(self, indexposition):
+    # ggpk record, headers of its two children (the root PDIR digest changes with anything below it)
+    # and header of _.index.bin, the position of _.index.bin is kept with the hash
+    hrecords = hashlib.blake2b(digest_size=16)
+    with open(self.ggpkname, "rb") as fin :
+      ggpkrecord = fin.read(28)
+      hrecords.update(ggpkrecord)
+      for bi in range(12, len(ggpkrecord) - 7, 8) :
+        fin.seek(int.from_bytes(ggpkrecord[bi:bi+8], byteorder='little', signed=False))
+        hrecords.update(fin.read(48))
+      if indexposition != -1 :
+        fin.seek(indexposition)
+        hrecords.update(fin.read(44))
+    return "%d:%s" % (indexposition, hrecords.hexdigest())
+  
+  def getsamplehash(self):
+    # blocks spread over the whole file, first and last ones included
+    ggpksize = os.path.getsize(self.ggpkname)
+    hsamples = hashlib.blake2b(digest_size=16)
     with open(self.ggpkname, "rb") as fin :
-      fin.seek(0)
-      ggpkpart=fin.read(hashlength)
-      hashstart=hashlib.sha256(ggpkpart).hexdigest()
-      fin.seek(ggpksize-hashlength)
-      ggpkpart=fin.read(hashlength)
-      hashend=hashlib.sha256(ggpkpart).hexdigest()
-    self.ggpkhash=hashstart+hashend+str(ggpksize)
+      if ggpksize <= hashsamples * hashsamplesize :
+        hsamples.update(fin.read())
+      else :
+        for i in range(hashsamples) :
+          fin.seek(i * (ggpksize - hashsamplesize) // (hashsamples - 1))
+          hsamples.update(fin.read(hashsamplesize))
+    return hsamples.hexdigest()
+  
+  def gethashlayers(self):
+    # the layers are kept for the session while the size, modification time and inode do not change
+    stathash = self.getstathash()
+    if self.hashlayers is None or self.hashlayers[0] != stathash :
+      self.hashlayers = [stathash, None, None]
+    return self.hashlayers
+  
+  def gethash(self):
+    # ggpk hash "stat/records/samples", from the cheapest layer to the most expensive one
+    layers = self.gethashlayers()
+    indexposition = -1
+    if "./Bundles2/_.index.bin" in self.fullfilelistdic :
+      indexposition = self.fullfilelistdic["./Bundles2/_.index.bin"]["position"]
+    if layers[1] is None or layers[1].startswith("%d:" % (indexposition)) is False :
+      layers[1] = self.getrecordhash(indexposition)
+    if layers[2] is None :
+      layers[2] = self.getsamplehash()
+    self.ggpkhash = "/".join(layers)
+  
+  def samehash(self, ggpkhash):
+    # compare with the hash of a previous session, a layer is only computed when the previous one can not decide
+    previouslayers = ggpkhash.split("/")
+    if len(previouslayers) != 3 :
+      return False
+    layers = self.gethashlayers()
+    if previouslayers[0] == layers[0] :
+      # not touched since
+      self.hashlayers = previouslayers
+      self.ggpkhash = ggpkhash
+      return True
+    indexposition = int(previouslayers[1].split(":")[0])
+    layers[1] = self.getrecordhash(indexposition)
+    if previouslayers[1] != layers[1] :
+      print("ggpk records changed")
+      return False
+    # touched or copied but the records are the same, compare the content
+    layers[2] = self.getsamplehash()
+    if previouslayers[2] != layers[2] :
+      print("ggpk content changed")
+      return False
+    self.ggpkhash = "/".join(layers)
+    return True
   
   def saveinfo(self):
     self.gethash()
@@ -783,30 +1091,7 @@ class listggpkfiles(object):
       with open(self.keeplistf, "w") as fout :
         for filename in self.keeplist :
           fout.write("%s\t%s\n" % (filename, self.keeplist[filename]))
-    with open(self.ggpknameinfo, "w") as fout :
-      fout.write("%s\n" % (self.ggpkhash))
-      fout.write("%d\n" % (self.firstfreerecord))
-      for filename in self.fullfilelist :
-        if filename in self.fullfilelistdic :
-          element = self.fullfilelistdic[filename]
-          if "bundlename" not in element :
-            fout.write("%s\t%s\t%d\t%d\t%d\n" % (
-              element["path"],
-              element["name"],
-              element["position"],
-              element["length"],
-              element["referenceposition"],
-            ))
-          else :
-            fout.write("%s\t%s\t%d\t%d\t%d\t%s\t%d\n" % (
-              element["path"],
-              element["name"],
-              element["position"],
-              element["length"],
-              element["referenceposition"],
-              element["bundlename"],
-              element["hash"],
-            ))
+    poemods_cache.savecache(self.ggpknameinfo, self.ggpkhash, self.firstfreerecord, self.fullfilelistdic)
   
   def defragment(self, defragmentto):
     #if self.forcescan is False :
@@ -819,16 +1104,16 @@ class listggpkfiles(object):
     pos=0
     with open(defragmentto, "wb") as ggpkout :
       with open(self.ggpkname, "rb") as ggpk :
-        ggpk.seek(self.fullfilelistdic["."]["position"])
-        data=ggpk.read(self.fullfilelistdic["."]["length"])
-        ggpkout.write(data)
+        # records are copied chunksize at a time, a bundle is never read whole
+        for chunk in self.recordchunks(ggpk, self.fullfilelistdic["."]["position"], self.fullfilelistdic["."]["length"]) :
+          ggpkout.write(chunk)
         pos+=self.fullfilelistdic["."]["length"]
         for name in self.fullfilelist :
-          if name=="." :
+          if name=="." or "bundlename" in self.fullfilelistdic[name] :
+            # files inside bundles are not records of the ggpk
             continue
-          ggpk.seek(self.fullfilelistdic[name]["position"])
-          data=ggpk.read(self.fullfilelistdic[name]["length"])
-          ggpkout.write(data)
+          for chunk in self.recordchunks(ggpk, self.fullfilelistdic[name]["position"], self.fullfilelistdic[name]["length"]) :
+            ggpkout.write(chunk)
           fullfilelist2dic[name]=copy.copy(self.fullfilelistdic[name])
           fullfilelist2dic[name]["position"]=pos
           path=self.fullfilelistdic[name]["path"]
@@ -898,38 +1183,42 @@ class listggpkfiles(object):
     if "bundlename" in fileinfo :
       # files inside bundles have no headers
       return writethis
+    bwritethis = self.recordheader(filename, len(writethis), hashlib.sha256(writethis).digest()) + writethis
+    print("generateheader %s" % (filename))
+    return bwritethis
+  
+  def recordheader(self, filename, length, digest):
+    # FILE record header for length bytes of data with this sha256
+    fileinfo = self.fullfilelistdic[filename]
     justfilename = fileinfo["name"].encode("UTF-16-LE")+b'\x00\x00'
     justfilenamel = len(fileinfo["name"])+1
     headerlength = 46 + len(fileinfo["name"])*2
-    record_length = headerlength + len(writethis)
+    record_length = headerlength + length
     field1 = (record_length).to_bytes(4, byteorder='little', signed=False)
     field2 = "FILE".encode("UTF-8")
     field3 = (justfilenamel).to_bytes(4, byteorder='little', signed=False)
-    field4 = hashlib.sha256(writethis).digest()
+    field4 = digest
     field5 = justfilename
-    bwritethis = field1 + field2 + field3 + field4 + field5 + writethis
-    print("generateheader %s" % (filename))
-    return bwritethis
+    return field1 + field2 + field3 + field4 + field5
   
   def checkifnewfileversion(self, filename, ggpkpointer) :
     if self.isthemod :
-      if "newversionchecked" in self.fullfilelistdic[filename] :
-        # we already checked for a new version of this file/bundle in this session
-        return True
-      self.fullfilelistdic[filename]["newversionchecked"] = True
-      fileinfo = self.fullfilelistdic[filename]
-      ggpkpointer.seek(fileinfo["position"])
-      beforefiledata = ggpkpointer.read(fileinfo["length"])
-      filehash = beforefiledata[12:44].hex()
-      if filename not in self.keeplist :
-        print("checkifnewfileversion filename not in keeplist : store file to disk %s" % (filename))
+      with self.keeplock :
+        if "newversionchecked" in self.fullfilelistdic[filename] :
+          # we already checked for a new version of this file/bundle in this session
+          return True
+        self.fullfilelistdic[filename]["newversionchecked"] = True
+        fileinfo = self.fullfilelistdic[filename]
         filestart = 46 + len(fileinfo["name"])*2
-        self.storefiletodisk(filename, beforefiledata[filestart:])
-      else :
-        if self.keeplist[filename] != filehash :
-          print("checkifnewfileversion keeplist filehash new version found : store file to disk %s" % (filename))
-          filestart = 46 + len(fileinfo["name"])*2
-          self.storefiletodisk(filename, beforefiledata[filestart:])
+        filehash = self.readerfor(ggpkpointer).read(fileinfo["position"], filestart)[12:44].hex()
+        filechunks = self.recordchunks(ggpkpointer, fileinfo["position"] + filestart, fileinfo["length"] - filestart)
+        if filename not in self.keeplist :
+          print("checkifnewfileversion filename not in keeplist : store file to disk %s" % (filename))
+          self.storefiletodisk(filename, filechunks)
+        else :
+          if self.keeplist[filename] != filehash :
+            print("checkifnewfileversion keeplist filehash new version found : store file to disk %s" % (filename))
+            self.storefiletodisk(filename, filechunks)
   
   def writebinarydata(self, filename, writethis, ggpkpointer) :
     if "bundlename" in self.fullfilelistdic[filename] :
@@ -944,244 +1233,368 @@ class listggpkfiles(object):
     if "bundlename" not in fileinfo :
       if self.isthemod :
         self.keeplist[filename] = writethis[12:44].hex()
+      fileinfo["digest"] = writethis[12:44]
       record_length = len(writethis)
       if record_length <= fileinfo["length"] :
         print("onlywritebinarydata %s size %d at %d" % (filename, record_length, fileinfo["position"]))
         ggpkpointer.seek(fileinfo["position"])
         ggpkpointer.write(writethis)
+        self.releaserecord(fileinfo["position"] + record_length, fileinfo["length"] - record_length, ggpkpointer)
         fileinfo["length"] = record_length
       else :
-        endofggpk = self.ggpksize
-        print("onlywritebinarydata %s size %d (position %d -> end of ggpk %d) modify refpos at %d" % (filename, record_length, fileinfo["position"], endofggpk, fileinfo["referenceposition"]))
-        ggpkpointer.seek(endofggpk)
+        newposition = self.allocaterecord(record_length, ggpkpointer)
+        print("onlywritebinarydata %s size %d (position %d -> %d, ggpk size %d) modify refpos at %d" % (filename, record_length, fileinfo["position"], newposition, self.ggpksize, fileinfo["referenceposition"]))
+        ggpkpointer.seek(newposition)
         ggpkpointer.write(writethis)
         ggpkpointer.seek(fileinfo["referenceposition"])
-        bggpksize = (endofggpk).to_bytes(8, byteorder='little', signed=False)
-        ggpkpointer.write(bggpksize)
-        fileinfo["position"] = endofggpk
+        bnewposition = (newposition).to_bytes(8, byteorder='little', signed=False)
+        ggpkpointer.write(bnewposition)
+        # the old record becomes free once nothing points at it
+        self.releaserecord(fileinfo["position"], fileinfo["length"], ggpkpointer)
+        fileinfo["position"] = newposition
         fileinfo["length"] = record_length
-        self.ggpksize = endofggpk + record_length
     else :
-      
-      # if the index has not been decompressed yet decompress it
-      self.decompressbundle(ggpkpointer, "./Bundles2/_.index.bin")
-      
-      bundlename = fileinfo["bundlename"]
-      newlength = len(writethis) # there is no header here, neither in this writethis nor in fileinfo["length"]
-      bundleinfo = self.fullfilelistdic[bundlename]
-      bundlesize = bundleinfo["idxunsize"]
-      position = fileinfo["position"]
-      newposition = -1
-      newbundlesize = -1
-      length = fileinfo["length"]
-      
-      if not bundleinfo["sorted"] :
-        flist = sorted(bundleinfo["flist"], key=itemgetter(0))
-        bundleinfo["flist"] = flist
-        flistl = len(flist)
-        
-        # look for free space available in the whole bundle
-        freespace = [[bundlesize, 0]]
-        i = 0
-        while i < flistl-1 :
-          endpos = flist[i][0] + flist[i][1]
-          #print("<- %12d" % (flist[i][0]))
-          #print("   %12d ->" % (endpos))
-          if endpos < flist[i+1][0] :
-            # some entries repeat themselves but this has no incidence
-            freespacesize = flist[i+1][0]-endpos
-            freespace.append([endpos, freespacesize])
-          i += 1
-        i = flistl-1
-        endpos = flist[i][0] + flist[i][1]
-        if endpos < bundlesize :
-          freespacesize = bundlesize-endpos
-          freespace[0][0] = endpos
-          freespace[0][1] = freespacesize
-        bundleinfo["free"] = freespace
-        # regroup and index files with same content
-        groups = {}
-        i = 0
-        while i < flistl :
-          if flist[i][0] not in groups :
-            groups[flist[i][0]] = [i]
-          else :
-            groups[flist[i][0]].append(i)
-          i += 1
-        bundleinfo["groups"] = groups
-        bundleinfo["sorted"] = True
-        
-      def addbind(addpos, addlen) :
-        i = 0
-        while i < freespacel :
-          if addpos + addlen == freespace[i][0] :
-            # bind with the following free space
-            print("bind with the following free space")
-            freespace[i][0] -= addlen
-            freespace[i][1] += addlen
-            return True
-          elif freespace[i][0] + freespace[i][1] == addpos :
-            # bind with the preceding free space
-            print("bind with the preceding free space")
-            freespace[i][1] += addlen
-            return True
-          i += 1
-        # coundn't bind free spaces
-        freespace.append([addpos, addlen])
-        return False
-        
-      freespace = bundleinfo["free"]
-      freespacel = len(freespace)
-      print("look for free space for %d size %d" % (position, newlength))
-      print(str(freespace))
-      
-      # fill in an already available space
-      i = 1
-      while i < freespacel :
-        if newlength <= freespace[i][1] :
-          # found a free space
-          print("already available space at %d size %d" % (freespace[i][0], freespace[i][1]))
-          newposition = freespace[i][0]
-          if newlength < freespace[i][1] :
-            freespace[i][0] += newlength
-            freespace[i][1] -= newlength
-          else :
-            freespace.pop(i)
-          break
-        i += 1
-
-      # new file is smaller write on its own position
-      if newposition == -1 :
-        if newlength <= length :
-          print("write on place of old file at %d size %d" % (position, length))
-          newposition = position
-          if newlength < length :
-            addbind(position + newlength, length - newlength)
+      self.writefilesintobundle(fileinfo["bundlename"], [[filename, writethis]], ggpkpointer)
+  
+  def writefilesintobundle(self, bundlename, files, ggpkpointer) :
+    # files [filename, data] of one bundle placed one after the other, the bundle is patched once
+    # there is no header here, neither in data nor in fileinfo["length"]
+    # the index is written back with the new offsets and sizes by updateindexbundle
+    self.fullfilelistdic["./Bundles2/_.index.bin"]["modified"] = True
+    self.preparebundle(bundlename)
+    bundleinfo = self.fullfilelistdic[bundlename]
+    # room the files may need at the end of the bundle, the bundle grows once for all of them
+    growth = sum([len(data) for filename, data in files])
+    newbundlesize = -1
+    patches = []
+    for filename, data in files :
+      growth -= len(data)
+      # data already written in the bundle is shared, the index entry points at it
+      digest = hashlib.sha256(data).digest()
+      newposition = bundleinfo["contents"].get(digest, -1)
+      if newposition != -1 :
+        if newposition != self.fullfilelistdic[filename]["position"] :
+          print("onlywritebinarydata same content %s %s (pos %d -> %d) (size %d -> %d)" % (filename, bundlename, self.fullfilelistdic[filename]["position"], newposition, self.fullfilelistdic[filename]["length"], len(data)))
+          self.movefileinindex(filename, newposition, len(data))
+        continue
+      newposition, bundlesize = self.placeinbundle(filename, len(data), growth)
+      if bundlesize != -1 :
+        newbundlesize = bundlesize
+      print("onlywritebinarydata insertfileintobundle %s %s (pos %d -> %d) (size %d -> %d)" % (filename, bundlename, self.fullfilelistdic[filename]["position"], newposition, self.fullfilelistdic[filename]["length"], len(data)))
+      self.movefileinindex(filename, newposition, len(data))
+      bundleinfo["contents"][digest] = newposition
+      bundleinfo["digests"][newposition] = digest
+      patches.append([newposition, data])
+    if len(patches) == 0 :
+      return
+    # file is inside a bundle, the bundle grows to newbundlesize if it needs more room
+    self.patchbundle(ggpkpointer, bundlename, patches, newbundlesize)
+    if newbundlesize != -1 :
+      newbundlesizeb = (newbundlesize).to_bytes(4, byteorder='little', signed=False)
+      self.indexbundle.seek(bundleinfo["idxunsizepos"])
+      self.indexbundle.write(newbundlesizeb)
+      print("%s modify index bundle length %d, idxpos %d" % (bundlename, newbundlesize, bundleinfo["idxunsizepos"]))
+      bundleinfo["idxunsize"] = newbundlesize
+  
+  def preparebundle(self, bundlename) :
+    # files of the bundle sorted by offset, its free space and its groups of files with the same offset
+    bundleinfo = self.fullfilelistdic[bundlename]
+    if bundleinfo["sorted"] :
+      return
+    bundlesize = bundleinfo["idxunsize"]
+    # [offset, size, position of the record in indexbundle, hash] of the files of the bundle, the records
+    # of a bundle not written to yet are the ones of the index sortindex was given
+    files = self.sortedindex.files
+    offsets = files["offset"]
+    sizes = files["size"]
+    hashes = files["hash"]
+    flist = [[int(offsets[i]), int(sizes[i]), files.position(i), int(hashes[i])] for i in self.sortedindex.groups().get(bundleinfo["bundleindex"], [])]
+    flist.sort(key=itemgetter(0))
+    bundleinfo["flist"] = flist
+    flistl = len(flist)
+    
+    # free space of the bundle, as left by the last session when the index is still the one it wrote
+    freespace = self.freespaces.get(bundlename)
+    if freespace is None or freespace.size != bundlesize :
+      freespace = poemods_free.fromflist(flist, bundlesize)
+      self.freespaces[bundlename] = freespace
+    bundleinfo["free"] = freespace
+    # regroup and index files with same content
+    groups = {}
+    i = 0
+    while i < flistl :
+      if flist[i][0] not in groups :
+        groups[flist[i][0]] = [i]
       else :
-        # the old data becomes free space
-        addbind(position, length)
-
+        groups[flist[i][0]].append(i)
+      i += 1
+    bundleinfo["groups"] = groups
+    # sha256 of the data written in the bundle -> its offset, and back
+    bundleinfo["contents"] = {}
+    bundleinfo["digests"] = {}
+    bundleinfo["sorted"] = True
+  
+  def placeinbundle(self, filename, newlength, growth=0) :
+    # (new position, new bundle size or -1) of a file of newlength bytes
+    # a bundle that is too small grows by at least growth bytes
+    fileinfo = self.fullfilelistdic[filename]
+    bundleinfo = self.fullfilelistdic[fileinfo["bundlename"]]
+    freespace = bundleinfo["free"]
+    position = fileinfo["position"]
+    length = fileinfo["length"]
+    newbundlesize = -1
+    print("look for free space for %d size %d : %d holes %d bytes (largest %d) %d bytes at the end, fragmentation %.2f" % ((position, newlength) + freespace.stats()))
+    
+    if newlength <= length and len(bundleinfo["groups"][position]) == 1 :
+      # new file is smaller and no other file uses the old one, write on its own position
+      print("write on place of old file at %d size %d" % (position, length))
+      newposition = position
+      freespace.release(position + newlength, length - newlength)
+      return newposition, newbundlesize
+    # fill in the smallest free space the file fits in
+    newposition = freespace.allocate(newlength)
+    if newposition != -1 :
+      print("already available space at %d" % (newposition))
+    else :
       # there's enough room at the end of the bundle
+      newposition = freespace.allocateend(newlength)
       if newposition == -1 :
-        i = 0
-        if newlength <= freespace[i][1] :
-          print("enough room at the end of the bundle at %d size %d" % (freespace[i][0], freespace[i][1]))
-          newposition = freespace[i][0]
-          if newlength < freespace[i][1] :
-            freespace[i][0] += newlength
-            freespace[i][1] -= newlength
-          else :
-            freespace.pop(i)
-
-      # we need to expand the bundle size by at least (newlength - length)
-      if newposition == -1 :
-        newposition = bundlesize
-        i = len(bundleinfo["flist"]) - 1
-        lastposavail = bundleinfo["flist"][i][0] + bundleinfo["flist"][i][1]
-        newbundlesize = max(lastposavail + newlength * 10, lastposavail + 10000000)
-        print("expand the bundle size at %d size %d" % (lastposavail, newbundlesize))
-        if newlength < newbundlesize : # always the case
-          addbind(lastposavail + newlength, newbundlesize - newlength)
-      
-      # file is inside a bundle decompress it if not already done
-      self.decompressbundle(ggpkpointer, bundlename, newbundlesize)
-      
-      print("onlywritebinarydata insertfileintobundle %s %s (pos %d -> %d) (size %d -> %d)" % (filename, bundlename, position, newposition, length, newlength))
-      self.insertfileintobundle(ggpkpointer, bundlename, newposition, writethis)
-      
-      # change the position and the size for each file with offset fileinfo["position"] in indexbundle
-      newpositionb = (newposition).to_bytes(4, byteorder='little', signed=False)
-      newlengthb = (newlength).to_bytes(4, byteorder='little', signed=False)
-      
-      groupatnewposition = []
-      for i in bundleinfo["groups"][position] :
-        bundleinfo["flist"][i][0] = newposition
-        bundleinfo["flist"][i][1] = newlength
-        offsetref = bundleinfo["flist"][i][2]
-        self.indexbundle.seek(offsetref + 12)
-        self.indexbundle.write(newpositionb)
-        self.indexbundle.write(newlengthb)
-        thisfilename = bundleinfo["flist"][i][3]
-        thisfileinfo = self.fullfilelistdic[thisfilename]
-        thisfileinfo["position"] = newposition
-        thisfileinfo["length"] = newlength
-        groupatnewposition.append(i)
-        print("%s modify index bundle at %d length %d, idxpos %d" % (thisfilename, newposition, newlength, offsetref))
-      bundleinfo["groups"][position].clear()
-      bundleinfo["groups"].pop(position)
-      bundleinfo["groups"][newposition] = groupatnewposition
-      
-      if newbundlesize != -1 :
-        newbundlesizeb = (newbundlesize).to_bytes(4, byteorder='little', signed=False)
-        self.indexbundle.seek(bundleinfo["idxunsizepos"])
-        self.indexbundle.write(newbundlesizeb)
-        print("%s modify index bundle length %d, idxpos %d" % (bundlename, newbundlesize, bundleinfo["idxunsizepos"]))
-        bundleinfo["idxunsize"] = newbundlesize
-      
-      
-      
-      
+        # we need to expand the bundle size by at least newlength
+        newbundlesize = freespace.size + max(growth, newlength * 10, 10000000)
+        print("expand the bundle size %d -> %d" % (freespace.size, newbundlesize))
+        freespace.grow(newbundlesize)
+        newposition = freespace.allocateend(newlength)
+      else :
+        print("enough room at the end of the bundle at %d" % (newposition))
+    return newposition, newbundlesize
+  
+  def movefileinindex(self, filename, newposition, newlength) :
+    # change the position and the size of the file in indexbundle, the other files with the same offset
+    # keep their data, the old data becomes free space when no file uses it anymore
+    fileinfo = self.fullfilelistdic[filename]
+    bundleinfo = self.fullfilelistdic[fileinfo["bundlename"]]
+    groups = bundleinfo["groups"]
+    flist = bundleinfo["flist"]
+    position = fileinfo["position"]
+    length = fileinfo["length"]
+    i = [i for i in groups[position] if flist[i][3] == fileinfo["hash"]][0]
+    groups[position].remove(i)
+    if len(groups[position]) == 0 or position == newposition :
+      # the data at position is freed or written over
+      digest = bundleinfo["digests"].pop(position, None)
+      if digest is not None :
+        bundleinfo["contents"].pop(digest)
+    if len(groups[position]) == 0 :
+      groups.pop(position)
+      if position != newposition :
+        bundleinfo["free"].release(position, length)
+    
+    flist[i][0] = newposition
+    flist[i][1] = newlength
+    offsetref = flist[i][2]
+    self.indexbundle.seek(offsetref + 12)
+    self.indexbundle.write((newposition).to_bytes(4, byteorder='little', signed=False))
+    self.indexbundle.write((newlength).to_bytes(4, byteorder='little', signed=False))
+    fileinfo["position"] = newposition
+    fileinfo["length"] = newlength
+    groups.setdefault(newposition, []).append(i)
+    print("%s modify index bundle at %d length %d, idxpos %d" % (filename, newposition, newlength, offsetref))
   
   def readbinarydata(self, filename, ggpkpointer, limit=-1):
     # try to read original file if present on disk
     fileinfo = self.fullfilelistdic[filename]
     if filename in self.keeplist :
       # keeplist only stores bundles, not inner files
-      headerlength = 46 + len(fileinfo["name"]) * 2
-      size = fileinfo["length"] - headerlength
-      if limit != -1 and size > limit :
-        length = limit
-      else :
-        length = size
-      position = fileinfo["position"]
-      ggpkpointer.seek(position)
-      beforefileinfo = ggpkpointer.read(length)
-      filehash = beforefileinfo[12:44].hex()
-      if self.keeplist[filename] != filehash :
-        # hash is different -> there's an updated original file
-        self.keeplist[filename] = filehash
-        self.storefiletodisk(filename, beforefileinfo[headerlength:])
-        if filename == "./Bundles2/_.index.bin" :
-          # there's an updated index, look for updated file offsets/sizes
-          self.getindexondiskinfo()
-        return beforefileinfo[headerlength:]
-      targetfilename = os.path.join("keep", filename[2:])
-      if os.path.exists(targetfilename) is True :
+      targetfilename = self.keptoriginal(filename, ggpkpointer)
+      if targetfilename is not None :
         with open(targetfilename, "rb") as fin :
-          if limit != -1 and size > limit :
-            filedata = fin.read(length)
-          else :
-            filedata = fin.read()
-        return filedata
+          return fin.read(limit)
     else :
       if "bundlename" in fileinfo :
         # file is inside a bundle
         bundlename = fileinfo["bundlename"]
         if bundlename in self.keeplist :
           # read file from bundle from disk
-          bundleinfo = self.fullfilelistdic[bundlename]
-          headerlength = 46 + len(bundleinfo["name"]) * 2
-          size = bundleinfo["length"] - headerlength
-          if limit != -1 and size > limit :
-            length = limit
-          else :
-            length = size
-          position = bundleinfo["position"]
-          ggpkpointer.seek(position)
-          beforefileinfo = ggpkpointer.read(length)
-          filehash = beforefileinfo[12:44].hex()
-          if self.keeplist[bundlename] != filehash :
-            # hash is different -> there's an updated original bundle
-            self.keeplist[bundlename] = filehash
-            self.storefiletodisk(bundlename, beforefileinfo[headerlength:])
-          targetfilename = os.path.join("keep", bundlename[2:])
-          if os.path.exists(targetfilename) is True :
+          targetfilename = self.keptoriginal(bundlename, ggpkpointer)
+          if targetfilename is not None :
             with open(targetfilename, "rb") as fin :
               return self.extractfilefrombundle(fin, 0, filename, limit)
     # file has not been stored on disk
     # read the one from the current ggpk
     return self.readggpkbinarydata(filename, ggpkpointer, limit)
   
+  def keptoriginal(self, bundlename, ggpkpointer):
+    # name of the original of a bundle or file kept on disk, stored again first if the ggpk has an updated original
+    bundleinfo = self.fullfilelistdic[bundlename]
+    headerlength = 46 + len(bundleinfo["name"]) * 2
+    reader = self.readerfor(ggpkpointer)
+    with self.keeplock :
+      filehash = reader.read(bundleinfo["position"], headerlength)[12:44].hex()
+      if self.keeplist[bundlename] != filehash :
+        # hash is different -> there's an updated original bundle
+        self.keeplist[bundlename] = filehash
+        self.storefiletodisk(bundlename, self.recordchunks(ggpkpointer, bundleinfo["position"] + headerlength, bundleinfo["length"] - headerlength))
+        if bundlename == "./Bundles2/_.index.bin" :
+          # there's an updated index, look for updated file offsets/sizes
+          self.getindexondiskinfo()
+    targetfilename = os.path.join("keep", bundlename[2:])
+    if os.path.exists(targetfilename) is False :
+      return None
+    return targetfilename
+  
+  def readbinarydatachunks(self, filename, ggpkpointer):
+    # the data of readbinarydata one piece after the other, a file inside a bundle comes one block at a
+    # time with the first and last blocks cut to the file : memory stays the size of one block
+    fileinfo = self.fullfilelistdic[filename]
+    if filename in self.keeplist :
+      targetfilename = self.keptoriginal(filename, ggpkpointer)
+      if targetfilename is not None :
+        with open(targetfilename, "rb") as fin :
+          yield from iter(lambda : fin.read(chunksize), b'')
+        return
+    elif "bundlename" in fileinfo and fileinfo["bundlename"] in self.keeplist :
+      targetfilename = self.keptoriginal(fileinfo["bundlename"], ggpkpointer)
+      if targetfilename is not None :
+        with open(targetfilename, "rb") as fin :
+          yield from self.extractchunksfrombundle(fin, 0, filename)
+        return
+    # file has not been stored on disk
+    # read the one from the current ggpk
+    if "bundlename" in fileinfo :
+      bundleinfo = self.fullfilelistdic[fileinfo["bundlename"]]
+    else :
+      bundleinfo = fileinfo
+    headerlength = 46 + len(bundleinfo["name"]) * 2
+    size = bundleinfo["length"] - headerlength
+    position = bundleinfo["position"] + headerlength
+    if size <= 0 or position + size > self.ggpksize :
+      return
+    if "bundlename" in fileinfo :
+      yield from self.extractchunksfrombundle(ggpkpointer, position, filename)
+    else :
+      yield from self.recordchunks(ggpkpointer, position, size)
+  
+  def recordchunks(self, ggpkpointer, position, size):
+    # size bytes of the ggpk from position, chunksize at a time
+    reader = self.readerfor(ggpkpointer)
+    for bi in range(0, size, chunksize) :
+      yield reader.read(position + bi, min(chunksize, size - bi))
+  
+  def decodeblock(self, reader, absoluteposition, table, bundlename, blockindex):
+    # decompressed block of a bundle, taken from the block cache or decompressed and added to it
+    key = (bundlename, blockindex, self.bundleversion(bundlename, absoluteposition))
+    block = poemods_blocks.blocks.get(key)
+    if block is not None :
+      return block
+    decompressedsize = table.extracted(blockindex)[1]
+    offset, size = table.compressed(blockindex)
+    output = bytearray(decompressedsize + safespace)
+    if decompressoozinto(reader.read(absoluteposition + offset, size), decompressedsize, output, 0) is False :
+      del output[decompressedsize:]
+      return output
+    block = bytes(memoryview(output)[:decompressedsize])
+    poemods_blocks.blocks.put(key, block)
+    return block
+  
+  def extractchunksfrombundle(self, ggpk, absoluteposition, filename):
+    # blocks holding a file decompressed one after the other, each one cut to the file
+    # the blocks go through the block cache like the ones of the other reads
+    reader = self.readerfor(ggpk)
+    bundlename = self.fullfilelistdic[filename]["bundlename"]
+    table = self.blocktable(reader, absoluteposition, bundlename)
+    filerange = self.bundledrange(filename, absoluteposition)
+    if filerange is None :
+      yield b'<original file not found>'
+      return
+    start = filerange[0]
+    end = filerange[0] + filerange[1]
+    for blockindex in table.blocks(start, end) :
+      blockstart, decompressedsize = table.extracted(blockindex)
+      block = self.decodeblock(reader, absoluteposition, table, bundlename, blockindex)
+      yield memoryview(block)[max(start, blockstart) - blockstart:min(end, blockstart + decompressedsize) - blockstart]
+  
+  def readbinarydatabybundle(self, filenames, ggpkpointer, limit=-1):
+    # (filename, data) of every file like readbinarydata, for many files at once
+    # the files inside bundles are grouped by bundle, bundles are read in ggpk order and their files by
+    # increasing offset : every block is read and decompressed once, one after the other
+    # with a limit only the blocks holding the first limit bytes of each file are decompressed
+    bundles = {}
+    for filename in filenames :
+      fileinfo = self.fullfilelistdic[filename]
+      if "bundlename" in fileinfo and filename not in self.keeplist :
+        bundlename = fileinfo["bundlename"]
+        if bundlename not in bundles :
+          bundles[bundlename] = []
+        bundles[bundlename].append(filename)
+      else :
+        yield filename, self.readbinarydata(filename, ggpkpointer, limit)
+    for bundlename in sorted(bundles, key=lambda bundlename: self.fullfilelistdic[bundlename]["position"]) :
+      if bundlename in self.keeplist :
+        targetfilename = self.keptoriginal(bundlename, ggpkpointer)
+        if targetfilename is None :
+          for filename in bundles[bundlename] :
+            yield filename, self.readggpkbinarydata(filename, ggpkpointer, limit)
+          continue
+        with open(targetfilename, "rb") as fin :
+          yield from self.readfilesfrombundle(fin, 0, bundlename, bundles[bundlename], limit)
+      else :
+        bundleinfo = self.fullfilelistdic[bundlename]
+        headerlength = 46 + len(bundleinfo["name"]) * 2
+        if bundleinfo["length"] <= headerlength :
+          for filename in bundles[bundlename] :
+            yield filename, b''
+          continue
+        if bundleinfo["position"] + bundleinfo["length"] > self.ggpksize :
+          for filename in bundles[bundlename] :
+            yield filename, None
+          continue
+        yield from self.readfilesfrombundle(ggpkpointer, bundleinfo["position"] + headerlength, bundlename, bundles[bundlename], limit)
+  
+  def probe(self, filenames, ggpkpointer, n):
+    # first n bytes of many files, enough for a magic number or a reference check
+    # filename -> memoryview of at most n bytes, None when the file cannot be read
+    heads = {}
+    for filename, piece in self.readbinarydatabybundle(filenames, ggpkpointer, n) :
+      if piece is None :
+        heads[filename] = None
+      else :
+        heads[filename] = memoryview(bytes(piece[:n]))
+    return heads
+  
+  def readfilesfrombundle(self, ggpk, absoluteposition, bundlename, filenames, limit=-1):
+    # (filename, data) of files of one bundle, absoluteposition 0 is the original kept on disk
+    reader = self.readerfor(ggpk)
+    table = self.blocktable(reader, absoluteposition, bundlename)
+    files = []
+    for filename in filenames :
+      filerange = self.bundledrange(filename, absoluteposition)
+      if filerange is None :
+        yield filename, b'<original file not found>'
+        continue
+      length = filerange[1]
+      if limit != -1 and length > limit :
+        length = limit
+      files.append([filerange[0], length, filename])
+    files.sort()
+    # decompressed blocks still needed, the ones before the start of the current file are dropped
+    # they go through the block cache, but stay here while needed even when the cache lets them go
+    decompressed = {}
+    for start, length, filename in files :
+      end = start + length
+      blocks = table.blocks(start, end)
+      if len(blocks) == 0 :
+        yield filename, b''
+        continue
+      for blockindex in [blockindex for blockindex in decompressed if blockindex < blocks[0]] :
+        del decompressed[blockindex]
+      pieces = []
+      for blockindex in blocks :
+        blockstart, decompressedsize = table.extracted(blockindex)
+        if blockindex not in decompressed :
+          decompressed[blockindex] = self.decodeblock(reader, absoluteposition, table, bundlename, blockindex)
+        pieces.append(memoryview(decompressed[blockindex])[max(start, blockstart) - blockstart:min(end, blockstart + decompressedsize) - blockstart])
+      yield filename, b''.join(pieces)
+  
   def readggpkbinarydata(self, filename, ggpkpointer, limit=-1):
     fileinfo = self.fullfilelistdic[filename]
     if "bundlename" in fileinfo :
@@ -1205,21 +1618,22 @@ class listggpkfiles(object):
       position = fileinfo["position"] + headerlength
       if position + size > self.ggpksize :
         return None
-      ggpkpointer.seek(position)
       if limit != -1 and size > limit :
         length = min(size, limit)
       else :
         length = size
-      piece = ggpkpointer.read(length)
+      piece = bytes(self.readerfor(ggpkpointer).read(position, length))
       return piece
   
-  def storefiletodisk(self, filename, writethis):
+  def storefiletodisk(self, filename, chunks):
+    # chunks of the original, as returned by recordchunks
     targetpath=os.path.join("keep", self.fullfilelistdic[filename]["path"][2:])
     if os.path.exists(targetpath) is False :
       os.makedirs(targetpath)
     targetfilename=os.path.join(targetpath, self.fullfilelistdic[filename]["name"])
     with open(targetfilename, "wb") as fout :
-      fout.write(writethis)
+      for chunk in chunks :
+        fout.write(chunk)
 
 
 
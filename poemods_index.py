@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+import struct
+import functools
+import io
+try :
+  import numpy
+except ImportError :
+  numpy = None
+
+# _.index.bin once extracted, little endian
+#   u32 bundle count
+#   for each bundle : u32 name length, UTF-8 name, u32 uncompressed size
+#   u32 file count
+#   file records, 20 bytes : u64 path hash, u32 bundle index, u32 offset, u32 size
+#   u32 path-rep count
+#   path-rep records, 20 bytes : u64 hash, u32 payload offset, u32 payload size, u32 payload recursive size
+#   bundle holding the path-rep payload
+# the record tables are read in place with numpy when it is installed, with struct.iter_unpack otherwise
+recordsize = 20
+filerecordfields = [["hash", "<u8"], ["bundle", "<u4"], ["offset", "<u4"], ["size", "<u4"]]
+pathrepfields = [["hash", "<u8"], ["offset", "<u4"], ["size", "<u4"], ["recursivesize", "<u4"]]
+structcodes = {"<u8" : "Q", "<u4" : "I"}
+
+fnvoffset = 0xcbf29ce484222325
+fnvprime = 0x100000001b3
+fnvmask = (1 << 64) - 1
+
+@functools.lru_cache(maxsize=65536)
+def fnv1a(filename):
+  # 64 bits FNV-1a of the lower case path followed by "++", as _.index.bin hashes its paths
+  hval = fnvoffset
+  for c in filename.lower() + "++" :
+    hval = ((hval ^ ord(c)) * fnvprime) & fnvmask
+  return hval
+
+def fnv1abatch(filenames):
+  # hashes of a list of paths, a list of python ints
+  # with numpy every path advances by one character per step, a step is one vector operation
+  if numpy is None or len(filenames) == 0 :
+    return [fnv1a.__wrapped__(filename) for filename in filenames]
+  try :
+    data = [(filename.lower() + "++").encode("latin-1") for filename in filenames]
+  except UnicodeEncodeError :
+    # characters above 0xff, not in paths decoded from the index
+    return [fnv1a.__wrapped__(filename) for filename in filenames]
+  lengths = numpy.fromiter(map(len, data), dtype=numpy.int64, count=len(data))
+  starts = numpy.zeros(len(data), dtype=numpy.int64)
+  numpy.cumsum(lengths[:-1], out=starts[1:])
+  chars = numpy.frombuffer(b''.join(data), dtype=numpy.uint8)
+  # longest paths first : the paths still running at a step are a prefix
+  order = numpy.argsort(-lengths, kind="stable")
+  lengths = lengths[order]
+  starts = starts[order]
+  hvals = numpy.full(len(data), fnvoffset, dtype=numpy.uint64)
+  prime = numpy.uint64(fnvprime)
+  ascending = lengths[::-1]
+  for step in range(int(lengths[0])) :
+    running = len(data) - int(numpy.searchsorted(ascending, step, side="right"))
+    hvals[:running] ^= chars[starts[:running] + step]
+    hvals[:running] *= prime
+  result = numpy.empty(len(data), dtype=numpy.uint64)
+  result[order] = hvals
+  return result.tolist()
+
+def decodepathrep(payload, offset, size):
+  # paths of one path-rep record, the payload is a list of u32 commands :
+  #   0 switches between the base phase and the path phase, entering the base phase forgets the bases
+  #   n > 0 is followed by a NUL terminated fragment, appended to base n - 1 when it exists
+  #   a fragment becomes a new base in the base phase and a path otherwise
+  basephase = False
+  bases = []
+  bf = offset
+  bfmax = offset + size
+  while bf < bfmax :
+    cmd, = struct.unpack_from("<I", payload, bf)
+    bf += 4
+    if cmd == 0 :
+      basephase = not basephase
+      if basephase :
+        bases.clear()
+      continue
+    end = payload.find(b'\x00', bf, bfmax)
+    if end == -1 :
+      end = bfmax
+    fragment = payload[bf:end].decode("latin-1")
+    bf = end + 1
+    if cmd - 1 < len(bases) :
+      fragment = bases[cmd - 1] + fragment
+    if basephase :
+      bases.append(fragment)
+    else :
+      yield fragment
+
+def indexpaths(payload, pathreps, batchsize=65536):
+  # (path, hash) of every path of the payload, hashed by batches while decoding
+  batch = []
+  for offset, size in zip(pathreps.values("offset"), pathreps.values("size")) :
+    for path in decodepathrep(payload, offset, size) :
+      batch.append(path)
+      if len(batch) == batchsize :
+        yield from zip(batch, fnv1abatch(batch))
+        batch = []
+  if len(batch) > 0 :
+    yield from zip(batch, fnv1abatch(batch))
+
+class records(object):
+  # table of 20 bytes records, one column per field
+  def __init__(self, buffer, start, count, fields):
+    self.start = start
+    self.count = count
+    self.columns = {}
+    if numpy is not None :
+      data = numpy.frombuffer(buffer, dtype=numpy.dtype([tuple(field) for field in fields]), count=count, offset=start)
+      for name, fieldtype in fields :
+        self.columns[name] = data[name]
+    else :
+      fmt = "<" + "".join([structcodes[fieldtype] for name, fieldtype in fields])
+      values = list(zip(*struct.iter_unpack(fmt, buffer[start:start+recordsize*count])))
+      for i, field in enumerate(fields) :
+        if i < len(values) :
+          self.columns[field[0]] = list(values[i])
+        else :
+          self.columns[field[0]] = []
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, name):
+    return self.columns[name]
+
+  def position(self, row):
+    # position of the record in the extracted index
+    return self.start + recordsize * row
+
+  def values(self, name):
+    # column as a list of python ints
+    if numpy is not None :
+      return self.columns[name].tolist()
+    return self.columns[name]
+
+  def group(self, name):
+    # (value, rows) for each value of a column, rows keep the record order
+    if numpy is not None :
+      order = numpy.argsort(self.columns[name], kind="stable")
+      keys = self.columns[name][order]
+      bounds = [0] + (numpy.flatnonzero(keys[1:] != keys[:-1]) + 1).tolist() + [self.count]
+      for i in range(len(bounds) - 1) :
+        if bounds[i] < bounds[i+1] :
+          yield int(keys[bounds[i]]), order[bounds[i]:bounds[i+1]].tolist()
+    else :
+      groups = {}
+      for row, key in enumerate(self.columns[name]) :
+        if key not in groups :
+          groups[key] = []
+        groups[key].append(row)
+      for key in sorted(groups) :
+        yield key, groups[key]
+
+  def lookup(self, name):
+    return recordlookup(self.columns[name])
+
+class recordlookup(object):
+  # row of a value in a column of unique values : bisection in a sorted copy with numpy, a dict otherwise
+  def __init__(self, keys):
+    if numpy is not None :
+      self.order = numpy.argsort(keys, kind="stable")
+      self.keys = keys[self.order]
+    else :
+      self.rows = {}
+      for row, key in enumerate(keys) :
+        self.rows[key] = row
+
+  def find(self, key):
+    if numpy is not None :
+      i = int(numpy.searchsorted(self.keys, numpy.uint64(key)))
+      if i < len(self.keys) and self.keys[i] == key :
+        return int(self.order[i])
+      return -1
+    return self.rows.get(key, -1)
+
+  def findall(self, keys):
+    # rows of a list of values, -1 when not found
+    if numpy is not None :
+      keys = numpy.array(keys, dtype=numpy.uint64)
+      if len(self.keys) == 0 :
+        return [-1] * len(keys)
+      i = numpy.searchsorted(self.keys, keys)
+      i[i == len(self.keys)] = 0
+      return numpy.where(self.keys[i] == keys, self.order[i], -1).tolist()
+    return [self.rows.get(key, -1) for key in keys]
+
+class indexmodel(object):
+  # _.index.bin decompressed and parsed once, the key tells which version of the index it is
+  # bundle table, record tables, grouping of the files by bundle and paths are shared by every user
+  def __init__(self, key, buffer):
+    self.key = key
+    self.buffer = buffer
+    self.bundlenames = []
+    self.bundlesizes = []
+    self.bundlesizepos = []
+    bf = 4
+    bundle_count, = struct.unpack_from("<I", buffer, 0)
+    for i in range(bundle_count) :
+      name_length, = struct.unpack_from("<I", buffer, bf)
+      bi = bf + 4
+      bf = bi + name_length
+      self.bundlenames.append(str(buffer[bi:bf], "UTF-8"))
+      self.bundlesizepos.append(bf)
+      self.bundlesizes.append(struct.unpack_from("<I", buffer, bf)[0])
+      bf += 4
+    file_count, = struct.unpack_from("<I", buffer, bf)
+    self.files = records(buffer, bf + 4, file_count, filerecordfields)
+    # end of the part of the index rewritten by updateindexbundle
+    self.filesend = bf + 4 + recordsize * file_count
+    bf = self.filesend
+    path_rep_count, = struct.unpack_from("<I", buffer, bf)
+    self.pathreps = records(buffer, bf + 4, path_rep_count, pathrepfields)
+    self.payloadstart = bf + 4 + recordsize * path_rep_count
+    self.filelookup = None
+    self.bundlegroups = None
+    self.payload = None
+
+  def lookup(self):
+    # row of a file record from its hash
+    if self.filelookup is None :
+      self.filelookup = self.files.lookup("hash")
+    return self.filelookup
+
+  def groups(self):
+    # bundle index -> rows of its file records
+    if self.bundlegroups is None :
+      self.bundlegroups = dict(self.files.group("bundle"))
+    return self.bundlegroups
+
+  def paths(self, extractbundle):
+    # (path, hash) of every file, extractbundle(buffer) decompresses the path-rep payload bundle
+    if self.payload is None :
+      self.payload = extractbundle(self.buffer[self.payloadstart:])
+    return indexpaths(self.payload, self.pathreps)
+
+  def writable(self):
+    # copy of the bundle table and file records, modified in place when files move inside bundles
+    return io.BytesIO(self.buffer[:self.filesend])
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+import os
+import mmap
+import threading
+
+# positional reads : read(position, length) returns a memoryview and moves no file position,
+# so one reader is shared by every thread without a lock
+# the ggpk is mapped once, a view of the mapping is returned without copying anything
+# the mapping keeps the size the file had when it was opened, what is written after its end is read
+# with os.pread, like the files that are not mapped (windows has no pread : seek and read under a lock)
+# writes through another file object are seen once that file object is flushed
+class filereader(object):
+  def __init__(self, fin, usemmap=True):
+    self.fin = fin
+    self.fd = fin.fileno()
+    self.mm = None
+    self.view = None
+    self.lock = threading.Lock()
+    if usemmap is True :
+      try :
+        self.mm = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+      except (ValueError, OSError) :
+        # empty file, or larger than the address space
+        self.mm = None
+
+  def ismapped(self, end):
+    # bytes before end are read from the mapping
+    return self.view is not None and end <= len(self.view)
+
+  def read(self, position, length):
+    if self.view is not None and position + length <= len(self.view) :
+      return self.view[position:position+length]
+    return memoryview(self.pread(position, length))
+
+  def pread(self, position, length):
+    if hasattr(os, "pread") :
+      return os.pread(self.fd, length, position)
+    with self.lock :
+      self.fin.seek(position)
+      return self.fin.read(length)
+
+  def close(self):
+    if self.view is not None :
+      self.view.release()
+      self.view = None
+    if self.mm is not None :
+      try :
+        self.mm.close()
+      except BufferError :
+        # a view returned by read is still used, the mapping goes away with it
+        pass
+      self.mm = None
+
+class bufferreader(object):
+  # same reads from bytes already in memory
+  def __init__(self, buffer):
+    self.view = memoryview(buffer)
+
+  def ismapped(self, end):
+    return True
+
+  def read(self, position, length):
+    return self.view[position:position+length]
+
+  def close(self):
+    self.view.release()
@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+import bisect
+from array import array
+import poemods_cache
+
+# file table : one array per column and one row per ggpk record or file inside a bundle
+# the table is fullfilelistdic, a row is read and written through fileentry like the dict it replaces
+#   position, length, referenceposition   columns, same meaning as before
+#   bundle                                 row of the bundle record holding the file, -1 for ggpk records
+#   hash                                   fnv1a of the path, files inside bundles only
+#   digest                                 sha256 of PDIR/FILE records, kept for ggpk records only
+#   anything else (flist, groups, idxunsize, ...) is only set on a few rows and kept aside
+# rows are sorted with poemods_cache.namekey once the scan is over, fullfilelist is the names in row order
+# names are never kept as one string per row : they are read from the paths of the cache the table is
+# attached to, or from a poemods_cache.namecolumn while rows are added
+# a name is found by bisection in the sorted names, only the names compared are decoded, the rows added
+# after the sort are kept in a dict until the next sort, a path hash by bisection in an array of the hashes
+entrykeys = ["position", "length", "path", "name", "referenceposition"]
+rowkeys = set(entrykeys + ["bundlename", "hash"])
+
+class filetable(object):
+  def __init__(self, cache=None):
+    self.cache = cache
+    self.columns = {}
+    for column, typecode in poemods_cache.cachecolumns :
+      self.columns[column] = array(typecode)
+    self.names = poemods_cache.namecolumn()
+    # rows 0:sortedcount are in namekey order, tailrows are the rows added after them
+    self.sortedcount = 0
+    self.tailrows = {}
+    self.digests = {}
+    self.extra = {}
+    self.hashkeys = None
+    self.hashrows = None
+    if cache is not None :
+      # the columns are copied, the names stay in the mapping
+      for column, typecode in poemods_cache.cachecolumns :
+        view = cache.columns[column].cast("B")
+        self.columns[column].frombytes(view)
+        view.release()
+      self.names = poemods_cache.cachednames(cache)
+      self.sortedcount = len(self)
+
+  def __len__(self):
+    return len(self.columns["position"])
+
+  def __contains__(self, filename):
+    return self.find(filename) != -1
+
+  def __getitem__(self, filename):
+    row = self.find(filename)
+    if row == -1 :
+      raise KeyError(filename)
+    return fileentry(self, row)
+
+  def __setitem__(self, filename, element):
+    row = self.find(filename)
+    if row == -1 :
+      self.addrow(filename, element)
+      return
+    entry = fileentry(self, row)
+    for key in element :
+      if key != "path" and key != "name" :
+        entry[key] = element[key]
+
+  def __iter__(self):
+    return iter(self.names)
+
+  def keys(self):
+    return filenames(self)
+
+  def get(self, filename, default=None):
+    row = self.find(filename)
+    if row == -1 :
+      return default
+    return fileentry(self, row)
+
+  def find(self, filename):
+    row = self.tailrows.get(filename, -1)
+    if row != -1 :
+      return row
+    row = poemods_cache.lowerbound(self.name, self.sortedcount, poemods_cache.namekey(filename))
+    if row < self.sortedcount and self.names[row] == filename :
+      return row
+    return -1
+
+  def name(self, row):
+    return self.names[row]
+
+  def digest(self, row):
+    if row in self.digests :
+      return self.digests[row]
+    if isinstance(self.names, poemods_cache.cachednames) :
+      digest = self.cache.digest(row)
+      if digest != poemods_cache.nodigest :
+        return digest
+    return None
+
+  def findhash(self, hashf):
+    # hash -> row of the files inside bundles, the hashes in order are built on first use
+    if self.hashkeys is None :
+      hashes = self.columns["hash"]
+      bundles = self.columns["bundle"]
+      rows = [row for row in range(len(self)) if bundles[row] != -1]
+      rows.sort(key=hashes.__getitem__)
+      self.hashrows = array("q", rows)
+      self.hashkeys = array("Q", [hashes[row] for row in rows])
+    i = bisect.bisect_left(self.hashkeys, hashf)
+    if i < len(self.hashkeys) and self.hashkeys[i] == hashf :
+      return self.hashrows[i]
+    return -1
+
+  def attach(self, cache):
+    # the names are read from the cache just written from this table, they leave the memory
+    if cache is None or cache.count != len(self) or len(self.tailrows) > 0 or self.sortedcount != len(self) :
+      return False
+    self.cache = cache
+    self.names = poemods_cache.cachednames(cache)
+    self.digests = {}
+    return True
+
+  def materialize(self):
+    # rows are going to be added to a table read from the cache, the names are copied out of the mapping
+    if isinstance(self.names, poemods_cache.cachednames) :
+      for row in range(len(self)) :
+        digest = self.digest(row)
+        if digest is not None :
+          self.digests[row] = bytes(digest)
+      cache = self.cache
+      offsets = array("Q")
+      view = cache.offsets.cast("B")
+      offsets.frombytes(view)
+      view.release()
+      self.names = poemods_cache.namecolumn(offsets, bytearray(cache.mm[cache.pathstart:cache.pathstart+offsets[-1]]))
+
+  def addrow(self, filename, element):
+    self.materialize()
+    row = len(self)
+    columns = self.columns
+    columns["position"].append(element["position"])
+    columns["length"].append(element["length"])
+    columns["referenceposition"].append(element["referenceposition"])
+    if "bundlename" in element :
+      columns["bundle"].append(self.find(element["bundlename"]))
+      columns["hash"].append(element["hash"])
+    else :
+      columns["bundle"].append(-1)
+      columns["hash"].append(0)
+    self.names.append(filename)
+    self.tailrows[filename] = row
+    self.hashkeys = None
+    for key in element :
+      if key == "digest" :
+        self.digests[row] = bytes(element[key])
+      elif key not in rowkeys :
+        if row not in self.extra :
+          self.extra[row] = {}
+        self.extra[row][key] = element[key]
+
+  def sort(self):
+    # rows in namekey order, the bundle column is renumbered
+    self.materialize()
+    count = len(self)
+    names = self.names
+    order = sorted(range(count), key=lambda row: poemods_cache.namekey(names[row]))
+    newrows = array("q", bytes(8 * count))
+    for newrow, row in enumerate(order) :
+      newrows[row] = newrow
+    for column, typecode in poemods_cache.cachecolumns :
+      values = self.columns[column]
+      self.columns[column] = array(typecode, [values[row] for row in order])
+    bundles = self.columns["bundle"]
+    for newrow in range(count) :
+      if bundles[newrow] != -1 :
+        bundles[newrow] = newrows[bundles[newrow]]
+    sortednames = poemods_cache.namecolumn()
+    for row in order :
+      sortednames.blob += names.raw(row)
+      sortednames.offsets.append(len(sortednames.blob))
+    self.names = sortednames
+    self.sortedcount = count
+    self.tailrows = {}
+    self.digests = {newrows[row] : self.digests[row] for row in self.digests}
+    self.extra = {newrows[row] : self.extra[row] for row in self.extra}
+    self.hashkeys = None
+
+class fileentry(object):
+  # one row of the table seen as the dict of the element
+  __slots__ = ["table", "row"]
+
+  def __init__(self, table, row):
+    self.table = table
+    self.row = row
+
+  def __getitem__(self, key):
+    table = self.table
+    row = self.row
+    if key == "position" or key == "length" or key == "referenceposition" :
+      return table.columns[key][row]
+    if key == "path" :
+      return poemods_cache.splitname(table.name(row))[0]
+    if key == "name" :
+      return poemods_cache.splitname(table.name(row))[1]
+    if key == "bundlename" or key == "hash" :
+      bundle = table.columns["bundle"][row]
+      if bundle == -1 :
+        raise KeyError(key)
+      if key == "hash" :
+        return table.columns["hash"][row]
+      return table.name(bundle)
+    if key == "digest" :
+      digest = table.digest(row)
+      if digest is None :
+        raise KeyError(key)
+      return digest
+    if row not in table.extra :
+      raise KeyError(key)
+    return table.extra[row][key]
+
+  def __setitem__(self, key, value):
+    table = self.table
+    row = self.row
+    if key == "position" or key == "length" or key == "referenceposition" :
+      table.columns[key][row] = value
+    elif key == "bundlename" :
+      table.columns["bundle"][row] = table.find(value)
+      table.hashkeys = None
+    elif key == "hash" :
+      table.columns["hash"][row] = value
+      table.hashkeys = None
+    elif key == "digest" :
+      table.digests[row] = bytes(value)
+    elif key == "path" or key == "name" :
+      raise KeyError("%s is part of the row name" % (key))
+    else :
+      if row not in table.extra :
+        table.extra[row] = {}
+      table.extra[row][key] = value
+
+  def __contains__(self, key):
+    try :
+      self[key]
+    except KeyError :
+      return False
+    return True
+
+  def get(self, key, default=None):
+    try :
+      return self[key]
+    except KeyError :
+      return default
+
+  def keys(self):
+    keys = list(entrykeys)
+    for key in ["bundlename", "hash", "digest"] :
+      if key in self :
+        keys.append(key)
+    keys.extend(self.table.extra.get(self.row, {}))
+    return keys
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __copy__(self):
+    # a plain dict, changing the copy does not change the table
+    return {key : self[key] for key in self.keys()}
+
+  def __repr__(self):
+    return repr(self.__copy__())
+
+class filenames(object):
+  # fullfilelist, the names of the table in row order
+  def __init__(self, table):
+    self.table = table
+
+  def __len__(self):
+    return len(self.table)
+
+  def __getitem__(self, i):
+    return self.table.names[i]
+
+  def __iter__(self):
+    return iter(self.table.names)
+
+class filehashes(object):
+  # hashdic, hash -> name of the files inside bundles
+  def __init__(self, table):
+    self.table = table
+
+  def __contains__(self, hashf):
+    return self.table.findhash(hashf) != -1
+
+  def __getitem__(self, hashf):
+    row = self.table.findhash(hashf)
+    if row == -1 :
+      raise KeyError(hashf)
+    return self.table.name(row)
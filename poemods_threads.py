@@ -11,8 +11,51 @@ import shutil
 import threading
 import queue
 import poemods_ggpk
+import poemods_blocks
+import poemods_free
+import poemods_batch
 import brotli
 import random
+import itertools
+import contextlib
+
+class sharedlock(object):
+  # held by any number of readers at once or by one writer, a waiting writer goes before new readers
+  
+  def __init__(self):
+    self.condition = threading.Condition()
+    self.readers = 0
+    self.writers = 0
+    self.writing = False
+  
+  @contextlib.contextmanager
+  def shared(self):
+    with self.condition :
+      while self.writing is True or self.writers > 0 :
+        self.condition.wait()
+      self.readers += 1
+    try :
+      yield
+    finally :
+      with self.condition :
+        self.readers -= 1
+        if self.readers == 0 :
+          self.condition.notify_all()
+  
+  @contextlib.contextmanager
+  def exclusive(self):
+    with self.condition :
+      self.writers += 1
+      while self.writing is True or self.readers > 0 :
+        self.condition.wait()
+      self.writers -= 1
+      self.writing = True
+    try :
+      yield
+    finally :
+      with self.condition :
+        self.writing = False
+        self.condition.notify_all()
 
 class manager(object):
   
@@ -20,6 +63,8 @@ class manager(object):
     
     # never load more bytes than viewerSizeLimit in the app's viewer
     self.viewerSizeLimit = 256 * 1024
+    # files larger than extractStreamLimit are extracted one block at a time
+    self.extractStreamLimit = 4 * 1024 * 1024
     
     self.modg=poemods_ggpk.listggpkfiles()
     if os.path.exists("extracted") is False :
@@ -33,6 +78,8 @@ class manager(object):
     self.threadskeeprunning=True
     self.didmodifybundle = False
     self.mylock=threading.Lock()
+    # the workers read the ggpk side by side, a batch is only written once none of them reads
+    self.readlock=sharedlock()
     self.workqueue = queue.Queue()
     for i in range(4) :
       t=threading.Thread(target=self.workerthread)
@@ -54,6 +101,10 @@ class manager(object):
           self.modg.updateindexbundle()
         for i in self.modg.bench :
           print("%5.5f" % i)
+        print("block cache : " + poemods_blocks.blocks.stats())
+        print("bundle free space : " + poemods_free.summary(list(self.modg.freespaces.values())))
+        if self.modg.freerecords is not None :
+          print("ggpk free records : %d holes %d bytes (largest %d)" % self.modg.freerecords.stats()[:3])
       elif vala[0]=="scan modg" :
         self.sendmessage.put(["Scanning %s" % (vala[1]), "scan modg", "", True])
         self.modg.rescanggpk(vala[1], vala[2], True)
@@ -61,6 +112,12 @@ class manager(object):
           self.sendmessage.put(["Invalid Content.ggpk : %s." % (vala[1]), "scan modg", "", False])
         else :
           self.sendmessage.put(["", "scan modg", "", False])
+      elif vala[0]=="decode threads" :
+        self.modg.setdecodethreads(vala[1])
+      elif vala[0]=="compress level" :
+        self.modg.setcompresslevel(vala[1])
+      elif vala[0]=="block cache" :
+        poemods_blocks.blocks.setbudget(vala[1] * 1024 * 1024)
       elif vala[0]=="defragment" :
         self.sendmessage.put(["Defragmenting %s" % (self.modg.ggpkname), "defragment", "", True])
         self.modg.defragment(vala[1])
@@ -69,22 +126,57 @@ class manager(object):
         if len(self.modg.fullfilelistdic)>0 :
           matchinglist=self.getfilteredlist(vala[1], vala[2], vala[3], vala[4])
           self.sendmessage.put(["%d files are being extracted..." % (len(matchinglist)), "extract", "", True])
-          with open(self.modg.ggpkname, "rb") as ggpkpointeri :
-            count=0
-            for filename in matchinglist :
-              targetpath=os.path.join("extracted", self.modg.fullfilelistdic[filename]["path"][2:])
-              if os.path.exists(targetpath) is False :
-                os.makedirs(targetpath)
-              targetfilename=os.path.join(targetpath, self.modg.fullfilelistdic[filename]["name"])
-              piece = self.modg.readbinarydata(filename, ggpkpointeri)
-              if filename.endswith(".dds") is True :
-                piece = self.decodedds(piece)
+          # files are read bundle by bundle, a writer thread writes them while the next ones are decompressed
+          writequeue=queue.Queue(64)
+          writererrors=[]
+          writer=threading.Thread(target=self.writerthread, args=(writequeue, writererrors))
+          writer.daemon=True
+          writer.start()
+          smallfiles=[]
+          largefiles=[]
+          for filename in matchinglist :
+            if self.modg.fullfilelistdic[filename]["length"] > self.extractStreamLimit :
+              largefiles.append(filename)
+            else :
+              smallfiles.append(filename)
+          count=0
+          error=None
+          try :
+            with open(self.modg.ggpkname, "rb") as ggpkpointeri :
+              for filename in largefiles :
+                chunks = self.modg.readbinarydatachunks(filename, ggpkpointeri)
+                if filename.endswith(".dds") is True :
+                  chunks = self.decodeddschunks(chunks)
+                  if chunks is None :
+                    continue
+                targetpath=os.path.join("extracted", self.modg.fullfilelistdic[filename]["path"][2:])
+                targetfilename=os.path.join(targetpath, self.modg.fullfilelistdic[filename]["name"])
+                if self.writechunks(targetpath, targetfilename, chunks) is True :
+                  count+=1
+              for filename, piece in self.modg.readbinarydatabybundle(smallfiles, ggpkpointeri) :
                 if piece is None :
                   continue
-              with open(targetfilename, "wb") as fout :
-                fout.write(piece)
-              count+=1
-          self.sendmessage.put(["%d files extracted." % (count), "extract", "", False])
+                if filename.endswith(".dds") is True :
+                  piece = self.decodedds(piece)
+                  if piece is None :
+                    continue
+                targetpath=os.path.join("extracted", self.modg.fullfilelistdic[filename]["path"][2:])
+                targetfilename=os.path.join(targetpath, self.modg.fullfilelistdic[filename]["name"])
+                writequeue.put([targetpath, targetfilename, piece])
+                count+=1
+          except Exception as e :
+            error=e
+          finally :
+            # the writer always ends, even when reading stopped early
+            writequeue.put(None)
+            writer.join()
+          if error is None and len(writererrors)>0 :
+            error=writererrors[0]
+          if error is not None :
+            print("extract error : %s" % (str(error)))
+            self.sendmessage.put(["Extract error : %s. %d files extracted." % (str(error), count - len(writererrors)), "extract", "", False])
+          else :
+            self.sendmessage.put(["%d files extracted." % (count), "extract", "", False])
         else :
           self.sendmessage.put(["Please scan backup Content.ggpk first."])
       elif vala[0]=="insert" :
@@ -94,7 +186,11 @@ class manager(object):
         if len(self.modg.fullfilelistdic)>0 :
           matchinglist=self.getfilteredlist(vala[1], vala[2], vala[3], vala[4])
           self.sendmessage.put(["%d files are being inserted..." % (len(matchinglist)), "insert", "", True])
+          batch=poemods_batch.writebatch(self.modg)
           with open(self.modg.ggpkname, "r+b") as ggpkpointerio :
+            # the encoding of the original textures is told by their first 4 bytes, read in one batch
+            ddsfiles=[filename for filename in matchinglist if filename.endswith(".dds") is True and os.path.exists(os.path.join("extracted", filename)) is True]
+            ddsheads=self.modg.probe(ddsfiles, ggpkpointerio, 4)
             count=0
             for filename in matchinglist :
               targetfilename=os.path.join("extracted", filename)
@@ -103,14 +199,13 @@ class manager(object):
                 with open(targetfilename, "rb") as fin :
                   piece=fin.read()
                 if filename.endswith(".dds") is True :
-                  pieceorig = self.modg.readbinarydata(filename, ggpkpointerio)
-                  encodingneeded = self.encodeddsneeded(pieceorig)
+                  encodingneeded = self.encodeddsneeded(ddsheads.get(filename))
                   if encodingneeded is True :
                     piece = self.encodedds(piece)
-                writethis = self.modg.generateheader(filename, piece)
-                self.modg.writebinarydata(filename, writethis, ggpkpointerio)
+                if batch.add(filename, piece) is True :
+                  batch.apply(ggpkpointerio)
                 count+=1
-          self.modg.saveinfo()
+            batch.commit(ggpkpointerio)
           self.sendmessage.put(["%d files inserted." % (count), "insert", "", False])
         else :
           self.sendmessage.put(["Please scan backup Content.ggpk first."])
@@ -137,11 +232,14 @@ class manager(object):
         self.maxcount=matchinglistl
         self.curcount=0
         mymod=__import__("mods."+vala[5], fromlist=['bebop'])
+        # the modified files are written together once every file is modified
+        self.batch=poemods_batch.writebatch(self.modg)
         with open(self.modg.ggpkname, "r+b") as ggpkpointerio :
           for filename in matchinglist :
             self.workqueue.put([filename, mymod, ggpkpointerio])
           self.workqueue.join()
-        self.modg.saveinfo()
+          with self.mylock:
+            self.batch.commit(ggpkpointerio)
         self.sendmessage.put(["", "modify", vala[6], False])
       elif vala[0]=="restore" :
         if len(self.modg.fullfilelistdic)==0 :
@@ -152,17 +250,7 @@ class manager(object):
           continue
         matchinglist=self.getfilteredlist(vala[1], vala[2], vala[3], vala[4])
         self.sendmessage.put(["%d files are being restored..." % (len(matchinglist)), "restore", "", True])
-        with open(self.modg.ggpkname, "r+b") as ggpkpointerio :
-          count=0
-          for filename in matchinglist :
-            if filename in self.modg.keeplist :
-              filedata=self.modg.readbinarydata(filename, ggpkpointerio)
-              if filedata is None :
-                continue
-              writethis = self.modg.generateheader(filename, filedata)
-              self.modg.onlywritebinarydata(filename, writethis, ggpkpointerio)
-              count+=1
-        self.modg.saveinfo()
+        count=self.restorefiles(matchinglist)
         self.sendmessage.put(["%d files restored." % (count), "restore", "", False])
       elif vala[0]=="replacewith" :
         if len(self.modg.fullfilelistdic)==0 :
@@ -195,25 +283,31 @@ class manager(object):
             piece=b''
             with open(targetfilename, "rb") as fin :
               piece=fin.read()
+            batch=poemods_batch.writebatch(self.modg)
             with open(self.modg.ggpkname, "r+b") as ggpkpointerio :
               count=0
               for filename in matchinglist :
-                writethis = self.modg.generateheader(filename, piece)
-                self.modg.writebinarydata(filename, writethis, ggpkpointerio)
+                if batch.add(filename, piece) is True :
+                  batch.apply(ggpkpointerio)
                 count+=1
-            self.modg.saveinfo()
+              batch.commit(ggpkpointerio)
             self.sendmessage.put(["%d files replaced." % (count), "replacewithasset", "", False])
           else :
             self.sendmessage.put(["Please put %s in the assets folder first." % (vala[5])])
         else :
           self.sendmessage.put(["Please scan backup Content.ggpk first."])
   
+  def ddsreference(self, filedata):
+    # "*" followed by the path of the texture used instead, the first 4 bytes tell
+    return filedata[0] == ord("*") and filedata[3]>=0x20
+  
   def encodeddsneeded(self, filedata):
+    # the first 4 bytes of the original are enough, as returned by probe
     if filedata is None :
       return False
     if len(filedata)<4 :
       return False
-    if filedata[0] == ord("*") and filedata[3]>=0x20 :
+    if self.ddsreference(filedata) is True :
       return False
     if filedata[:4] == b'DDS ' :
       return False
@@ -231,24 +325,82 @@ class manager(object):
       return None
     if len(filedata)<4 :
       return None
-    if filedata[0] == ord("*") and filedata[3]>=0x20 :
+    if self.ddsreference(filedata) is True :
       return None
     if filedata[:4] == b'DDS ' :
       return filedata
     else :
       size = int.from_bytes(filedata[:4], 'little')
-      filedatamod = brotli.decompress(filedata[4:])
+      try :
+        filedatamod = brotli.decompress(filedata[4:])
+      except brotli.error as e :
+        print("brotli decompress error : %s" % (str(e)))
+        return None
       if len(filedatamod)!=size :
         print("brotli decompress error")
         return None
       else :
         return filedatamod
   
+  def decodeddschunks(self, chunks):
+    # decodedds for a file read by pieces, None when the file is not extracted
+    chunks = iter(chunks)
+    header = bytearray()
+    for chunk in chunks :
+      header += chunk
+      if len(header) >= 4 :
+        break
+    if len(header)<4 :
+      return None
+    if self.ddsreference(header) is True :
+      return None
+    if header[:4] == b'DDS ' :
+      return itertools.chain([header], chunks)
+    return self.brotlichunks(int.from_bytes(header[:4], 'little'), itertools.chain([header[4:]], chunks))
+  
+  def brotlichunks(self, size, chunks):
+    decompressor = brotli.Decompressor()
+    decompressed = 0
+    for chunk in chunks :
+      filedatamod = decompressor.process(bytes(chunk))
+      decompressed += len(filedatamod)
+      yield filedatamod
+    if decompressed != size or decompressor.is_finished() is False :
+      raise ValueError("brotli decompress error")
+  
+  def writechunks(self, targetpath, targetfilename, chunks) :
+    if os.path.exists(targetpath) is False :
+      os.makedirs(targetpath)
+    try :
+      with open(targetfilename, "wb") as fout :
+        for chunk in chunks :
+          fout.write(chunk)
+    except (ValueError, brotli.error) as e :
+      print(str(e))
+      os.remove(targetfilename)
+      return False
+    return True
+  
+  def writerthread(self, writequeue, errors) :
+    # a file that cannot be written is added to errors, the queue is read until None so nothing waits on it
+    while True :
+      towrite = writequeue.get()
+      if towrite is None :
+        break
+      targetpath, targetfilename, piece = towrite
+      try :
+        if os.path.exists(targetpath) is False :
+          os.makedirs(targetpath)
+        with open(targetfilename, "wb") as fout :
+          fout.write(piece)
+      except OSError as e :
+        errors.append(e)
+  
   def workerthread(self) :
     while True :
       filename = self.workqueue.get()
       if self.threadskeeprunning is True :
-        with self.mylock:
+        with self.readlock.shared():
           backupfiledata=self.modg.readbinarydata(filename[0], filename[2])
         if backupfiledata is not None :
           filedatamod, encoding, bom = filename[1].execute(filename[0], backupfiledata, self.modg)
@@ -257,23 +409,40 @@ class manager(object):
               filedatamodified = filedatamod
             else :
               filedatamodified = bom + filedatamod.encode(encoding)
-            writethis = self.modg.generateheader(filename[0], filedatamodified)
-            with self.mylock:
-              self.modg.writebinarydata(filename[0], writethis, filename[2])
+            if self.batch.add(filename[0], filedatamodified) is True :
+              with self.mylock, self.readlock.exclusive():
+                self.batch.apply(filename[2])
         #self.curcount+=1
         #if self.curcount%500==0 :
         #    print("%d / %d" % (self.curcount, self.maxcount))
       self.workqueue.task_done()
   
+  def restorefiles(self, matchinglist) :
+    # the originals kept on disk are written back together, the number of files restored
+    batch=poemods_batch.writebatch(self.modg, keeporiginals=False)
+    with open(self.modg.ggpkname, "r+b") as ggpkpointerio :
+      count=0
+      for filename in matchinglist :
+        if filename in self.modg.keeplist :
+          filedata=self.modg.readbinarydata(filename, ggpkpointerio)
+          if filedata is None :
+            continue
+          if batch.add(filename, filedata) is True :
+            batch.apply(ggpkpointerio)
+          count+=1
+      batch.commit(ggpkpointerio)
+    return count
+  
   def modifyreplace(self, matchinglist, replacewiththis) :
     with open(self.modg.ggpkname, "r+b") as ggpkpointerio :
       replacewiththisdata=self.modg.readbinarydata(replacewiththis, ggpkpointerio)
       if replacewiththisdata is None :
         return False
+      batch=poemods_batch.writebatch(self.modg)
       for filename in matchinglist :
-        writethis = self.modg.generateheader(filename, replacewiththisdata)
-        self.modg.writebinarydata(filename, writethis, ggpkpointerio)
-    self.modg.saveinfo()
+        if batch.add(filename, replacewiththisdata) is True :
+          batch.apply(ggpkpointerio)
+      batch.commit(ggpkpointerio)
   
   def searchthread(self, i):
     while self.threadskeeprunning is True :
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+import os
+import sys
+import struct
+import hashlib
+import random
+import contextlib
+import io
+
+# small Content.ggpk written from scratch for the tests
+#   root PDIR -> Bundles2 PDIR -> Folder PDIR -> b0.bundle.bin ... bundles
+#                              -> _.index.bin
+#             -> loose.txt
+# bundle blocks are stored as they are after 0xcc 0x06, no libooz is needed to write them
+# poemods_ggpk opens libooz from ooz/build relative to the working directory : it is imported from the
+# root of the repository, the tests then run in a temporary directory holding keep/
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root not in sys.path :
+  sys.path.insert(0, root)
+
+def importggpk():
+  cwd = os.getcwd()
+  os.chdir(root)
+  try :
+    with contextlib.redirect_stdout(io.StringIO()) :
+      import poemods_ggpk
+  finally :
+    os.chdir(cwd)
+  return poemods_ggpk
+
+def fnv1a(filename):
+  hval = 0xcbf29ce484222325
+  for c in filename.lower() + "++" :
+    hval = ((hval ^ ord(c)) * 0x100000001b3) & 0xffffffffffffffff
+  return hval
+
+def bundle(data, blocksize=0x40000, compress=None):
+  # compress(block) is a compressed block, without it the blocks are stored
+  if compress is None :
+    compress = lambda block : b'\xcc\x06' + block
+  blocks = [bytes(compress(data[i:i+blocksize])) for i in range(0, len(data), blocksize)]
+  payload = b''.join(blocks)
+  header = struct.pack("<IIIII", len(data), len(payload), len(blocks) * 4 + 0x30, 8, 1)
+  header += struct.pack("<QQII", len(data), len(payload), len(blocks), blocksize) + b'\x00' * 16
+  return header + b''.join([struct.pack("<I", len(block)) for block in blocks]) + payload
+
+def pathrep(paths):
+  commands = [struct.pack("<I", 0), struct.pack("<I", 1) + b'\x00', struct.pack("<I", 0)]
+  for path in paths :
+    commands.append(struct.pack("<I", 1) + path.encode() + b'\x00')
+  return b''.join(commands)
+
+def index(bundles, files):
+  # bundles [name, size], files [path, bundle index, offset, size]
+  parts = [struct.pack("<I", len(bundles))]
+  for name, size in bundles :
+    parts.append(struct.pack("<I", len(name)) + name.encode() + struct.pack("<I", size))
+  parts.append(struct.pack("<I", len(files)))
+  for path, bi, offset, size in files :
+    parts.append(struct.pack("<QIII", fnv1a(path), bi, offset, size))
+  payload = pathrep([path for path, bi, offset, size in files])
+  parts.append(struct.pack("<I", 1) + struct.pack("<QIII", 1, 0, len(payload), len(payload)))
+  parts.append(bundle(payload))
+  return b''.join(parts)
+
+def filerecord(name, data):
+  bname = (name + "\x00").encode("UTF-16-LE")
+  return struct.pack("<I", 44 + len(bname) + len(data)) + b"FILE" + struct.pack("<I", len(name) + 1) + hashlib.sha256(data).digest() + bname + data
+
+def pdirrecord(name, children, digest):
+  bname = (name + "\x00").encode("UTF-16-LE")
+  table = b''.join([struct.pack("<IQ", i, position) for i, position in enumerate(children)])
+  return struct.pack("<I", 48 + len(bname) + len(table)) + b"PDIR" + struct.pack("<II", len(name) + 1, len(children)) + digest + bname + table
+
+def files(seed, nbundles, nfiles):
+  # path -> content of every file of the bundles
+  rnd = random.Random(seed)
+  contents = {}
+  for bi in range(nbundles) :
+    for fi in range(nfiles) :
+      path = "Metadata/B%d/file_%d.%s" % (bi, fi, ["mat", "dds", "ogg"][fi % 3])
+      if fi % 3 == 1 :
+        contents[path] = b'DDS ' + bytes([rnd.getrandbits(8) for i in range(100 + fi * 13)])
+      else :
+        contents[path] = ("version %d\r\nBlendMode Opaque\r\n%s\r\n" % (fi, path) * (1 + fi % 40)).encode("UTF-16-LE")
+  return contents
+
+def build(ggpkname, nbundles=3, nfiles=60, seed=1, free=65536, blocksize=0x40000):
+  # writes the ggpk, returns {"./path" : content} of every file, "./loose.txt" included
+  contents = files(seed, nbundles, nfiles)
+  bundles = []
+  entries = []
+  data = [bytearray() for bi in range(nbundles)]
+  for path in contents :
+    bi = int(path.split("/")[1][1:])
+    entries.append([path, bi, len(data[bi]), len(contents[path])])
+    data[bi] += contents[path]
+  for bi in range(nbundles) :
+    bundles.append(["Folder/b%d" % bi, len(data[bi])])
+  ggpk = bytearray(28)
+  def put(record):
+    position = len(ggpk)
+    ggpk.extend(record)
+    return position
+  bundlepositions = [put(filerecord("b%d.bundle.bin" % bi, bundle(bytes(data[bi]), blocksize))) for bi in range(nbundles)]
+  indexposition = put(filerecord("_.index.bin", bundle(index(bundles, entries))))
+  loose = "hello loose".encode("UTF-16-LE")
+  looseposition = put(filerecord("loose.txt", loose))
+  folderposition = put(pdirrecord("Folder", bundlepositions, hashlib.sha256(b"Folder").digest()))
+  bundles2position = put(pdirrecord("Bundles2", [folderposition, indexposition], hashlib.sha256(b"Bundles2").digest()))
+  rootposition = put(pdirrecord("", [bundles2position, looseposition], hashlib.sha256(b"root").digest()))
+  freeposition = put(struct.pack("<I4sQ", free, b"FREE", 0) + bytes(free - 16))
+  ggpk[0:28] = struct.pack("<I4sIQQ", 28, b"GGPK", 3, rootposition, freeposition)
+  with open(ggpkname, "wb") as fout :
+    fout.write(ggpk)
+  result = {"./" + path : contents[path] for path in contents}
+  result["./loose.txt"] = loose
+  return result
+
+def quiet():
+  # what the tool prints is not shown
+  return contextlib.redirect_stdout(io.StringIO())
+
+def scan(poemods_ggpk, ggpkname, forcerescan=False):
+  modg = poemods_ggpk.listggpkfiles()
+  with quiet() :
+    modg.rescanggpk(ggpkname, forcerescan, True)
+  return modg
+
+def read(modg, ggpkname, filename):
+  with open(ggpkname, "rb") as ggpk :
+    with contextlib.redirect_stdout(io.StringIO()) :
+      return bytes(modg.readggpkbinarydata(filename, ggpk))
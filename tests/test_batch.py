@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import unittest
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+import poemods_batch
+
+class batchtest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    self.contents = ggpkbuilder.build("Content.ggpk")
+    self.modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    # bundles patched, the index written back by commit not counted
+    self.patched = []
+    patchbundle = self.modg.patchbundle
+    def counted(ggpk, bundlename, patches, newextractedsize=-1):
+      if bundlename != "./Bundles2/_.index.bin" :
+        self.patched.append([bundlename, len(patches)])
+      return patchbundle(ggpk, bundlename, patches, newextractedsize)
+    self.modg.patchbundle = counted
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def commit(self, files):
+    batch = poemods_batch.writebatch(self.modg)
+    for filename in files :
+      batch.add(filename, files[filename])
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      count = batch.commit(ggpk)
+    self.contents.update(files)
+    return count
+
+  def check(self):
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk", True)
+    for filename in self.contents :
+      self.assertEqual(ggpkbuilder.read(modg, "Content.ggpk", filename), self.contents[filename], filename)
+
+  def test_same_payload_is_written_once(self):
+    payload = b'minimal ogg ' * 20000
+    filenames = ["./Metadata/B1/file_%d.ogg" % (fi) for fi in [2, 5, 8, 11, 14]]
+    bundlename = "./Bundles2/Folder/b1.bundle.bin"
+    with ggpkbuilder.quiet() :
+      self.modg.preparebundle(bundlename)
+    end = self.modg.freespaces[bundlename].end
+    self.assertEqual(self.commit({filename : payload for filename in filenames}), 5)
+    positions = set([self.modg.fullfilelistdic[filename]["position"] for filename in filenames])
+    self.assertEqual(len(positions), 1)
+    # the bundle is patched once and its used part grows by one payload
+    self.assertEqual(self.patched, [[bundlename, 1]])
+    self.assertEqual(self.modg.freespaces[bundlename].end, end + len(payload))
+    # written again later to other files : they point at it
+    self.commit({"./Metadata/B1/file_17.ogg" : payload, "./Metadata/B1/file_20.ogg" : payload})
+    self.assertEqual(self.patched, [[bundlename, 1]])
+    self.assertEqual(self.modg.fullfilelistdic["./Metadata/B1/file_20.ogg"]["position"], positions.pop())
+    self.assertEqual(self.modg.freespaces[bundlename].end, end + len(payload))
+    self.check()
+
+  def test_payloads_are_shared_inside_a_bundle(self):
+    payload = b'minimal dds ' * 100
+    files = {"./Metadata/B0/file_1.dds" : payload, "./Metadata/B2/file_4.dds" : payload, "./Metadata/B2/file_7.dds" : payload}
+    self.commit(files)
+    self.assertEqual(sorted(self.patched), [["./Bundles2/Folder/b0.bundle.bin", 1], ["./Bundles2/Folder/b2.bundle.bin", 1]])
+    self.assertEqual(self.modg.fullfilelistdic["./Metadata/B2/file_4.dds"]["position"], self.modg.fullfilelistdic["./Metadata/B2/file_7.dds"]["position"])
+    self.check()
+
+  def test_last_payload_added_is_written(self):
+    batch = poemods_batch.writebatch(self.modg, 10)
+    self.assertFalse(batch.add("./Metadata/B0/file_0.mat", b'first'))
+    self.assertFalse(batch.add("./Metadata/B0/file_0.mat", b'second'))
+    self.assertTrue(batch.add("./Metadata/B0/file_3.mat", b'third'))
+    self.assertEqual(batch.size, 11)
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      self.assertEqual(batch.commit(ggpk), 2)
+    self.assertEqual(batch.size, 0)
+    self.contents.update({"./Metadata/B0/file_0.mat" : b'second', "./Metadata/B0/file_3.mat" : b'third'})
+    self.check()
+
+if __name__ == "__main__" :
+  unittest.main()
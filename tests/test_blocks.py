@@ -0,0 +1,293 @@
+#!/usr/bin/python3
+import os
+import io
+import random
+import tempfile
+import unittest
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+import poemods_blocks
+
+class blockcachetest(unittest.TestCase):
+  def test_least_recently_used_blocks_go_first(self):
+    cache = poemods_blocks.blockcache(30)
+    cache.put(("b", 0, 1), b'a' * 10)
+    cache.put(("b", 1, 1), b'b' * 10)
+    cache.put(("c", 0, 1), b'c' * 10)
+    self.assertEqual(cache.get(("b", 0, 1)), b'a' * 10)
+    cache.put(("c", 1, 1), b'd' * 10)
+    self.assertIsNone(cache.get(("b", 1, 1)))
+    self.assertEqual(cache.size, 30)
+    # larger than the whole budget : not kept
+    cache.put(("c", 2, 1), b'e' * 31)
+    self.assertIsNone(cache.get(("c", 2, 1)))
+    cache.forget("b")
+    self.assertEqual(sorted(cache.blocks), [("c", 0, 1), ("c", 1, 1)])
+    cache.setbudget(15)
+    self.assertEqual(list(cache.blocks), [("c", 1, 1)])
+    self.assertEqual([cache.hits, cache.misses], [1, 2])
+
+class blocktabletest(unittest.TestCase):
+  def table(self, data, blocksize):
+    # table of a bundle whose compressed blocks are all of different sizes
+    sizes = iter(range(3, 1000, 7))
+    bundle = ggpkbuilder.bundle(data, blocksize, lambda block : bytes(next(sizes)))
+    return poemods_blocks.blocktable(bundle), bundle
+
+  def test_offsets_are_the_sums_of_the_sizes(self):
+    table, bundle = self.table(bytes(10 * 0x100 + 1), 0x100)
+    self.assertEqual([table.extractedsize, table.blockcount, table.blocksize], [10 * 0x100 + 1, 11, 0x100])
+    sizes = list(range(3, 1000, 7))[:11]
+    self.assertEqual(table.offsets[0], 60 + 4 * 11)
+    self.assertEqual(table.offsets[-1], len(bundle))
+    for i in range(11) :
+      self.assertEqual(table.compressed(i), (60 + 4 * 11 + sum(sizes[:i]), sizes[i]))
+    self.assertEqual(table.extracted(3), (3 * 0x100, 0x100))
+    self.assertEqual(table.extracted(10), (10 * 0x100, 1))
+
+  def test_blocks_of_a_range(self):
+    table, bundle = self.table(bytes(10 * 0x100 + 1), 0x100)
+    self.assertEqual(table.blocks(0, 1), range(0, 1))
+    self.assertEqual(table.blocks(0xff, 0x101), range(0, 2))
+    self.assertEqual(table.blocks(0x100, 0x200), range(1, 2))
+    self.assertEqual(table.blocks(0x250, 10 * 0x100 + 1), range(2, 11))
+    # cut to the extracted size, nothing for an empty range
+    self.assertEqual(table.blocks(10 * 0x100, 1 << 40), range(10, 11))
+    self.assertEqual(table.blocks(5, 5), range(0))
+    self.assertEqual(table.blocks(10 * 0x100 + 1, 1 << 40), range(0))
+
+  def test_compressed_offset_is_found_by_bisection(self):
+    table, bundle = self.table(bytes(40 * 0x80 + 9), 0x80)
+    for offset in range(len(bundle) + 5) :
+      expected = -1
+      for i in range(table.blockcount) :
+        if table.offsets[i] <= offset < table.offsets[i+1] :
+          expected = i
+      self.assertEqual(table.blockat(offset), expected, offset)
+
+  def test_tables_are_parsed_once_per_version(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp :
+      os.chdir(tmp)
+      try :
+        ggpkbuilder.build("Content.ggpk", blocksize=0x1000)
+        modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+        poemods_blocks.tables.clear()
+        bundlename = "./Bundles2/Folder/b0.bundle.bin"
+        with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+          position = modg.fullfilelistdic[bundlename]["position"] + 46 + len("b0.bundle.bin") * 2
+          reader = modg.readerfor(ggpk)
+          table = modg.blocktable(reader, position, bundlename)
+          self.assertIs(modg.blocktable(reader, position, bundlename), table)
+          self.assertEqual(table.offsets[-1], modg.fullfilelistdic[bundlename]["length"] - 46 - len("b0.bundle.bin") * 2)
+          modg.writebinarydata("./Metadata/B0/file_3.mat", b'new version', ggpk)
+          position = modg.fullfilelistdic[bundlename]["position"] + 46 + len("b0.bundle.bin") * 2
+          self.assertIsNot(modg.blocktable(modg.readerfor(ggpk), position, bundlename), table)
+      finally :
+        poemods_blocks.tables.clear()
+        os.chdir(cwd)
+
+class decompresstest(unittest.TestCase):
+  # blocks decompressed in a ggpk of small blocks
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    # blocks of 4KB, every bundle has about twenty of them
+    self.contents = ggpkbuilder.build("Content.ggpk", blocksize=0x1000)
+    self.modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    poemods_blocks.blocks.clear()
+    self.decompressed = 0
+    decompressoozinto = poemods_ggpk.decompressoozinto
+    def counted(filedata, uncompressed_size, output, offset):
+      self.decompressed += 1
+      return decompressoozinto(filedata, uncompressed_size, output, offset)
+    self.decompressoozinto = decompressoozinto
+    poemods_ggpk.decompressoozinto = counted
+
+  def tearDown(self):
+    poemods_ggpk.decompressoozinto = self.decompressoozinto
+    poemods_blocks.blocks.clear()
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+class extractcachetest(decompresstest):
+  def test_extract_fills_the_block_cache(self):
+    filenames = [filename for filename in self.contents if filename.startswith("./Metadata/B1/")]
+    with open("Content.ggpk", "rb") as ggpk, ggpkbuilder.quiet() :
+      for filename, piece in self.modg.readbinarydatabybundle(filenames, ggpk) :
+        self.assertEqual(piece, self.contents[filename])
+      blockcount = self.decompressed
+      self.assertGreater(blockcount, 10)
+      self.assertEqual(len(poemods_blocks.blocks.blocks), blockcount)
+      # read again : every block comes from the cache
+      for filename, piece in self.modg.readbinarydatabybundle(filenames, ggpk) :
+        self.assertEqual(piece, self.contents[filename])
+      for filename in filenames :
+        self.assertEqual(b''.join(self.modg.readbinarydatachunks(filename, ggpk)), self.contents[filename])
+        self.assertEqual(bytes(self.modg.readbinarydata(filename, ggpk)), self.contents[filename])
+    self.assertEqual(self.decompressed, blockcount)
+
+  def test_streamed_blocks_are_cached(self):
+    filename = "./Metadata/B2/file_39.mat"
+    with open("Content.ggpk", "rb") as ggpk, ggpkbuilder.quiet() :
+      self.assertEqual(b''.join(self.modg.readbinarydatachunks(filename, ggpk)), self.contents[filename])
+      blockcount = self.decompressed
+      self.assertGreater(blockcount, 1)
+      self.assertEqual(bytes(self.modg.readbinarydata(filename, ggpk)), self.contents[filename])
+    self.assertEqual(self.decompressed, blockcount)
+
+class probetest(decompresstest):
+  def test_first_block_of_each_file_is_decoded_once(self):
+    filenames = [filename for filename in self.contents if filename.startswith("./Metadata/B0/")]
+    with open("Content.ggpk", "rb") as ggpk, ggpkbuilder.quiet() :
+      heads = self.modg.probe(filenames + ["./loose.txt"], ggpk, 4)
+      self.assertEqual(sorted(heads), sorted(filenames + ["./loose.txt"]))
+      for filename in heads :
+        self.assertIsInstance(heads[filename], memoryview)
+        self.assertEqual(bytes(heads[filename]), self.contents[filename][:4])
+      # files sharing a first block share its decoding
+      firstblocks = set()
+      for filename in filenames :
+        fileinfo = self.modg.fullfilelistdic[filename]
+        firstblocks.add(fileinfo["position"] // 0x1000)
+      self.assertEqual(self.decompressed, len(firstblocks))
+      self.assertLess(self.decompressed, len(filenames))
+      # more than a file holds
+      filename = "./Metadata/B0/file_4.dds"
+      self.assertEqual(bytes(self.modg.probe([filename], ggpk, 1 << 20)[filename]), self.contents[filename])
+
+  def test_unreadable_file_is_none(self):
+    fileinfo = self.modg.fullfilelistdic["./loose.txt"]
+    self.modg.ggpksize = fileinfo["position"] + 10
+    with open("Content.ggpk", "rb") as ggpk, ggpkbuilder.quiet() :
+      self.assertEqual(self.modg.probe(["./loose.txt"], ggpk, 4), {"./loose.txt" : None})
+
+def content(size, seed=2):
+  rnd = random.Random(seed)
+  return b''.join([rnd.choice([b"BlendMode Opaque\r\n", rnd.randbytes(7), b"\x00" * 5]) for i in range(size // 8)])[:size]
+
+class decodertest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    self.nativebundle = poemods_ggpk.nativebundle
+    self.modg = poemods_ggpk.listggpkfiles()
+
+  def tearDown(self):
+    poemods_ggpk.nativebundle = self.nativebundle
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+class decodetest(decodertest):
+  def test_block_is_written_at_its_offset(self):
+    output = bytearray(b'\xff' * (100 + poemods_ggpk.safespace))
+    self.assertTrue(poemods_ggpk.decompressoozinto(b'\xcc\x06' + b'abc' * 10, 30, output, 10))
+    self.assertEqual(bytes(output[:10]), b'\xff' * 10)
+    self.assertEqual(bytes(output[10:40]), b'abc' * 10)
+    self.assertEqual(bytes(output[40:100]), b'\xff' * 60)
+
+  @unittest.skipIf(poemods_ggpk.nativecompress is False, "libooz without Ooz_Compress")
+  def test_compressed_blocks_are_written_in_place(self):
+    data = content(5 * 0x1000 + 123)
+    compressed = [bytes(poemods_ggpk.compressooz(bytearray(data[i:i+0x1000]), 4)) for i in range(0, len(data), 0x1000)]
+    self.assertTrue(all([block[0] != 0xcc for block in compressed[:-1]]))
+    # one output, the safe space of a block is written over by the next one
+    output = bytearray(len(data) + poemods_ggpk.safespace)
+    for i, block in enumerate(compressed) :
+      self.assertTrue(poemods_ggpk.decompressoozinto(block, min(0x1000, len(data) - i * 0x1000), output, i * 0x1000))
+    self.assertEqual(bytes(output[:len(data)]), data)
+
+  def test_bundles_are_extracted_into_one_output(self):
+    data = content(9 * 0x1000 + 5)
+    compress = None
+    if poemods_ggpk.nativecompress is True :
+      compress = lambda block : poemods_ggpk.compressooz(bytearray(block), 4)
+    bundle = ggpkbuilder.bundle(data, 0x1000, compress)
+    for native in sorted(set([False, self.nativebundle])) :
+      poemods_ggpk.nativebundle = native
+      extracted = self.modg.extractbundle(io.BytesIO(b'pad' + bundle), 3)
+      self.assertIsInstance(extracted, bytearray)
+      self.assertEqual(len(extracted), len(data))
+      self.assertEqual(extracted, data)
+
+class paralleltest(decodertest):
+  def blocks(self, data, blocksize):
+    # (compressed block, size, offset) of data
+    blocks = []
+    for offset in range(0, len(data), blocksize) :
+      block = data[offset:offset+blocksize]
+      if poemods_ggpk.nativecompress is True and (offset // blocksize) % 3 != 2 :
+        compressed = bytes(poemods_ggpk.compressooz(bytearray(block), 4))
+      else :
+        compressed = b'\xcc\x06' + block
+      blocks.append([compressed, len(block), offset])
+    return blocks
+
+  def test_blocks_decoded_side_by_side_are_in_order(self):
+    data = content(40 * 0x1000 + 77, 5)
+    blocks = self.blocks(data, 0x1000)
+    decoder = poemods_ggpk.blockdecoder(4)
+    try :
+      for count in [1, 2, 3, len(blocks)] :
+        output = bytearray(count * 0x1000 + poemods_ggpk.safespace)
+        self.assertTrue(decoder.decode(blocks[:count], output))
+        end = blocks[count-1][2] + blocks[count-1][1]
+        self.assertEqual(bytes(output[:end]), data[:end])
+    finally :
+      decoder.close()
+
+  def test_failed_block_is_reported(self):
+    blocks = self.blocks(content(4 * 0x1000, 6), 0x1000)
+    blocks[2][0] = b'\x8c\x0a' + bytes(40)
+    decoder = poemods_ggpk.blockdecoder(3)
+    try :
+      with ggpkbuilder.quiet() :
+        self.assertFalse(decoder.decode(blocks, bytearray(4 * 0x1000 + poemods_ggpk.safespace)))
+    finally :
+      decoder.close()
+
+  def test_bundle_is_extracted_by_the_threads(self):
+    poemods_ggpk.nativebundle = False
+    data = content(33 * 0x1000 + 9, 7)
+    compress = None
+    if poemods_ggpk.nativecompress is True :
+      compress = lambda block : poemods_ggpk.compressooz(bytearray(block), 4)
+    bundle = ggpkbuilder.bundle(data, 0x1000, compress)
+    self.modg.setdecodethreads(0)
+    self.assertEqual(self.modg.decoder.threads, os.cpu_count() or 1)
+    self.modg.setdecodethreads(4)
+    self.assertEqual(self.modg.decoder.threads, 4)
+    self.assertEqual(self.modg.extractbundle(io.BytesIO(bundle), 0), data)
+    self.modg.setdecodethreads(1)
+    self.assertIsNone(self.modg.decoder.pool)
+
+@unittest.skipIf(poemods_ggpk.nativebundle is False, "libooz without Ooz_DecompressBundle")
+class nativetest(unittest.TestCase):
+  def decompress(self, bundle, start, length, threads):
+    # (return value, bytes written) of Ooz_DecompressBundle
+    ffi = poemods_ggpk.ffi
+    output = bytearray(length + poemods_ggpk.safespace)
+    written = poemods_ggpk.ooz.Ooz_DecompressBundle(ffi.from_buffer("uint8_t[]", bundle), len(bundle), start, length, ffi.from_buffer("uint8_t[]", output), threads)
+    return written, bytes(output[:max(written, 0)])
+
+  def test_ranges_are_decoded(self):
+    data = content(21 * 0x1000 + 300, 8)
+    compress = None
+    if poemods_ggpk.nativecompress is True :
+      compress = lambda block : poemods_ggpk.compressooz(bytearray(block), 4)
+    for bundle in [ggpkbuilder.bundle(data, 0x1000, compress), ggpkbuilder.bundle(data, 0x1000)] :
+      for threads in [1, 4] :
+        for start, length in [[0, len(data)], [5, 10], [0x1000 - 3, 6], [0x1800, 7 * 0x1000 + 1], [0x1000 * 21, 300], [len(data) - 10, 1000]] :
+          written, output = self.decompress(bundle, start, length, threads)
+          self.assertEqual(written, min(length, len(data) - start))
+          self.assertEqual(output, data[start:start+length])
+        self.assertEqual(self.decompress(bundle, len(data), 10, threads)[0], 0)
+    # the blocks holding the range are missing
+    self.assertEqual(self.decompress(bundle[:len(bundle) // 2], len(data) - 10, 10, 1)[0], -1)
+    self.assertEqual(self.decompress(bundle[:40], 0, 10, 1)[0], -1)
+
+if __name__ == "__main__" :
+  unittest.main()
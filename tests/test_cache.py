@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import unittest
+import contextlib
+import io
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+import poemods_cache
+
+class cachetest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def test_warm_start_reads_the_table_from_the_cache(self):
+    contents = ggpkbuilder.build("Content.ggpk")
+    cold = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    self.assertIsInstance(modg.fullfilelistdic.names, poemods_cache.cachednames)
+    self.assertEqual(list(modg.fullfilelist), list(cold.fullfilelist))
+    for filename in cold.fullfilelist :
+      self.assertEqual(modg.fullfilelistdic[filename].__copy__(), cold.fullfilelistdic[filename].__copy__())
+    # the files of a bundle are only listed once one of them is written
+    bundlename = "./Bundles2/Folder/b1.bundle.bin"
+    self.assertNotIn("flist", modg.fullfilelistdic[bundlename])
+    filename = "./Metadata/B1/file_2.ogg"
+    data = b'written after a warm start'
+    with open("Content.ggpk", "r+b") as ggpk, contextlib.redirect_stdout(io.StringIO()) :
+      modg.writebinarydata(filename, data, ggpk)
+      modg.updateindexbundle(ggpk)
+    self.assertNotIn("flist", modg.fullfilelistdic["./Bundles2/Folder/b0.bundle.bin"])
+    flist = modg.fullfilelistdic[bundlename]["flist"]
+    self.assertEqual(len(flist), 60)
+    self.assertEqual([entry[0] for entry in flist], sorted([entry[0] for entry in flist]))
+    self.assertIsInstance(modg.fullfilelistdic.names, poemods_cache.cachednames)
+    contents[filename] = data
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk", True)
+    for filename in contents :
+      self.assertEqual(ggpkbuilder.read(modg, "Content.ggpk", filename), contents[filename], filename)
+
+if __name__ == "__main__" :
+  unittest.main()
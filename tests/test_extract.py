@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+import os
+import queue
+import tempfile
+import threading
+import unittest
+import contextlib
+import io
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+import poemods_threads
+
+class extracttest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    # only the helpers are used, no thread of the manager is started
+    self.manager = poemods_threads.manager.__new__(poemods_threads.manager)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def test_broken_brotli_texture_is_skipped(self):
+    with contextlib.redirect_stdout(io.StringIO()) :
+      self.assertIsNone(self.manager.decodedds(b'\x10\x00\x00\x00not brotli at all'))
+
+  def test_writer_reports_errors_and_drains(self):
+    writequeue = queue.Queue(2)
+    errors = []
+    writer = threading.Thread(target=self.manager.writerthread, args=(writequeue, errors))
+    writer.daemon = True
+    writer.start()
+    with open("file", "wb") as fout :
+      fout.write(b'x')
+    # "file" is not a directory, every write fails and the queue is still emptied
+    for i in range(10) :
+      writequeue.put([os.path.join("file", "dir"), os.path.join("file", "dir", "%d" % i), b'data'])
+    writequeue.put(["out", os.path.join("out", "ok"), b'data'])
+    writequeue.put(None)
+    writer.join(10)
+    self.assertFalse(writer.is_alive())
+    self.assertEqual(len(errors), 10)
+    with open(os.path.join("out", "ok"), "rb") as fin :
+      self.assertEqual(fin.read(), b'data')
+
+class copytest(unittest.TestCase):
+  # originals kept on disk and defragmented copies are written chunksize bytes at a time
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    self.contents = ggpkbuilder.build("Content.ggpk")
+    self.modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    self.chunksize = poemods_ggpk.chunksize
+    poemods_ggpk.chunksize = 4096
+    self.largest = 0
+    recordchunks = self.modg.recordchunks
+    def counted(ggpkpointer, position, size):
+      for chunk in recordchunks(ggpkpointer, position, size) :
+        self.largest = max(self.largest, len(chunk))
+        yield chunk
+    self.modg.recordchunks = counted
+
+  def tearDown(self):
+    poemods_ggpk.chunksize = self.chunksize
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def test_original_is_kept_by_chunks(self):
+    bundlename = "./Bundles2/Folder/b2.bundle.bin"
+    bundleinfo = self.modg.fullfilelistdic[bundlename]
+    self.modg.keeplist[bundlename] = "an older original"
+    with open("Content.ggpk", "rb") as ggpk, ggpkbuilder.quiet() :
+      targetfilename = self.modg.keptoriginal(bundlename, ggpk)
+      headerlength = 46 + len(bundleinfo["name"]) * 2
+      ggpk.seek(bundleinfo["position"] + headerlength)
+      original = ggpk.read(bundleinfo["length"] - headerlength)
+    self.assertGreater(len(original), 4 * 4096)
+    self.assertEqual(self.largest, 4096)
+    with open(targetfilename, "rb") as fin :
+      self.assertEqual(fin.read(), original)
+    # a loose file is kept the same way before it is written over
+    self.modg.isthemod = True
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      self.modg.writebinarydata("./loose.txt", self.modg.generateheader("./loose.txt", b'new'), ggpk)
+    with open(os.path.join("keep", "loose.txt"), "rb") as fin :
+      self.assertEqual(fin.read(), self.contents["./loose.txt"])
+
+  def test_defragmented_copy_is_written_by_chunks(self):
+    with ggpkbuilder.quiet() :
+      self.modg.defragment(os.path.join("copy", "Content.ggpk"))
+    self.assertEqual(self.largest, 4096)
+    copy = ggpkbuilder.scan(poemods_ggpk, os.path.join("copy", "Content.ggpk"), True)
+    for filename in self.contents :
+      self.assertEqual(ggpkbuilder.read(copy, os.path.join("copy", "Content.ggpk"), filename), self.contents[filename], filename)
+
+if __name__ == "__main__" :
+  unittest.main()
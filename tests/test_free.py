@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+import os
+import io
+import struct
+import tempfile
+import unittest
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+import poemods_free
+import poemods_cache
+import poemods_reader
+
+class freespacetest(unittest.TestCase):
+  def test_smallest_hole_that_fits(self):
+    free = poemods_free.freespace(1000, 900, [(0, 50), (100, 10), (200, 30), (300, 31), (400, 200)])
+    self.assertEqual(free.allocate(30), 200)
+    self.assertEqual(free.allocate(30), 300)
+    # what is left of the hole stays free
+    self.assertEqual(free.holes(), [(0, 50), (100, 10), (330, 1), (400, 200)])
+    self.assertEqual(free.allocate(100), 400)
+    self.assertEqual(free.holes(), [(0, 50), (100, 10), (330, 1), (500, 100)])
+    self.assertEqual(free.allocate(101), -1)
+    # a hole left smaller than minimum is not used
+    self.assertEqual(free.allocate(45, 10), 500)
+    self.assertEqual(free.allocateend(50), 900)
+    self.assertEqual(free.allocateend(51), -1)
+
+  def test_released_range_merges_with_both_sides(self):
+    free = poemods_free.freespace(1000, 800, [(100, 50), (300, 100)])
+    free.release(150, 150)
+    self.assertEqual(free.holes(), [(100, 300)])
+    free.release(500, 10)
+    free.release(520, 10)
+    free.release(510, 10)
+    self.assertEqual(free.holes(), [(100, 300), (500, 30)])
+    # free up to the end : the end moves back
+    free.release(700, 100)
+    self.assertEqual(free.end, 700)
+    free.release(530, 170)
+    self.assertEqual(free.holes(), [(100, 300)])
+    self.assertEqual(free.end, 500)
+    self.assertEqual(free.stats(), (1, 300, 300, 500, 0))
+
+  def test_fragmentation_statistics(self):
+    free = poemods_free.freespace(1000, 1000, [(0, 10), (100, 30)])
+    count, holebytes, largest, freeend, fragmentation = free.stats()
+    self.assertEqual([count, holebytes, largest, freeend], [2, 40, 30, 0])
+    self.assertAlmostEqual(fragmentation, 0.25)
+    self.assertIn("2 holes 40 bytes (largest 30)", poemods_free.summary([free, poemods_free.freespace(10, 5)]))
+
+  def test_free_space_from_the_files(self):
+    # files sharing their data and a file inside an other one add no hole
+    flist = [[0, 10], [10, 5], [10, 5], [30, 40], [40, 5], [100, 20]]
+    free = poemods_free.fromflist(flist, 150)
+    self.assertEqual(free.holes(), [(15, 15), (70, 30)])
+    self.assertEqual([free.size, free.end], [150, 120])
+
+class sparsefile(object):
+  # file object of the writes of flush and reader of fromchain, for ggpks larger than memory
+  def __init__(self):
+    self.pages = {}
+    self.position = 0
+
+  def seek(self, position):
+    self.position = position
+
+  def write(self, data):
+    for i in range(len(data)) :
+      page = self.pages.setdefault((self.position + i) >> 12, bytearray(4096))
+      page[(self.position + i) & 4095] = data[i]
+    self.position += len(data)
+
+  def read(self, position, length):
+    return bytes([self.pages.get((position + i) >> 12, bytes(4096))[(position + i) & 4095] for i in range(length)])
+
+class freerecordstest(unittest.TestCase):
+  def chain(self, records, sparse, size):
+    # holes of the FREE records linked from offset 16, as read back
+    records.flush(sparse)
+    return poemods_free.fromchain(sparse, size, 16).holes()
+
+  def test_holes_past_4gib_are_split(self):
+    size = 100 + (5 << 30)
+    records = poemods_free.freerecords(100, 16)
+    records.grow(size)
+    records.release(100, size - 100)
+    holes = records.holes()
+    self.assertEqual(holes[0][0], 100)
+    self.assertEqual(len(holes), 2)
+    for (start, length), (following, unused) in zip(holes, holes[1:] + [(size, 0)]) :
+      self.assertLess(length, 1 << 32)
+      self.assertGreaterEqual(length, records.minimum)
+      self.assertEqual(start + length, following)
+    self.assertEqual(self.chain(records, sparsefile(), size), holes)
+    # the last piece is never shorter than a record header
+    records = poemods_free.freerecords(0, 16)
+    records.grow(records.largest + 10)
+    records.release(0, records.largest + 10)
+    self.assertEqual(records.holes(), [(0, records.largest - 6), (records.largest - 6, 16)])
+
+  def test_released_records_merge(self):
+    sparse = sparsefile()
+    records = poemods_free.freerecords(1000, 16)
+    records.release(100, 50)
+    records.release(200, 50)
+    self.assertEqual(self.chain(records, sparse, 1000), [(100, 50), (200, 50)])
+    # between both : one record, the two others are unlinked
+    records.release(150, 50)
+    self.assertEqual(self.chain(records, sparse, 1000), [(100, 150)])
+    # too small for a record
+    records.release(300, 15)
+    self.assertEqual(records.holes(), [(100, 150)])
+    # up to the end of the ggpk
+    records.release(900, 100)
+    self.assertEqual(self.chain(records, sparse, 1000), [(100, 150), (900, 100)])
+
+  def test_chain_is_rewritten_by_allocations(self):
+    sparse = sparsefile()
+    chain = [(500, 64), (100, 40), (300, 200), (700, 30)]
+    for i, (start, length) in enumerate(chain) :
+      following = 0
+      if i + 1 < len(chain) :
+        following = chain[i+1][0]
+      sparse.seek(start)
+      sparse.write(struct.pack("<I4sQ", length, b"FREE", following))
+    sparse.seek(16)
+    sparse.write(struct.pack("<Q", 500))
+    records = poemods_free.fromchain(sparse, 1000, 16)
+    self.assertEqual(records.holes(), sorted(chain))
+    self.assertEqual(records.writes, [])
+    # the smallest record that fits, the one in the middle of the chain
+    self.assertEqual(records.allocate(40), 100)
+    # what is left is a record or nothing : 14 bytes would be left of the record at 500
+    self.assertEqual(records.allocate(50), 300)
+    self.assertEqual(records.allocate(48), 500)
+    self.assertEqual(records.allocate(30), 700)
+    self.assertEqual(self.chain(records, sparse, 1000), [(350, 150), (548, 16)])
+    # nothing fits : the ggpk grows
+    self.assertEqual(records.allocate(300), 1000)
+    self.assertEqual(records.size, 1300)
+    self.assertEqual(records.allocate(150), 350)
+    self.assertEqual(self.chain(records, sparse, 1300), [(548, 16)])
+
+  def test_chain_read_from_a_ggpk(self):
+    data = bytearray(200)
+    struct.pack_into("<Q", data, 16, 120)
+    struct.pack_into("<I4sQ", data, 120, 40, b"FREE", 40)
+    struct.pack_into("<I4sQ", data, 40, 24, b"FREE", 0)
+    records = poemods_free.fromchain(poemods_reader.bufferreader(bytes(data)), 200, 16)
+    self.assertEqual(records.holes(), [(40, 24), (120, 40)])
+    ggpk = io.BytesIO(bytes(data))
+    records.release(64, 56)
+    records.flush(ggpk)
+    self.assertEqual(poemods_free.fromchain(poemods_reader.bufferreader(ggpk.getvalue()), 200, 16).holes(), [(40, 120)])
+
+class savedtest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def test_saved_free_space_reads_back(self):
+    bundles = {"./Bundles2/a.bundle.bin" : (1000, 900, [(0, 50), (1 << 40, 7)]), "./Bundles2/b.bundle.bin" : (10, 10, [])}
+    poemods_cache.savefree("free.bin", "key", bundles)
+    loaded = poemods_cache.loadfree("free.bin", "key")
+    self.assertEqual({name : (size, end, list(holes)) for name, (size, end, holes) in loaded.items()}, bundles)
+    self.assertIsNone(poemods_cache.loadfree("free.bin", "other key"))
+    self.assertIsNone(poemods_cache.loadfree("missing.bin", "key"))
+
+  def test_free_space_is_kept_between_sessions(self):
+    ggpkbuilder.build("Content.ggpk")
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    bundlename = "./Bundles2/Folder/b0.bundle.bin"
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      # the file moves to the end of the bundle, its range is a hole
+      modg.writebinarydata("./Metadata/B0/file_6.mat", modg.generateheader("./Metadata/B0/file_6.mat", bytes(100000)), ggpk)
+      modg.updateindexbundle(ggpk)
+    holes = modg.freespaces[bundlename].holes()
+    self.assertGreater(len(holes), 0)
+    fromflist = poemods_free.fromflist
+    def notcalled(flist, size):
+      self.fail("free space rebuilt from the files")
+    poemods_free.fromflist = notcalled
+    try :
+      modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+      self.assertEqual(modg.freespaces[bundlename].holes(), holes)
+      with ggpkbuilder.quiet() :
+        modg.preparebundle(bundlename)
+    finally :
+      poemods_free.fromflist = fromflist
+    self.assertIs(modg.fullfilelistdic[bundlename]["free"], modg.freespaces[bundlename])
+
+if __name__ == "__main__" :
+  unittest.main()
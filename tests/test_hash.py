@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import unittest
+import contextlib
+import io
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+
+class hashtest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    ggpkbuilder.build("Content.ggpk")
+    self.modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    self.ggpkhash = self.modg.ggpkhash
+    self.samples = 0
+    getsamplehash = self.modg.getsamplehash
+    def countsamples():
+      self.samples += 1
+      return getsamplehash()
+    self.modg.getsamplehash = countsamples
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def samehash(self):
+    with contextlib.redirect_stdout(io.StringIO()) :
+      return self.modg.samehash(self.ggpkhash)
+
+  def write(self, position, data):
+    with open("Content.ggpk", "r+b") as ggpk :
+      ggpk.seek(position)
+      ggpk.write(data)
+
+  def test_untouched_ggpk_is_not_read(self):
+    self.assertEqual(len(self.ggpkhash.split("/")), 3)
+    self.assertTrue(self.samehash())
+    # saveinfo after an action keeps the layers of the session
+    self.modg.gethash()
+    self.modg.gethash()
+    self.assertEqual(self.modg.ggpkhash, self.ggpkhash)
+    self.assertEqual(self.samples, 0)
+
+  def test_touched_ggpk_is_compared_by_content(self):
+    st = os.stat("Content.ggpk")
+    os.utime("Content.ggpk", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    self.assertTrue(self.samehash())
+    self.assertEqual(self.samples, 1)
+    self.assertNotEqual(self.modg.ggpkhash, self.ggpkhash)
+
+  def test_changed_content_is_found_by_the_samples(self):
+    fileinfo = self.modg.fullfilelistdic["./Bundles2/Folder/b1.bundle.bin"]
+    self.write(fileinfo["position"] + fileinfo["length"] - 10, b'changed')
+    self.assertFalse(self.samehash())
+    self.assertEqual(self.samples, 1)
+
+  def test_changed_records_are_found_without_the_samples(self):
+    fileinfo = self.modg.fullfilelistdic["./"]
+    # digest of the root directory
+    self.write(fileinfo["position"] + 16, bytes(32))
+    self.assertFalse(self.samehash())
+    self.assertEqual(self.samples, 0)
+
+  def test_moved_index_changes_the_records_layer(self):
+    indexposition = self.modg.fullfilelistdic["./Bundles2/_.index.bin"]["position"]
+    layers = self.ggpkhash.split("/")
+    self.assertTrue(layers[1].startswith("%d:" % (indexposition)))
+    self.write(indexposition + 12, bytes(32))
+    self.assertFalse(self.samehash())
+    self.assertEqual(self.samples, 0)
+
+if __name__ == "__main__" :
+  unittest.main()
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+import os
+import io
+import struct
+import random
+import tempfile
+import unittest
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+import poemods_index
+
+def filerecords(count, seed=1):
+  # [hash, bundle, offset, size] of count file records, hashes unique and unordered
+  rnd = random.Random(seed)
+  hashes = list({rnd.getrandbits(64) | 1 : 0 for i in range(count)})
+  return [[hashf, rnd.randrange(5), rnd.randrange(1 << 32), rnd.randrange(1 << 20)] for hashf in hashes]
+
+class nonumpy(object):
+  # poemods_index as without numpy installed
+  def __enter__(self):
+    self.numpy = poemods_index.numpy
+    poemods_index.numpy = None
+
+  def __exit__(self, *args):
+    poemods_index.numpy = self.numpy
+
+class indextest(unittest.TestCase):
+  def parse(self, rows, start=7):
+    buffer = bytes(start) + b''.join([struct.pack("<QIII", *row) for row in rows]) + bytes(3)
+    return poemods_index.records(buffer, start, len(rows), poemods_index.filerecordfields)
+
+  def check(self, rows):
+    files = self.parse(rows)
+    self.assertEqual(len(files), len(rows))
+    for i, name in enumerate(["hash", "bundle", "offset", "size"]) :
+      self.assertEqual(files.values(name), [row[i] for row in rows])
+    self.assertEqual(files.position(3), 7 + 3 * poemods_index.recordsize)
+    groups = {}
+    for row, record in enumerate(rows) :
+      groups.setdefault(record[1], []).append(row)
+    self.assertEqual(dict(files.group("bundle")), groups)
+    self.assertEqual([key for key, rows in files.group("bundle")], sorted(groups))
+    lookup = files.lookup("hash")
+    self.assertEqual(lookup.find(0), -1)
+    if len(rows) == 0 :
+      self.assertEqual(lookup.findall([0]), [-1])
+      return
+    for row in range(0, len(rows), 17) :
+      self.assertEqual(lookup.find(rows[row][0]), row)
+    self.assertEqual(lookup.find(0), -1)
+    keys = [rows[5][0], 0, rows[0][0], rows[-1][0]]
+    self.assertEqual(lookup.findall(keys), [5, -1, 0, len(rows) - 1])
+
+  @unittest.skipIf(poemods_index.numpy is None, "numpy is not installed")
+  def test_records_with_numpy(self):
+    self.check(filerecords(1000))
+
+  def test_records_without_numpy(self):
+    with nonumpy() :
+      self.check(filerecords(1000))
+      self.check([])
+
+  def test_index_model_is_the_same_without_numpy(self):
+    bundles = [["Folder/b0", 100], ["Folder/b1", 200]]
+    paths = [["Metadata/B%d/f%d.mat" % (i % 2, i), i % 2, i * 10, 10] for i in range(50)]
+    buffer = ggpkbuilder.index(bundles, paths)
+    withnumpy = poemods_index.indexmodel("key", buffer)
+    columns = {name : withnumpy.files.values(name) for name in ["hash", "bundle", "offset", "size"]}
+    pathrepsizes = withnumpy.pathreps.values("size")
+    with nonumpy() :
+      without = poemods_index.indexmodel("key", buffer)
+      self.assertEqual(without.bundlenames, ["Folder/b0", "Folder/b1"])
+      self.assertEqual(without.bundlesizes, [100, 200])
+      self.assertEqual(without.groups(), withnumpy.groups())
+      self.assertEqual(without.groups(), {0 : list(range(0, 50, 2)), 1 : list(range(1, 50, 2))})
+      self.assertEqual(without.lookup().find(ggpkbuilder.fnv1a(paths[7][0])), 7)
+      for name in columns :
+        self.assertEqual(without.files.values(name), columns[name])
+      self.assertEqual(without.pathreps.values("size"), pathrepsizes)
+    self.assertEqual(without.writable().getvalue(), withnumpy.writable().getvalue())
+
+def commands(*commands):
+  # path-rep payload : 0 switches phase, [n, fragment] is n followed by the NUL terminated fragment
+  payload = b''
+  for command in commands :
+    if command == 0 :
+      payload += struct.pack("<I", 0)
+    else :
+      payload += struct.pack("<I", command[0]) + command[1].encode("latin-1") + b'\x00'
+  return payload
+
+class pathreptest(unittest.TestCase):
+  def test_fragments_are_added_to_their_base(self):
+    payload = commands(0, [1, "Art/"], [1, "Textures/"], 0, [2, "a.dds"], [1, "b.mat"], [3, "x"], 0, [1, "Meta/"], 0, [1, "c"], [1, "\xe9"])
+    self.assertEqual(list(poemods_index.decodepathrep(payload, 0, len(payload))), ["Art/Textures/a.dds", "Art/b.mat", "x", "Meta/c", "Meta/\xe9"])
+
+  def test_records_are_decoded_apart(self):
+    first = commands(0, [1, "Art/"], 0, [1, "a"], [1, "b"])
+    second = commands([1, "loose"])
+    payload = first + second + struct.pack("<I", 1) + b'end'
+    self.assertEqual(list(poemods_index.decodepathrep(payload, 0, len(first))), ["Art/a", "Art/b"])
+    # a record starts without bases, the last fragment may end without its NUL
+    self.assertEqual(list(poemods_index.decodepathrep(payload, len(first), len(payload) - len(first))), ["loose", "end"])
+
+  def test_paths_come_with_their_hashes_by_batches(self):
+    paths = ["Metadata/B%d/f%d.mat" % (i % 3, i) for i in range(10)]
+    payload = b''.join([commands([1, path]) for path in paths])
+    buffer = struct.pack("<QIII", 1, 0, len(payload), len(payload))
+    pathreps = poemods_index.records(buffer, 0, 1, poemods_index.pathrepfields)
+    decoded = poemods_index.indexpaths(payload, pathreps, 4)
+    self.assertEqual(next(decoded), (paths[0], ggpkbuilder.fnv1a(paths[0])))
+    self.assertEqual(list(decoded), [(path, ggpkbuilder.fnv1a(path)) for path in paths[1:]])
+
+class fnvtest(unittest.TestCase):
+  def paths(self):
+    rnd = random.Random(3)
+    letters = "abcXYZ_/.0129é"
+    paths = ["", "a", "Metadata/Effects/Spells/x.ao", "ART/Textures/Interface/2D/2DArt_UIImages_InGame_4K.dds"]
+    paths += ["".join([rnd.choice(letters) for j in range(rnd.randrange(1, 120))]) for i in range(500)]
+    return paths
+
+  def test_batch_hashes_are_the_single_ones(self):
+    paths = self.paths()
+    expected = [ggpkbuilder.fnv1a(path) for path in paths]
+    self.assertEqual(poemods_index.fnv1abatch(paths), expected)
+    self.assertEqual([poemods_index.fnv1a(path) for path in paths], expected)
+    with nonumpy() :
+      self.assertEqual(poemods_index.fnv1abatch(paths), expected)
+    self.assertEqual(poemods_index.fnv1abatch([]), [])
+
+  def test_paths_outside_latin1_fall_back(self):
+    paths = ["Metadata/ok.dat", "Metadata/\u4e2d\u6587.dat"]
+    self.assertEqual(poemods_index.fnv1abatch(paths), [ggpkbuilder.fnv1a(path) for path in paths])
+
+class ggpktest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    self.contents = ggpkbuilder.build("Content.ggpk")
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+class scantest(ggpktest):
+  def scan(self, modg, forcerescan):
+    # number of times _.index.bin is decompressed, the path-rep payload bundle not counted
+    extracted = []
+    extractbundle = modg.extractbundle
+    def counted(ggpk, absoluteposition):
+      if isinstance(ggpk, io.BytesIO) is False :
+        extracted.append(absoluteposition)
+      return extractbundle(ggpk, absoluteposition)
+    modg.extractbundle = counted
+    with ggpkbuilder.quiet() :
+      modg.rescanggpk("Content.ggpk", forcerescan, True)
+    del modg.extractbundle
+    return len(extracted)
+
+  def test_index_is_decompressed_once_per_scan(self):
+    modg = poemods_ggpk.listggpkfiles()
+    self.assertEqual(self.scan(modg, True), 1)
+    index = modg.indexmodel
+    self.assertEqual(len(index.files), 180)
+    with open("Content.ggpk", "rb") as ggpk :
+      self.assertIs(modg.getindexmodel(ggpk), index)
+    # the index record did not change : the same model is used again
+    self.assertEqual(self.scan(modg, True), 0)
+    self.assertIs(modg.indexmodel, index)
+    self.assertEqual(self.scan(poemods_ggpk.listggpkfiles(), False), 1)
+
+  def test_written_index_is_parsed_again(self):
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    index = modg.indexmodel
+    filename = "./Metadata/B0/file_4.dds"
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      modg.writebinarydata(filename, b'DDS new', ggpk)
+      modg.updateindexbundle(ggpk)
+      self.assertIsNot(modg.getindexmodel(ggpk), index)
+    row = modg.indexmodel.lookup().find(ggpkbuilder.fnv1a(filename[2:]))
+    self.assertEqual(modg.indexmodel.files.values("size")[row], 7)
+
+class pathscachetest(ggpktest):
+  def scan(self, forcerescan):
+    # scanned table and number of path-rep records decoded
+    decoded = []
+    decodepathrep = poemods_index.decodepathrep
+    def counted(payload, offset, size):
+      decoded.append(offset)
+      return decodepathrep(payload, offset, size)
+    poemods_index.decodepathrep = counted
+    try :
+      modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk", forcerescan)
+    finally :
+      poemods_index.decodepathrep = decodepathrep
+    return modg, len(decoded)
+
+  def test_paths_are_kept_across_ggpk_changes(self):
+    modg, decoded = self.scan(True)
+    self.assertEqual(decoded, 1)
+    self.assertTrue(os.path.exists(modg.indexpathsname))
+    # an other record changed, not the index
+    with open("Content.ggpk", "ab") as ggpk :
+      ggpk.write(bytes(100))
+    modg, decoded = self.scan(False)
+    self.assertEqual(decoded, 0)
+    self.assertEqual(len([filename for filename in modg.fullfilelist if "bundlename" in modg.fullfilelistdic[filename]]), 180)
+    # our own writes move files inside bundles and rewrite the index, its paths stay the same
+    filename = "./Metadata/B2/file_9.mat"
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      modg.writebinarydata(filename, b'moved', ggpk)
+      modg.updateindexbundle(ggpk)
+    modg, decoded = self.scan(True)
+    self.assertEqual(decoded, 0)
+    self.assertEqual(ggpkbuilder.read(modg, "Content.ggpk", filename), b'moved')
+
+  def test_other_paths_are_decoded(self):
+    modg, decoded = self.scan(True)
+    ggpkbuilder.build("Content.ggpk", nfiles=50)
+    modg, decoded = self.scan(False)
+    self.assertEqual(decoded, 1)
+    self.assertNotIn("./Metadata/B0/file_55.dds", modg.fullfilelistdic)
+    self.assertIn("./Metadata/B0/file_49.dds", modg.fullfilelistdic)
+
+  def test_broken_paths_are_decoded(self):
+    modg, decoded = self.scan(True)
+    with open(modg.indexpathsname, "r+b") as fout :
+      # path count
+      fout.seek(8)
+      fout.write(bytes(8))
+    modg, decoded = self.scan(True)
+    self.assertEqual(decoded, 1)
+    self.assertIn("./Metadata/B0/file_55.dds", modg.fullfilelistdic)
+
+if __name__ == "__main__" :
+  unittest.main()
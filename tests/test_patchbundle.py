@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+import os
+import random
+import tempfile
+import unittest
+import contextlib
+import io
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+import poemods_blocks
+
+def blocks(seed, count, size=0x40000):
+  # blocks of text, noise, repeated noise, small alphabets and UTF-16 text
+  rnd = random.Random(seed)
+  words = [b"BlendMode", b"Opaque", b"version", b"texture", b"\r\n", b"Metadata/", b"0.5", b" ", b"\x00"]
+  result = []
+  for i in range(count) :
+    kind = i % 5
+    if kind == 0 :
+      block = b''.join([rnd.choice(words) for j in range(size // 4)])
+    elif kind == 1 :
+      block = rnd.randbytes(size)
+    elif kind == 2 :
+      block = rnd.randbytes(rnd.randint(1, 3000)) * (size // 1000)
+    elif kind == 3 :
+      block = bytes([rnd.choice(b"ab\x00") for j in range(size)])
+    else :
+      block = "".join([rnd.choice(["version %d\r\n" % rnd.randint(0, 99), "Blend ", "é"]) for j in range(size // 8)]).encode("UTF-16-LE")
+    result.append(block[:size])
+  return result
+
+@unittest.skipIf(poemods_ggpk.nativecompress is False, "libooz without Ooz_Compress")
+class compresstest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def test_blocks_decompress_to_themselves(self):
+    with contextlib.redirect_stdout(io.StringIO()) :
+      for block in blocks(1, 150) :
+        compressed = poemods_ggpk.compressooz(bytearray(block), 4)
+        self.assertLessEqual(len(compressed), len(block) + 2)
+        self.assertEqual(poemods_ggpk.decompressooz(bytes(compressed), len(block)), block)
+
+  def test_level_0_stores_blocks(self):
+    block = blocks(3, 1)[0]
+    self.assertEqual(bytes(poemods_ggpk.compressooz(bytearray(block), 0)), b'\xcc\x06' + block)
+
+  def test_patched_bundles_read_back(self):
+    contents = ggpkbuilder.build("Content.ggpk")
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    names = sorted([filename for filename in contents if filename.endswith(".mat")])
+    data = blocks(1, 150)
+    with open("Content.ggpk", "r+b") as ggpk, contextlib.redirect_stdout(io.StringIO()) :
+      for i, block in enumerate(data) :
+        filename = names[i % len(names)]
+        modg.writebinarydata(filename, modg.generateheader(filename, block), ggpk)
+        contents[filename] = block
+      modg.updateindexbundle(ggpk)
+    for modg in [modg, ggpkbuilder.scan(poemods_ggpk, "Content.ggpk", True)] :
+      for filename in contents :
+        self.assertEqual(ggpkbuilder.read(modg, "Content.ggpk", filename), contents[filename], filename)
+
+class countingfile(object):
+  # file object counting the bytes written through it
+  def __init__(self, fileobject):
+    self.fileobject = fileobject
+    self.written = 0
+
+  def write(self, data):
+    self.written += len(data)
+    return self.fileobject.write(data)
+
+  def __getattr__(self, name):
+    return getattr(self.fileobject, name)
+
+class writtentest(unittest.TestCase):
+  # bytes written to the ggpk for a small edit of a bundle of 4KB blocks
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    self.contents = ggpkbuilder.build("Content.ggpk", blocksize=0x1000)
+    self.modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    self.bundlename = "./Bundles2/Folder/b1.bundle.bin"
+    bundleinfo = self.modg.fullfilelistdic[self.bundlename]
+    self.headerlength = 46 + len(bundleinfo["name"]) * 2
+    self.table = poemods_blocks.blocktable(ggpkbuilder.read(self.modg, "Content.ggpk", self.bundlename))
+    self.bundlelength = bundleinfo["length"]
+    # files of the bundle by offset
+    self.filenames = sorted([filename for filename in self.contents if filename.startswith("./Metadata/B1/")], key=lambda filename : self.modg.fullfilelistdic[filename]["position"])
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def edit(self, filename):
+    # same size edit of filename, the number of bytes written
+    data = bytes(reversed(self.contents[filename]))
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      counted = countingfile(ggpk)
+      self.modg.writebinarydata(filename, self.modg.generateheader(filename, data), counted)
+    self.contents[filename] = data
+    return counted.written
+
+  def check(self):
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      self.modg.updateindexbundle(ggpk)
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk", True)
+    for filename in self.contents :
+      self.assertEqual(ggpkbuilder.read(modg, "Content.ggpk", filename), self.contents[filename], filename)
+
+  def test_stored_blocks_are_written_alone(self):
+    self.modg.setcompresslevel(0)
+    filename = self.filenames[len(self.filenames) // 2]
+    self.assertGreater(self.table.blockcount, 20)
+    written = self.edit(filename)
+    # record header, bundle header and block table, the blocks holding the file, a free record
+    fileinfo = self.modg.fullfilelistdic[filename]
+    blocks = len(self.table.blocks(fileinfo["position"], fileinfo["position"] + fileinfo["length"]))
+    self.assertLessEqual(written, self.headerlength + self.table.offsets[0] + blocks * (0x1000 + 2) + 64)
+    self.assertLess(written, self.bundlelength // 4)
+    self.check()
+
+  @unittest.skipIf(poemods_ggpk.nativecompress is False, "libooz without Ooz_Compress")
+  def test_only_the_tail_moves(self):
+    self.modg.setcompresslevel(4)
+    filename = self.filenames[len(self.filenames) * 3 // 4]
+    fileinfo = self.modg.fullfilelistdic[filename]
+    first = self.table.blocks(fileinfo["position"], fileinfo["position"] + fileinfo["length"])[0]
+    written = self.edit(filename)
+    # the blocks compressed again are smaller, the ones after them move
+    self.assertLessEqual(written, self.headerlength + self.table.offsets[0] + self.table.offsets[-1] - self.table.offsets[first] + 64)
+    self.assertLess(written, self.bundlelength // 2)
+    self.check()
+
+if __name__ == "__main__" :
+  unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+import os
+import re
+import struct
+import tempfile
+import unittest
+import contextlib
+import io
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+import poemods_reader
+
+class rescantest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def test_moved_grandchild_is_found(self):
+    # b1.bundle.bin is copied to the end of the ggpk and the table of Folder is written in place :
+    # the digests of Folder, Bundles2 and the root are the same as before
+    contents = ggpkbuilder.build("Content.ggpk")
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    bundlename = "./Bundles2/Folder/b1.bundle.bin"
+    position = modg.fullfilelistdic[bundlename]["position"]
+    length = modg.fullfilelistdic[bundlename]["length"]
+    referenceposition = modg.fullfilelistdic[bundlename]["referenceposition"]
+    folderdigest = modg.fullfilelistdic["./Bundles2/Folder/"]["digest"]
+    with open("Content.ggpk", "r+b") as ggpk :
+      ggpk.seek(position)
+      record = ggpk.read(length)
+      newposition = ggpk.seek(0, os.SEEK_END)
+      ggpk.write(record)
+      ggpk.seek(referenceposition)
+      ggpk.write(struct.pack("<Q", newposition))
+      # the old record is not a valid record anymore
+      ggpk.seek(position)
+      ggpk.write(bytes(length))
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    self.assertEqual(modg.fullfilelistdic["./Bundles2/Folder/"]["digest"], folderdigest)
+    self.assertEqual(modg.fullfilelistdic[bundlename]["position"], newposition)
+    self.assertEqual(modg.fullfilelistdic[bundlename]["referenceposition"], referenceposition)
+    for filename in contents :
+      self.assertEqual(ggpkbuilder.read(modg, "Content.ggpk", filename), contents[filename], filename)
+
+  def test_unchanged_directories_are_reused(self):
+    contents = ggpkbuilder.build("Content.ggpk")
+    ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    with open("Content.ggpk", "ab") as ggpk :
+      ggpk.write(bytes(16))
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    self.assertEqual(modg.reusedcount[0], 1)
+    for filename in contents :
+      self.assertEqual(ggpkbuilder.read(modg, "Content.ggpk", filename), contents[filename], filename)
+
+  def scanstatistics(self, modg):
+    # records, bytes read, reads, seeks and reads from the mapping printed by the scan
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output) :
+      modg.rescanggpk("Content.ggpk", True, True)
+    return [int(value) for value in re.search(r"(\d+) records, (\d+) bytes read in (\d+) reads, (\d+) seeks, (\d+) reads from the mapping", output.getvalue()).groups()]
+
+  def test_scan_statistics_count_mapped_reads_apart(self):
+    ggpkbuilder.build("Content.ggpk")
+    modg = poemods_ggpk.listggpkfiles()
+    records, bytesread, reads, seeks, mappedreads = self.scanstatistics(modg)
+    self.assertTrue(modg.reader.ismapped(modg.ggpksize))
+    self.assertEqual(records, 9)
+    self.assertEqual([bytesread, reads, seeks], [0, 0, 0])
+    self.assertGreaterEqual(mappedreads, records)
+
+  def test_unmapped_scan_coalesces_reads(self):
+    contents = ggpkbuilder.build("Content.ggpk")
+    mapped = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk", True)
+    modg = unmapped()
+    records, bytesread, reads, seeks, mappedreads = self.scanstatistics(modg)
+    self.assertFalse(modg.reader.ismapped(1))
+    self.assertEqual(records, 9)
+    self.assertEqual(mappedreads, 0)
+    # records close to each other come from the same read, the data of the files is not read
+    self.assertGreater(reads, 0)
+    self.assertLess(reads, records)
+    self.assertLessEqual(seeks, reads)
+    self.assertLess(bytesread, modg.ggpksize)
+    self.assertEqual(list(modg.fullfilelist), list(mapped.fullfilelist))
+    for filename in mapped.fullfilelist :
+      self.assertEqual(modg.fullfilelistdic[filename].__copy__(), mapped.fullfilelistdic[filename].__copy__())
+    for filename in contents :
+      self.assertEqual(ggpkbuilder.read(modg, "Content.ggpk", filename), contents[filename], filename)
+
+  def test_records_far_apart_are_read_alone(self):
+    data = bytes(range(256)) * 2048
+    with open("data", "wb") as fout :
+      fout.write(data)
+    with open("data", "rb") as fin :
+      reader = poemods_ggpk.recordreader(poemods_reader.filereader(fin, False), len(data))
+      reader.plan(100, [(1000, "")])
+      self.assertEqual(bytes(reader.read(100, 8)), data[100:108])
+      # within readahead : no new read
+      reader.plan(1000, [])
+      self.assertEqual(bytes(reader.read(1000, 4)), data[1000:1004])
+      self.assertEqual([reader.reads, reader.seeks], [1, 1])
+      # too far : one read of headerahead bytes for the whole header
+      reader.plan(400000, [])
+      self.assertEqual(reader.unpack("<II", 400000, 8), struct.unpack("<II", data[400000:400008]))
+      self.assertEqual(bytes(reader.read(400000, 300)), data[400000:400300])
+      self.assertEqual([reader.reads, reader.seeks, reader.mappedreads], [2, 2, 0])
+      self.assertEqual(reader.bytesread, reader.readahead + reader.headerahead)
+      reader.reader.close()
+
+class unmapped(poemods_ggpk.listggpkfiles):
+  # the ggpk is read with pread as when it cannot be mapped
+  def openreader(self):
+    self.closereader()
+    self.ggpkfile = open(self.ggpkname, "rb")
+    self.reader = poemods_reader.filereader(self.ggpkfile, False)
+
+if __name__ == "__main__" :
+  unittest.main()
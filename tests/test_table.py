@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import unittest
+import ggpkbuilder
+import poemods_cache
+import poemods_table
+
+class tabletest(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def fill(self, table, count):
+    table["./Bundles2/b.bundle.bin"] = {"position" : 10, "length" : 20, "path" : "./Bundles2/", "name" : "b.bundle.bin", "referenceposition" : 4, "digest" : b'\x01' * 32}
+    for i in range(count) :
+      path = "./Metadata/Dir%d/" % (i % 7)
+      name = "File_%d.dat" % (count - i)
+      table[path + name] = {"position" : i, "length" : 1, "path" : path, "name" : name, "referenceposition" : 0, "bundlename" : "./Bundles2/b.bundle.bin", "hash" : 1000 + i}
+
+  def test_rows_are_found_after_sort_and_attach(self):
+    table = poemods_table.filetable()
+    self.fill(table, 500)
+    table.sort()
+    names = list(table)
+    self.assertEqual(names, sorted(names, key=poemods_cache.namekey))
+    cachename = os.path.join(self.tmp.name, "table.bin")
+    poemods_cache.savecache(cachename, "hash", -1, table)
+    cache = poemods_cache.loadcache(cachename)
+    self.assertTrue(table.attach(cache))
+    self.assertIsInstance(table.names, poemods_cache.cachednames)
+    for filename in names :
+      self.assertEqual(table.name(table.find(filename)), filename)
+    self.assertEqual(table["./Metadata/Dir3/File_490.dat"]["position"], 10)
+    self.assertEqual(table["./Metadata/Dir3/File_490.dat"]["bundlename"], "./Bundles2/b.bundle.bin")
+    self.assertEqual(table.findhash(1010), table.find("./Metadata/Dir3/File_490.dat"))
+    self.assertEqual(table["./Bundles2/b.bundle.bin"]["digest"], b'\x01' * 32)
+    self.assertNotIn("./Metadata/Dir3/File_491.dat", table)
+    # a lookup decodes the names it compares, not every name
+    decoded = []
+    name = cache.name
+    cache.name = lambda i : decoded.append(i) or name(i)
+    self.assertEqual(table["./Metadata/Dir1/File_100.dat"]["position"], 400)
+    self.assertLessEqual(len(decoded), 12)
+    cache.name = name
+    # a row added to a table read from the cache
+    table["./loose.txt"] = {"position" : 1, "length" : 2, "path" : "./", "name" : "loose.txt", "referenceposition" : 3}
+    self.assertEqual(table["./loose.txt"]["length"], 2)
+    self.assertEqual(table["./Metadata/Dir3/File_490.dat"]["position"], 10)
+    self.assertEqual(table["./Bundles2/b.bundle.bin"]["digest"], b'\x01' * 32)
+    cache.close()
+
+if __name__ == "__main__" :
+  unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+import os
+import queue
+import tempfile
+import threading
+import unittest
+import ggpkbuilder
+
+poemods_ggpk = ggpkbuilder.importggpk()
+import poemods_threads
+import poemods_batch
+
+class sharedlocktest(unittest.TestCase):
+  def test_readers_share_and_writer_waits(self):
+    lock = poemods_threads.sharedlock()
+    events = []
+    inside = threading.Barrier(3, timeout=10)
+    release = threading.Event()
+    def reader():
+      with lock.shared() :
+        inside.wait()
+        release.wait(10)
+        events.append("read")
+    def writer():
+      with lock.exclusive() :
+        events.append("write")
+    readers = [threading.Thread(target=reader) for i in range(2)]
+    for thread in readers :
+      thread.start()
+    # both readers hold the lock at once
+    inside.wait()
+    thread = threading.Thread(target=writer)
+    thread.start()
+    thread.join(0.2)
+    self.assertEqual(events, [])
+    release.set()
+    thread.join(10)
+    for reader in readers :
+      reader.join(10)
+    self.assertEqual(events, ["read", "read", "write"])
+
+class uppercase(object):
+  # mod module of the tests
+  def execute(self, filename, filedata, modg):
+    return bytes(filedata).upper(), None, None
+
+class workertest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    self.contents = ggpkbuilder.build("Content.ggpk")
+    self.modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    # only the workers are started
+    self.manager = poemods_threads.manager.__new__(poemods_threads.manager)
+    self.manager.modg = self.modg
+    self.manager.threadskeeprunning = True
+    self.manager.mylock = threading.Lock()
+    self.manager.readlock = poemods_threads.sharedlock()
+    self.manager.workqueue = queue.Queue()
+    for i in range(4) :
+      t = threading.Thread(target=self.manager.workerthread)
+      t.daemon = True
+      t.start()
+
+  def tearDown(self):
+    self.manager.threadskeeprunning = False
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def test_workers_read_side_by_side(self):
+    filenames = [filename for filename in self.contents if filename.startswith("./Metadata/B1/")]
+    # the first two reads only end once both started
+    together = threading.Barrier(2, timeout=10)
+    readbinarydata = self.modg.readbinarydata
+    def read(filename, ggpkpointer, limit=-1):
+      if filename in filenames[:2] :
+        together.wait()
+      return readbinarydata(filename, ggpkpointer, limit)
+    self.modg.readbinarydata = read
+    # the files are read from the ggpk, not from originals kept on disk
+    self.modg.isthemod = False
+    # a batch budget of one byte : every file is written while the other workers read
+    self.manager.batch = poemods_batch.writebatch(self.modg, 1)
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      for filename in filenames :
+        self.manager.workqueue.put([filename, uppercase(), ggpk])
+      self.manager.workqueue.join()
+      self.manager.batch.commit(ggpk)
+    self.assertFalse(together.broken)
+    del self.modg.readbinarydata
+    for filename in filenames :
+      self.assertEqual(ggpkbuilder.read(self.modg, "Content.ggpk", filename), self.contents[filename].upper(), filename)
+
+  def test_kept_original_is_stored_once(self):
+    bundlename = "./Bundles2/Folder/b1.bundle.bin"
+    # the original index is kept first, it tells where the files are in the kept bundle
+    self.modg.keeplist["./Bundles2/_.index.bin"] = "an older original"
+    with open("Content.ggpk", "rb") as ggpk, ggpkbuilder.quiet() :
+      self.modg.keptoriginal("./Bundles2/_.index.bin", ggpk)
+    self.modg.keeplist[bundlename] = "an older original"
+    stored = []
+    storefiletodisk = self.modg.storefiletodisk
+    def counted(filename, chunks):
+      stored.append(filename)
+      return storefiletodisk(filename, chunks)
+    self.modg.storefiletodisk = counted
+    filenames = [filename for filename in self.contents if filename.startswith("./Metadata/B1/")]
+    results = {}
+    def read(filename):
+      with open("Content.ggpk", "rb") as ggpk :
+        results[filename] = bytes(self.modg.readbinarydata(filename, ggpk))
+    threads = [threading.Thread(target=read, args=(filename, )) for filename in filenames]
+    with ggpkbuilder.quiet() :
+      for thread in threads :
+        thread.start()
+      for thread in threads :
+        thread.join(30)
+    self.assertEqual(stored, [bundlename])
+    for filename in filenames :
+      self.assertEqual(results[filename], self.contents[filename])
+
+class restoretest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tmp = tempfile.TemporaryDirectory()
+    os.chdir(self.tmp.name)
+    self.contents = ggpkbuilder.build("Content.ggpk")
+    self.modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk")
+    self.manager = poemods_threads.manager.__new__(poemods_threads.manager)
+    self.manager.modg = self.modg
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.tmp.cleanup()
+
+  def counted(self, name):
+    # calls of a method of modg
+    calls = []
+    method = getattr(self.modg, name)
+    def counted(*args):
+      calls.append(args)
+      return method(*args)
+    setattr(self.modg, name, counted)
+    return calls
+
+  def test_originals_are_written_back_together(self):
+    batch = poemods_batch.writebatch(self.modg)
+    for filename in ["./loose.txt", "./Metadata/B1/file_4.dds", "./Metadata/B1/file_8.ogg"] :
+      batch.add(filename, b'modified ' + self.contents[filename])
+    with open("Content.ggpk", "r+b") as ggpk, ggpkbuilder.quiet() :
+      batch.commit(ggpk)
+    bundlename = "./Bundles2/Folder/b1.bundle.bin"
+    self.assertIn(bundlename, self.modg.keeplist)
+    saveinfo = self.counted("saveinfo")
+    updateindexbundle = self.counted("updateindexbundle")
+    storefiletodisk = self.counted("storefiletodisk")
+    with ggpkbuilder.quiet() :
+      count = self.manager.restorefiles(["./Bundles2/_.index.bin", bundlename, "./loose.txt", "./Metadata/B1/file_4.dds"])
+    # the files inside bundles are restored with their bundle and the index
+    self.assertEqual(count, 3)
+    self.assertEqual(len(updateindexbundle), 1)
+    self.assertEqual(len(saveinfo), 1)
+    self.assertEqual(storefiletodisk, [])
+    modg = ggpkbuilder.scan(poemods_ggpk, "Content.ggpk", True)
+    for filename in self.contents :
+      self.assertEqual(ggpkbuilder.read(modg, "Content.ggpk", filename), self.contents[filename], filename)
+
+if __name__ == "__main__" :
+  unittest.main()